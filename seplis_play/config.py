@@ -107,13 +107,40 @@ class ConfigModel(BaseSettings):
     ffmpeg_segment_threshold_for_new_transcoder: int = 7
     ffmpeg_pause_threshold_seconds: int = 300
     ffmpeg_resume_threshold_seconds: int = 150
+    # Transcodes running at a time, software encodes default to half the CPUs.
+    # Copy jobs are only limited by the total by default.
+    ffmpeg_max_transcodes: int = 20
+    ffmpeg_max_software_transcodes: int | None = None
+    ffmpeg_max_hardware_transcodes: int = 8
+    ffmpeg_max_copy_transcodes: int | None = None
+    ffmpeg_transcode_queue_timeout: float = 10  # Seconds to wait for a free slot
+    ffmpeg_transcode_retry_after: int = 5  # Seconds, sent when no slot was free
+    # New software encodes use a faster preset, fewer threads and a lower
+    # resolution when the running encodes' average speed drops below this
+    ffmpeg_degrade_speed: float = 1.5
+    ffmpeg_degrade_load: float = 0.9  # Or the 1 minute load average per CPU above this
 
     extract_keyframes: bool = True
+    scan_workers: int | None = None  # Files scanned at a time, 2 x CPUs by default
+    scan_ffprobe_workers: int | None = None  # Defaults to the number of CPUs
+    scan_watch_workers: int | None = None  # Defaults to the number of CPUs
+    # Seconds a watched file's size and modified time must stay the same
+    # before it's scanned
+    scan_watch_stable_seconds: float = 3
+    index_batch_size: int = 500  # Entries per play server index update
+    index_batch_wait: float = 2.0  # Seconds to wait for more entries before sending
+    index_batch_retries: int = 3
+    series_not_found_ttl: int = 24 * 60 * 60  # Seconds before searching again
+    # Where the scan commands write their metrics, e.g. for the node exporter's
+    # textfile collector
+    scan_metrics_file: Path | None = None
 
     port: int = 8003
     transcode_folder: Path = Path(tempfile.gettempdir()) / 'seplis_play'
     thumbnails_path: Path | None = None
     session_timeout: int = 60  # Timeout for HLS sessions
+    metadata_cache_size: int = 1000
+    metadata_cache_ttl: int = 300  # Seconds
     server_id: str = ''
     api_url: AnyHttpUrl = AnyHttpUrl('https://api.seplis.net')
     logging: ConfigLoggingModel = ConfigLoggingModel()
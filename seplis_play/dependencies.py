@@ -1,30 +1,53 @@
+import hmac
+import time
+from typing import Annotated
+
 import jwt
-from fastapi import HTTPException
+from fastapi import Header, HTTPException
 from sqlalchemy import select
 
-from seplis_play import config, database, logger
+from seplis_play import config, database, logger, metrics
+from seplis_play.metadata_cache import episode_key, metadata_cache, movie_key
 from seplis_play.scanners.episode.episode_models import MEpisode
 from seplis_play.scanners.movie.movie_models import MMovie
 from seplis_play.schemas.page_id_schema import PlayId
 from seplis_play.schemas.source_metadata_schemas import SourceMetadata
+from seplis_play.utils.keyframes_utils import unpack_keyframes
+from seplis_play.utils.lru_cache_utils import LRUCache
+
+# Verified play ids, a session sends the same one with every segment request.
+play_ids: LRUCache[str, PlayId] = LRUCache(maxsize=1024)
 
 
 async def get_sources(play_id: str) -> list[SourceMetadata]:
     data = decode_play_id(play_id)
     if data.type == 'series':
-        query = select(MEpisode.meta_data).where(
+        key = episode_key(data.series_id, data.number)
+        query = select(MEpisode.summary, MEpisode.keyframes).where(
             MEpisode.series_id == data.series_id,
             MEpisode.number == data.number,
         )
     elif data.type == 'movie':
-        query = select(MMovie.meta_data).where(
+        key = movie_key(data.movie_id)
+        query = select(MMovie.summary, MMovie.keyframes).where(
             MMovie.movie_id == data.movie_id,
         )
     else:
         raise HTTPException(400, 'Play id type not supported')
-    async with database.session() as session:
-        r = await session.scalars(query)
-        return [d for d in r if d]
+
+    sources = metadata_cache.get(key)
+    metrics.metadata_cache_requests_total.inc('miss' if sources is None else 'hit')
+    if sources is None:
+        sources = []
+        async with database.session() as session:
+            for metadata, keyframes in await session.execute(query):
+                if not metadata:
+                    continue
+                if keyframes:
+                    metadata['keyframes'] = unpack_keyframes(keyframes)
+                sources.append(metadata)
+        metadata_cache.set(key, sources)
+    return sources
 
 
 async def get_metadata(play_id: str, source_index: int) -> SourceMetadata:
@@ -35,13 +58,31 @@ async def get_metadata(play_id: str, source_index: int) -> SourceMetadata:
 
 
 def decode_play_id(play_id: str) -> PlayId:
+    data = play_ids.get(play_id)
+    if data is not None:
+        if data.exp > time.time():
+            return data
+        play_ids.pop(play_id)
     try:
-        data = jwt.decode(
-            play_id,
-            config.secret,
-            algorithms=['HS256'],
+        data = PlayId.model_validate(
+            jwt.decode(
+                play_id,
+                config.secret,
+                algorithms=['HS256'],
+            )
         )
-        return PlayId.model_validate(data)
+        play_ids.set(play_id, data)
+        return data
     except jwt.PyJWTError as e:
         logger.error(f'Failed to decode play id: {e}')
         raise HTTPException(400, 'Play id invalid') from e
+
+
+def require_secret(authorization: Annotated[str | None, Header()] = None) -> None:
+    """
+    Only let the requests signed with the server secret through.
+    """
+    if not config.secret or not hmac.compare_digest(
+        (authorization or '').encode(), f'Secret {config.secret}'.encode()
+    ):
+        raise HTTPException(401, 'Invalid secret')
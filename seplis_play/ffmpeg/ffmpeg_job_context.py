@@ -67,6 +67,8 @@ class JobRegistryEntry:
     encoder: str | None = None
     progress: float = 0.0
     variants: int = 1  # Number of ABR variants
+    kind: str | None = None  # 'copy', 'hardware' or 'software'
+    speed: float = 0.0  # Encode speed relative to real time
 
     @property
     def elapsed_time(self) -> float:
@@ -85,11 +87,15 @@ class JobRegistry:
         self._jobs: dict[str, JobRegistryEntry] = {}
         self._lock = asyncio.Lock()
 
-    async def register(self, job_id: str, source: str) -> None:
+    async def register(self, job_id: str, source: str, kind: str | None = None) -> None:
         """Register a new job."""
         async with self._lock:
             self._jobs[job_id] = JobRegistryEntry(
-                job_id=job_id, source=source, status='queued', start_time=time.time()
+                job_id=job_id,
+                source=source,
+                status='queued',
+                start_time=time.time(),
+                kind=kind,
             )
 
     async def update_status(
@@ -109,6 +115,13 @@ class JobRegistry:
                 self._jobs[job_id].progress = progress
                 self._jobs[job_id].variants = variants
 
+    def update_progress(self, job_id: str, progress: float, speed: float) -> None:
+        """Non-async update from the FFmpeg progress callback."""
+        job = self._jobs.get(job_id)
+        if job:
+            job.progress = progress
+            job.speed = speed
+
     async def remove(self, job_id: str) -> None:
         """Remove a job from the registry."""
         async with self._lock:
@@ -132,6 +145,10 @@ class JobRegistry:
         """Non-async get of running jobs."""
         return [j for j in self._jobs.values() if j.status == 'running']
 
+    def get_queued_jobs(self) -> list[JobRegistryEntry]:
+        """Non-async get of queued jobs, oldest first."""
+        return [j for j in self._jobs.values() if j.status == 'queued']
+
     def get_total_variants(self) -> int:
         """Get total number of active encode streams (for NVENC limits)."""
         return sum(j.variants for j in self._jobs.values() if j.status == 'running')
@@ -16,7 +16,9 @@ from .routes import (
     health_routes,
     hls_routes,
     keep_alive_routes,
+    metrics_routes,
     request_media_routes,
+    sessions_routes,
     sources_routes,
     subtitle_file_routes,
     thumbnails_routes,
@@ -52,6 +54,8 @@ app.include_router(close_session_routes.router)
 app.include_router(download_source_routes.router)
 app.include_router(request_media_routes.router)
 app.include_router(hls_routes.router)
+app.include_router(sessions_routes.router)
+app.include_router(metrics_routes.router)
 
 
 def never_is_not_modified(
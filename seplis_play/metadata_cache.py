@@ -0,0 +1,30 @@
+from seplis_play import config
+from seplis_play.schemas.source_metadata_schemas import SourceMetadata
+from seplis_play.utils.lru_cache_utils import LRUCache
+
+# Parsed sources of a play target, e.g. ('series', series_id, number)
+# or ('movie', movie_id).
+# The scanners invalidate the entries they change. A scanner running in another
+# process can't do that so the entries also expire after `metadata_cache_ttl`.
+metadata_cache: LRUCache[tuple, list[SourceMetadata]] = LRUCache(
+    maxsize=config.metadata_cache_size,
+    ttl=config.metadata_cache_ttl,
+)
+
+
+def episode_key(series_id: int | None, number: int | None) -> tuple:
+    return ('series', series_id, number)
+
+
+def movie_key(movie_id: int | None) -> tuple:
+    return ('movie', movie_id)
+
+
+def invalidate_episode(series_id: int | None, number: int | None) -> None:
+    if series_id and number is not None:
+        metadata_cache.pop(episode_key(series_id, number))
+
+
+def invalidate_movie(movie_id: int | None) -> None:
+    if movie_id:
+        metadata_cache.pop(movie_key(movie_id))
@@ -0,0 +1,94 @@
+import os
+import tempfile
+from pathlib import Path
+
+from seplis_play.utils.metrics_utils import Counter, Histogram, MetricsRegistry
+
+# Served at /metrics, the scan commands write theirs to `scan_metrics_file`
+# since they run in their own process.
+registry = MetricsRegistry()
+
+segment_request_seconds = registry.register(
+    Histogram(
+        'seplis_play_segment_request_seconds',
+        'Time to serve a HLS media segment by how it was served',
+        labels=('source',),  # disk, waited, new_transcoder or failed
+    )
+)
+wait_for_segment_seconds = registry.register(
+    Histogram(
+        'seplis_play_wait_for_segment_seconds',
+        'Time spent waiting for the transcoder to write a segment',
+        labels=('result',),  # ready, closed or timeout
+    )
+)
+transcoder_start_seconds = registry.register(
+    Histogram(
+        'seplis_play_transcoder_start_seconds',
+        'Time from requesting a transcoder until ffmpeg produced output',
+        labels=('kind',),
+    )
+)
+transcodes_rejected_total = registry.register(
+    Counter(
+        'seplis_play_transcodes_rejected_total',
+        'Transcodes rejected because no slot was free',
+        labels=('kind',),
+    )
+)
+transcoder_restarts_total = registry.register(
+    Counter(
+        'seplis_play_transcoder_restarts_total',
+        'Transcoders replaced within a session, e.g. after seeking',
+    )
+)
+session_transcoder_restarts = registry.register(
+    Histogram(
+        'seplis_play_session_transcoder_restarts',
+        'Transcoder restarts per closed session',
+        buckets=(0, 1, 2, 3, 5, 10, 20, 50),
+    )
+)
+metadata_cache_requests_total = registry.register(
+    Counter(
+        'seplis_play_metadata_cache_requests_total',
+        'Source metadata lookups by cache result',
+        labels=('result',),  # hit or miss
+    )
+)
+source_bytes_total = registry.register(
+    Counter(
+        'seplis_play_source_bytes_total',
+        'Bytes of source files sent by /source',
+    )
+)
+scanned_files_total = registry.register(
+    Counter(
+        'seplis_play_scanned_files_total',
+        'Files scanned by result',
+        labels=('scanner', 'result'),  # ok or failed
+    )
+)
+ffprobe_seconds = registry.register(
+    Histogram(
+        'seplis_play_ffprobe_seconds',
+        'Duration of the ffprobe calls made by the scanners',
+    )
+)
+
+
+def write_metrics_file(path: Path) -> None:
+    """
+    Write the metrics for the node exporter's textfile collector.
+
+    The file is replaced atomically so it's never read half written.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(registry.render())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
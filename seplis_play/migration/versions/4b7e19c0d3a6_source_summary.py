@@ -0,0 +1,113 @@
+"""Source summary
+
+Revision ID: 4b7e19c0d3a6
+Revises: c5d2a8e41f07
+Create Date: 2026-10-17 11:02:18.734092
+
+"""
+
+from typing import Any
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '4b7e19c0d3a6'
+down_revision = 'c5d2a8e41f07'
+
+# The fields read when playing, as they were when this migration was written
+BASE_STREAM_KEYS = frozenset({'index', 'codec_name', 'codec_type', 'disposition', 'tags'})
+STREAM_KEYS = {
+    'video': BASE_STREAM_KEYS
+    | {
+        'width',
+        'height',
+        'pix_fmt',
+        'profile',
+        'level',
+        'tier',
+        'codec_tag_string',
+        'color_transfer',
+        'color_primaries',
+        'color_space',
+        'r_frame_rate',
+        'has_b_frames',
+        'side_data_list',
+    },
+    'audio': BASE_STREAM_KEYS
+    | {'channels', 'sample_rate', 'profile', 'bit_rate', 'group_index'},
+    'subtitle': BASE_STREAM_KEYS,
+}
+NESTED_KEYS = {
+    'tags': frozenset({'language', 'title'}),
+    'disposition': frozenset({'default', 'forced'}),
+}
+SIDE_DATA_KEYS = frozenset(
+    {
+        'side_data_type',
+        'dv_profile',
+        'rpu_present_flag',
+        'bl_present_flag',
+        'dv_bl_signal_compatibility_id',
+    }
+)
+FORMAT_KEYS = frozenset({'filename', 'format_name', 'duration', 'size', 'bit_rate'})
+
+
+def upgrade() -> None:
+    for table_name in ('episodes', 'movies'):
+        op.add_column(table_name, sa.Column('summary', sa.JSON, nullable=True))
+        fill_summary(table_name)
+
+
+def fill_summary(table_name: str) -> None:
+    table = sa.table(
+        table_name,
+        sa.column('path', sa.Text),
+        sa.column('metadata', sa.JSON),
+        sa.column('summary', sa.JSON),
+    )
+    conn = op.get_bind()
+    last_path = ''
+    while True:
+        rows = conn.execute(
+            sa.select(table.c.path, table.c.metadata)
+            .where(table.c.path > last_path)
+            .order_by(table.c.path)
+            .limit(500)
+        ).all()
+        if not rows:
+            break
+        last_path = rows[-1].path
+        for row in rows:
+            if not row.metadata:
+                continue
+            conn.execute(
+                sa.update(table)
+                .where(table.c.path == row.path)
+                .values({table.c.summary: get_summary(row.metadata)})
+            )
+
+
+def get_summary(metadata: dict[str, Any]) -> dict[str, Any]:
+    streams = []
+    for stream in metadata.get('streams') or []:
+        s = pick(stream, STREAM_KEYS.get(stream.get('codec_type', ''), BASE_STREAM_KEYS))
+        for key, nested_keys in NESTED_KEYS.items():
+            if key in s:
+                s[key] = pick(s[key], nested_keys)
+        if 'side_data_list' in s:
+            s['side_data_list'] = [pick(d, SIDE_DATA_KEYS) for d in s['side_data_list']]
+        streams.append(s)
+    return {
+        'streams': streams,
+        'format': pick(metadata.get('format') or {}, FORMAT_KEYS),
+    }
+
+
+def pick(data: dict[str, Any], keys: frozenset[str]) -> dict[str, Any]:
+    return {k: v for k, v in data.items() if k in keys}
+
+
+def downgrade() -> None:
+    pass
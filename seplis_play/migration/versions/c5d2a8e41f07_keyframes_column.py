@@ -0,0 +1,83 @@
+"""Keyframes column
+
+Revision ID: c5d2a8e41f07
+Revises: 1d2da7b8c14b
+Create Date: 2026-10-17 10:12:41.508213
+
+"""
+
+import struct
+from decimal import ROUND_HALF_UP, Decimal
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'c5d2a8e41f07'
+down_revision = '1d2da7b8c14b'
+
+
+def upgrade() -> None:
+    for table_name in ('episodes', 'movies'):
+        op.add_column(
+            table_name,
+            sa.Column('keyframes', sa.LargeBinary(2**24 - 1), nullable=True),
+        )
+        move_keyframes(table_name)
+
+
+def move_keyframes(table_name: str) -> None:
+    """
+    Move the keyframes out of the metadata into the packed keyframes column.
+    """
+    table = sa.table(
+        table_name,
+        sa.column('path', sa.Text),
+        sa.column('metadata', sa.JSON),
+        sa.column('keyframes', sa.LargeBinary),
+    )
+    conn = op.get_bind()
+    last_path = ''
+    while True:
+        rows = conn.execute(
+            sa.select(table.c.path, table.c.metadata)
+            .where(table.c.path > last_path)
+            .order_by(table.c.path)
+            .limit(500)
+        ).all()
+        if not rows:
+            break
+        last_path = rows[-1].path
+        for row in rows:
+            if not row.metadata or 'keyframes' not in row.metadata:
+                continue
+            metadata = dict(row.metadata)
+            keyframes = metadata.pop('keyframes') or []
+            conn.execute(
+                sa.update(table)
+                .where(table.c.path == row.path)
+                .values(
+                    {
+                        table.c.metadata: metadata,
+                        table.c.keyframes: pack_keyframes(keyframes)
+                        if keyframes
+                        else None,
+                    }
+                )
+            )
+
+
+def pack_keyframes(keyframes: list[str]) -> bytes:
+    """
+    The keyframe timestamps in seconds as sorted little endian int64
+    microseconds, kept here as they were when this migration was written.
+    """
+    microseconds = sorted(
+        int(Decimal(k).scaleb(6).to_integral_value(rounding=ROUND_HALF_UP))
+        for k in keyframes
+    )
+    return struct.pack(f'<{len(microseconds)}q', *microseconds)
+
+
+def downgrade() -> None:
+    pass
@@ -0,0 +1,35 @@
+"""Indexed episodes and movies
+
+Revision ID: e81f4c2d9a57
+Revises: 4b7e19c0d3a6
+Create Date: 2026-10-17 14:37:05.921846
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e81f4c2d9a57'
+down_revision = '4b7e19c0d3a6'
+
+
+def upgrade() -> None:
+    op.create_table(
+        'indexed_episodes',
+        sa.Column('server_id', sa.String(100), primary_key=True),
+        sa.Column('series_id', sa.Integer, primary_key=True),
+        sa.Column('episode_number', sa.Integer, primary_key=True),
+        sa.Column('created_at', sa.DateTime),
+    )
+    op.create_table(
+        'indexed_movies',
+        sa.Column('server_id', sa.String(100), primary_key=True),
+        sa.Column('movie_id', sa.Integer, primary_key=True),
+        sa.Column('created_at', sa.DateTime),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('indexed_episodes')
+    op.drop_table('indexed_movies')
@@ -8,6 +8,7 @@ from anyio import to_thread
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.responses import FileResponse, StreamingResponse
 
+from .. import metrics
 from ..dependencies import get_metadata
 from ..schemas.source_metadata_schemas import SourceMetadata
 
@@ -111,4 +112,6 @@ async def _send_bytes(path: str, start: int, end: int) -> AsyncGenerator[bytes]:
         f.seek(start)
         while (pos := f.tell()) <= end:
             read_size = min(FileResponse.chunk_size, end + 1 - pos)
-            yield await f.read(read_size)
+            data = await f.read(read_size)
+            metrics.source_bytes_total.inc(value=len(data))
+            yield data
@@ -1,13 +1,16 @@
+import hashlib
 import math
+import time
+from dataclasses import dataclass, fields
 from typing import Annotated
 from urllib.parse import urlencode
 
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import FileResponse
 
 from seplis_play import logger
 
-from .. import config
+from .. import config, metrics
 from ..dependencies import get_metadata
 from ..schemas.source_metadata_schemas import SourceMetadata
 from ..schemas.source_schemas import Source
@@ -19,10 +22,24 @@ from ..transcoding.base_transcoder import (
     sessions,
 )
 from ..transcoding.hls_transcoder import HlsTranscoder
+from ..transcoding.transcode_scheduler import TranscodeSlotsFull
+from ..utils.lru_cache_utils import LRUCache
 
 router = APIRouter()
 
 
+@dataclass
+class MediaPlaylist:
+    content: bytes
+    etag: str
+    # The cached sources are replaced when the scanner changes them,
+    # which makes the playlist stale.
+    metadata: SourceMetadata
+
+
+media_playlists: LRUCache[tuple, MediaPlaylist] = LRUCache(maxsize=256)
+
+
 @router.get('/hls/main.m3u8', name='Get HLS main playlist')
 async def get_main_playlist_route(
     settings: Annotated[TranscodeSettings, Depends()],
@@ -37,17 +54,49 @@ async def get_main_playlist_route(
 
 @router.get('/hls/media.m3u8', name='Get HLS media playlist')
 async def get_media_route(
+    request: Request,
     settings: Annotated[TranscodeSettings, Depends()],
-    metadata: Annotated[SourceMetadata, Depends(get_metadata)],
 ) -> Response:
+    key = media_playlist_key(settings)
     if await refresh_session_timeout(settings.session):
-        transcoder = HlsTranscoder(settings=settings, metadata=metadata)
+        metadata = await get_metadata(settings.play_id, settings.source_index)
+        playlist = media_playlists.get(key)
+        if playlist is None or playlist.metadata is not metadata:
+            transcoder = HlsTranscoder(settings=settings, metadata=metadata)
+            playlist = cache_media_playlist(key, transcoder)
     else:
         transcoder = await start_transcode(settings)
+        playlist = cache_media_playlist(key, transcoder)
+
+    headers = {'ETag': playlist.etag}
+    if playlist.etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
     return Response(
-        content=transcoder.generate_media_playlist(),
+        content=playlist.content,
         media_type='application/x-mpegURL',
+        headers=headers,
+    )
+
+
+def media_playlist_key(settings: TranscodeSettings) -> tuple:
+    values = []
+    for f in fields(settings):
+        if f.name in ('start_time', 'start_segment'):
+            continue
+        value = getattr(settings, f.name)
+        values.append((f.name, tuple(value) if isinstance(value, list) else value))
+    return tuple(values)
+
+
+def cache_media_playlist(key: tuple, transcoder: HlsTranscoder) -> MediaPlaylist:
+    content = transcoder.generate_media_playlist().encode()
+    playlist = MediaPlaylist(
+        content=content,
+        etag=f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"',
+        metadata=transcoder.metadata,
     )
+    media_playlists.set(key, playlist)
+    return playlist
 
 
 @router.get('/hls/subtitle.m3u8', name='Get HLS subtitle playlist')
@@ -79,49 +128,64 @@ async def get_media_segment_route(
     segment: int,
     settings: Annotated[TranscodeSettings, Depends()],
 ) -> FileResponse:
+    started = time.monotonic()
     await refresh_session_timeout(settings.session)
     if settings.session in sessions:
+        sessions[settings.session].playback_segment = segment
         folder: str | None = sessions[settings.session].transcode_folder
+        tracker = sessions[settings.session].segment_tracker
 
-        if folder is not None:
-            await manage_transcoder_pause(settings.session, folder, segment)
-            if await HlsTranscoder.is_segment_ready(folder, segment):
-                return FileResponse(HlsTranscoder.get_segment_path(folder, segment))
+        if folder is not None and tracker is not None:
+            await manage_transcoder_pause(settings.session, segment)
+            if not tracker.is_ready(segment):
+                await tracker.refresh()
+            if tracker.is_ready(segment):
+                return segment_response(folder, segment, 'disk', started)
 
-            (
-                first_transcoded_segment,
-                last_transcoded_segment,
-            ) = await HlsTranscoder.first_last_transcoded_segment(folder)
             upper_bound = (
-                last_transcoded_segment
-                + config.ffmpeg_segment_threshold_for_new_transcoder
+                tracker.last + config.ffmpeg_segment_threshold_for_new_transcoder
             )
-            if first_transcoded_segment <= segment <= upper_bound:
+            if tracker.first <= segment <= upper_bound:
                 logger.debug(
                     f'Requested segment {segment} is within the range '
-                    f'{first_transcoded_segment}-{upper_bound} '
+                    f'{tracker.first}-{upper_bound} '
                     f'to wait for transcoding'
                 )
-                if await HlsTranscoder.wait_for_segment(folder, segment):
-                    return FileResponse(HlsTranscoder.get_segment_path(folder, segment))
+                if await tracker.wait_for(segment):
+                    return segment_response(folder, segment, 'waited', started)
 
             logger.debug(
                 f'Requested segment {segment} is not within the range '
-                f'{first_transcoded_segment}-{upper_bound} '
+                f'{tracker.first}-{upper_bound} '
                 f'to wait for transcoding, start a new transcoder'
             )
     else:
         logger.debug('Start new transcoder since the session does not exist')
 
-    await start_transcode(settings, segment)
+    try:
+        await start_transcode(settings, segment)
+    except HTTPException:
+        metrics.segment_request_seconds.observe(time.monotonic() - started, 'failed')
+        raise
 
+    sessions[settings.session].playback_segment = segment
     folder = sessions[settings.session].transcode_folder
-    if folder is not None and await HlsTranscoder.wait_for_segment(folder, segment):
-        return FileResponse(HlsTranscoder.get_segment_path(folder, segment))
+    if folder is not None and await HlsTranscoder.wait_for_segment(
+        settings.session, segment
+    ):
+        return segment_response(folder, segment, 'new_transcoder', started)
 
+    metrics.segment_request_seconds.observe(time.monotonic() - started, 'failed')
     raise HTTPException(404, 'No media')
 
 
+def segment_response(
+    folder: str, segment: int, source: str, started: float
+) -> FileResponse:
+    metrics.segment_request_seconds.observe(time.monotonic() - started, source)
+    return FileResponse(HlsTranscoder.get_segment_path(folder, segment))
+
+
 @router.get('/hls/init.mp4', name='Get HLS init segment')
 async def get_init_segment_route(
     settings: Annotated[TranscodeSettings, Depends()],
@@ -150,9 +214,10 @@ async def _start_transcode(
 
     if start_segment >= 0 and settings.session in sessions:
         session_model = sessions[settings.session]
-        folder = session_model.transcode_folder
-        if folder:
-            first, last = await HlsTranscoder.first_last_transcoded_segment(folder)
+        tracker = session_model.segment_tracker
+        if tracker is not None:
+            await tracker.refresh()
+            first, last = tracker.first, tracker.last
             if first <= start_segment <= last:
                 return transcode
             active_first = first if first >= 0 else session_model.start_segment
@@ -161,7 +226,7 @@ async def _start_transcode(
                 active_first <= start_segment
                 and start_segment
                 <= active_last + config.ffmpeg_segment_threshold_for_new_transcoder
-                and await HlsTranscoder.wait_for_segment(folder, start_segment)
+                and await tracker.wait_for(start_segment)
             ):
                 return transcode
 
@@ -179,20 +244,29 @@ async def _start_transcode(
     if settings.session in sessions:
         await close_transcoder(settings.session)
 
-    ready = await transcode.start()
+    try:
+        ready = await transcode.start()
+    except TranscodeSlotsFull as e:
+        raise HTTPException(
+            503,
+            'Too many transcodes running, try again later',
+            headers={'Retry-After': str(e.retry_after)},
+        ) from e
     if not ready:
         raise HTTPException(500, 'Transcode failed to start')
     sessions[settings.session].segment_time = transcode.segment_time()
     return transcode
 
 
-async def manage_transcoder_pause(
-    session_key: str, folder: str, current_segment: int
-) -> None:
+async def manage_transcoder_pause(session_key: str, current_segment: int) -> None:
     session_model = sessions.get(session_key)
-    if not session_model or not session_model.segment_time:
+    if (
+        not session_model
+        or not session_model.segment_time
+        or not session_model.segment_tracker
+    ):
         return
-    _, last = await HlsTranscoder.first_last_transcoded_segment(folder)
+    last = session_model.segment_tracker.last
     if last < 0:
         return
     ahead_segments = max(0, last - current_segment)
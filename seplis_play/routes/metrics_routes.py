@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Response
+
+from .. import metrics
+
+router = APIRouter()
+
+
+@router.get('/metrics', name='Get metrics')
+async def get_metrics_route() -> Response:
+    return Response(
+        content=metrics.registry.render(),
+        media_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,70 @@
+import time
+
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+
+from ..dependencies import require_secret
+from ..transcoding.base_transcoder import SessionModel, sessions
+
+router = APIRouter()
+
+
+class SessionStats(BaseModel):
+    session: str
+    method: str | None
+    video: str | None
+    paused: bool
+    speed: float
+    fps: float
+    bitrate: str
+    frames: int
+    output_bytes: int
+    transcoded_time: float
+    percent: float
+    first_segment: int
+    last_segment: int
+    playback_segment: int
+    segments_ahead: int | None
+    time_to_first_segment: float | None
+    running_time: float
+
+
+@router.get(
+    '/sessions',
+    name='Get active sessions',
+    dependencies=[Depends(require_secret)],
+)
+async def get_sessions_route() -> list[SessionStats]:
+    return [get_session_stats(session, s) for session, s in list(sessions.items())]
+
+
+def get_session_stats(session: str, s: SessionModel) -> SessionStats:
+    progress = s.progress
+    tracker = s.segment_tracker
+    first = tracker.first if tracker else -1
+    last = tracker.last if tracker else -1
+    first_ready_at = tracker.first_ready_at if tracker else None
+    decision = s.transcode_decision
+    return SessionStats(
+        session=session,
+        method=decision.method if decision else None,
+        video=decision.video.action if decision else None,
+        paused=s.ffmpeg_runner.paused,
+        speed=progress.speed if progress else 0,
+        fps=float(progress.fps) if progress else 0,
+        bitrate=progress.bitrate if progress else '',
+        frames=progress.frame if progress else 0,
+        output_bytes=progress.total_size if progress else 0,
+        transcoded_time=float(progress.time) if progress else 0,
+        percent=float(progress.percent) if progress else 0,
+        first_segment=first,
+        last_segment=last,
+        playback_segment=s.playback_segment,
+        segments_ahead=max(0, last - s.playback_segment)
+        if last >= 0 and s.playback_segment >= 0
+        else None,
+        time_to_first_segment=first_ready_at - s.started_at
+        if first_ready_at is not None and s.started_at
+        else None,
+        running_time=time.monotonic() - s.started_at if s.started_at else 0,
+    )
@@ -2,6 +2,7 @@ import asyncio
 from typing import Any, cast
 
 import pytest
+from fastapi import Request
 
 from seplis_play import config
 from seplis_play.routes import hls_routes
@@ -10,7 +11,7 @@ from seplis_play.transcoding.base_transcoder import (
     refresh_session_timeout,
     sessions,
 )
-from seplis_play.transcoding.hls_transcoder import HlsTranscoder
+from seplis_play.transcoding.hls_segment_tracker import HlsSegmentTracker
 from seplis_play.transcoding.transcode_settings_schema import TranscodeSettings
 
 
@@ -60,27 +61,28 @@ async def test_pause_thresholds_are_measured_in_seconds(
         def resume(self) -> None:
             self.paused = False
 
-    last_segment = 100
-
-    async def first_last(_folder: str) -> tuple[int, int]:
-        return (0, last_segment)
+    tracker = HlsSegmentTracker('/tmp/transcode/media.m3u8')
+    tracker.first, tracker.last = (0, 100)
 
     runner = Runner()
     session = 'b' * 32
     sessions[session] = cast(
         Any,
-        type('Session', (), {'segment_time': 3, 'ffmpeg_runner': runner})(),
+        type(
+            'Session',
+            (),
+            {'segment_time': 3, 'ffmpeg_runner': runner, 'segment_tracker': tracker},
+        )(),
     )
-    monkeypatch.setattr(HlsTranscoder, 'first_last_transcoded_segment', first_last)
     monkeypatch.setattr(config, 'ffmpeg_pause_threshold_seconds', 300)
     monkeypatch.setattr(config, 'ffmpeg_resume_threshold_seconds', 150)
 
     try:
-        await hls_routes.manage_transcoder_pause(session, '/tmp/transcode', 0)
+        await hls_routes.manage_transcoder_pause(session, 0)
         assert runner.paused is True
 
-        last_segment = 40
-        await hls_routes.manage_transcoder_pause(session, '/tmp/transcode', 0)
+        tracker.last = 40
+        await hls_routes.manage_transcoder_pause(session, 0)
         assert runner.paused is False
     finally:
         sessions.pop(session, None)
@@ -159,3 +161,54 @@ async def test_refresh_session_timeout_replaces_timer() -> None:
     finally:
         sessions[session].call_later.cancel()
         sessions.pop(session, None)
+
+
+@pytest.mark.asyncio
+async def test_media_playlist_is_served_from_cache_with_etag(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    built = 0
+
+    class Transcoder:
+        def __init__(self, settings: TranscodeSettings, metadata: Any) -> None:
+            nonlocal built
+            built += 1
+            self.metadata = metadata
+
+        def generate_media_playlist(self) -> str:
+            return '#EXTM3U'
+
+    async def session_exists(_session: str) -> bool:
+        return True
+
+    metadata: Any = {}
+
+    async def get_metadata(_play_id: str, _source_index: int) -> Any:
+        return metadata
+
+    monkeypatch.setattr(hls_routes, 'HlsTranscoder', Transcoder)
+    monkeypatch.setattr(hls_routes, 'refresh_session_timeout', session_exists)
+    monkeypatch.setattr(hls_routes, 'get_metadata', get_metadata)
+    settings = make_settings('f' * 32)
+
+    def make_request(if_none_match: str | None = None) -> Request:
+        headers = [(b'if-none-match', if_none_match.encode())] if if_none_match else []
+        return Request({'type': 'http', 'method': 'GET', 'headers': headers})
+
+    try:
+        first = await hls_routes.get_media_route(make_request(), settings)
+        second = await hls_routes.get_media_route(make_request(), settings)
+        not_modified = await hls_routes.get_media_route(
+            make_request(first.headers['etag']), settings
+        )
+
+        assert built == 1
+        assert first.body == second.body == b'#EXTM3U'
+        assert second.headers['etag'] == first.headers['etag']
+        assert not_modified.status_code == 304
+
+        metadata = {}
+        await hls_routes.get_media_route(make_request(), settings)
+        assert built == 2
+    finally:
+        hls_routes.media_playlists.clear()
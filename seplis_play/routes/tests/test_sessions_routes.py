@@ -0,0 +1,66 @@
+import time
+from decimal import Decimal
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from seplis_play import config
+from seplis_play.ffmpeg.ffmpeg_runner import FFmpegRunner
+from seplis_play.ffmpeg.ffmpeg_schemas import TranscodeProgress
+from seplis_play.routes import sessions_routes
+from seplis_play.testbase import run_file
+from seplis_play.transcoding.base_transcoder import SessionModel
+from seplis_play.transcoding.hls_segment_tracker import HlsSegmentTracker
+
+
+@pytest.mark.asyncio
+async def test_session_stats() -> None:
+    tracker = HlsSegmentTracker('/tmp/transcode/media.m3u8')
+    tracker.first, tracker.last = (10, 25)
+    now = time.monotonic()
+    tracker.first_ready_at = now - 8
+    s = SessionModel(
+        ffmpeg_runner=FFmpegRunner(),
+        call_later=None,
+        segment_tracker=tracker,
+        progress=TranscodeProgress(
+            frame=500,
+            fps=Decimal('120.5'),
+            total_size=1024,
+            time=Decimal('20.5'),
+            speed=4.2,
+        ),
+        started_at=now - 10,
+        playback_segment=15,
+    )
+
+    stats = sessions_routes.get_session_stats('a' * 32, s)
+
+    assert stats.speed == 4.2
+    assert stats.fps == 120.5
+    assert stats.frames == 500
+    assert stats.output_bytes == 1024
+    assert stats.paused is False
+    assert stats.segments_ahead == 10
+    assert stats.time_to_first_segment == pytest.approx(2)
+
+
+def test_sessions_require_the_secret(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, 'secret', 'secret')
+    app = FastAPI()
+    app.include_router(sessions_routes.router)
+    client = TestClient(app)
+
+    assert client.get('/sessions').status_code == 401
+    assert (
+        client.get('/sessions', headers={'Authorization': 'Secret wrong'}).status_code
+        == 401
+    )
+    r = client.get('/sessions', headers={'Authorization': 'Secret secret'})
+    assert r.status_code == 200
+    assert r.json() == []
+
+
+if __name__ == '__main__':
+    run_file(__file__)
@@ -1,4 +1,5 @@
 import asyncio
+from array import array
 
 from seplis_play.routes.request_media_routes import request_media_route
 from seplis_play.schemas.source_metadata_schemas import SourceMetadata
@@ -40,7 +41,7 @@ TRANSCODE_METADATA: SourceMetadata = {
         'size': '2743430123',
         'bit_rate': '6294815',
     },
-    'keyframes': ['0.000000', '6.715000'],
+    'keyframes': array('q', [0, 6_715_000]),
 }
 
 DIRECT_PLAY_METADATA: SourceMetadata = {
@@ -74,7 +75,7 @@ DIRECT_PLAY_METADATA: SourceMetadata = {
         'size': '2743430123',
         'bit_rate': '2500000',
     },
-    'keyframes': ['0.000000', '6.715000'],
+    'keyframes': array('q', [0, 6_715_000]),
 }
 
 
@@ -1,12 +1,14 @@
 import asyncio
 import os
 from collections.abc import Awaitable
+from pathlib import Path
 from typing import Any
 
 import click
 import uvicorn
 
-from seplis_play import config
+from seplis_play import config, logger
+from seplis_play.metrics import write_metrics_file
 
 
 @click.group()
@@ -35,16 +37,44 @@ async def play_scan_task(task: Awaitable[Any]) -> None:
 
     seplis_play.scan.upgrade_scan_db()
     database.setup()
+    metrics_writer = (
+        asyncio.create_task(write_scan_metrics(config.scan_metrics_file))
+        if config.scan_metrics_file
+        else None
+    )
     try:
         await task
     finally:
         await database.close()
+        if metrics_writer:
+            metrics_writer.cancel()
+            await asyncio.wait([metrics_writer])
+
+
+async def write_scan_metrics(path: Path) -> None:
+    """
+    Writes the metrics every 15 seconds and a last time when cancelled.
+    """
+    try:
+        while True:
+            await asyncio.sleep(15)
+            try:
+                write_metrics_file(path)
+            except OSError as e:
+                logger.warning(f'Failed to write the metrics to {path}: {e}')
+    finally:
+        write_metrics_file(path)
 
 
 @cli.command()
 @click.option('--disable-cleanup', is_flag=True, help='Disable cleanup after scan')
 @click.option('--disable-thumbnails', is_flag=True, help='Disable making thumbnails')
-def scan(disable_cleanup: bool, disable_thumbnails: bool) -> None:
+@click.option(
+    '--full-index-sync',
+    is_flag=True,
+    help='Replace the play server index instead of sending the changes',
+)
+def scan(disable_cleanup: bool, disable_thumbnails: bool, full_index_sync: bool) -> None:
     import seplis_play.scan
 
     asyncio.run(
@@ -52,6 +82,7 @@ def scan(disable_cleanup: bool, disable_thumbnails: bool) -> None:
             seplis_play.scan.scan(
                 disable_cleanup=disable_cleanup,
                 disable_thumbnails=disable_thumbnails,
+                full_index_sync=full_index_sync,
             )
         )
     )
@@ -65,10 +96,15 @@ def scan_watch() -> None:
 
 
 @cli.command()
-def scan_cleanup() -> None:
+@click.option(
+    '--full-index-sync',
+    is_flag=True,
+    help='Replace the play server index instead of sending the changes',
+)
+def scan_cleanup(full_index_sync: bool) -> None:
     import seplis_play.scan
 
-    asyncio.run(play_scan_task(seplis_play.scan.cleanup()))
+    asyncio.run(play_scan_task(seplis_play.scan.cleanup(full_index_sync=full_index_sync)))
 
 
 def main() -> None:
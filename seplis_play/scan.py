@@ -11,7 +11,11 @@ from seplis_play.scanners import (
 )
 
 
-async def scan(disable_cleanup: bool = False, disable_thumbnails: bool = False) -> None:
+async def scan(
+    disable_cleanup: bool = False,
+    disable_thumbnails: bool = False,
+    full_index_sync: bool = False,
+) -> None:
     for s in config.scan:
         scanner: EpisodeScan | MovieScan | None = None
         if s.type == 'series':
@@ -40,13 +44,13 @@ async def scan(disable_cleanup: bool = False, disable_thumbnails: bool = False)
             logger.error(f'Scan type: "{s.type}" is not supported')
 
     if not disable_cleanup:
-        await cleanup()
+        await cleanup(full_index_sync=full_index_sync)
 
 
-async def cleanup() -> None:
+async def cleanup(full_index_sync: bool = False) -> None:
     logger.info('Cleanup started')
-    await cleanup_episodes()
-    await cleanup_movies()
+    await cleanup_episodes(full_index_sync=full_index_sync)
+    await cleanup_movies(full_index_sync=full_index_sync)
     await cleanup_subtitles()
 
 
@@ -1,29 +1,224 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
 import os
-from typing import Literal
+import time
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Literal, NamedTuple
 
 from watchfiles import Change, awatch
 
 from seplis_play import config, logger
 from seplis_play.config import ConfigPlayScanModel
 from seplis_play.scanners import EpisodeScan, MovieScan, PlayScan, SubtitleScan
+from seplis_play.scanners.episode.episode_scan import episode_index
+from seplis_play.scanners.movie.movie_scan import movie_index
 
-files_waiting_to_finish: dict[str, asyncio.Task[None]] = {}
+# Lanes, the lowest is handled first
+LANE_DELETE = 0
+LANE_SUBTITLE = 1
+LANE_MEDIA = 2
 
-scan_queue: asyncio.Queue[tuple[Change, str, ConfigPlayScanModel] | None] = (
-    asyncio.Queue()
-)
+
+class WatchEvent(NamedTuple):
+    change: Change
+    path: str
+    scan_info: ConfigPlayScanModel
+    # Set when the path was moved from here
+    old_path: str | None = None
+
+
+class WatchQueue:
+    """
+    Spreads the changes over the workers, a path always goes to the same worker
+    so the changes of a path are handled in order.
+
+    A worker handles deletes first, then subtitles and then media files and
+    directories. A path is only queued once, a newer change replaces the
+    waiting one and moves it to its lane.
+
+    Changes under a directory that is waiting to be scanned or being scanned
+    are held back until the scan is done, most of them are then unchanged.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self.queues: list[asyncio.PriorityQueue[tuple[int, int, str]]] = [
+            asyncio.PriorityQueue() for _ in range(workers)
+        ]
+        self.waiting: dict[str, WatchEvent] = {}
+        self.directories: dict[str, list[WatchEvent]] = {}
+        self._order = itertools.count()
+
+    def put(self, event: WatchEvent) -> None:
+        if event.change != Change.deleted:
+            directory = self.get_scanned_directory(event.path)
+            if directory is not None:
+                self.directories[directory].append(event)
+                return
+            if event.change == Change.added and is_directory(event.path):
+                prefix = event.path + os.sep
+                # Already held back changes are kept if it's added again
+                self.directories.setdefault(event.path, []).extend(
+                    self.waiting.pop(path)
+                    for path in list(self.waiting)
+                    if path.startswith(prefix)
+                    and self.waiting[path].change != Change.deleted
+                )
+        previous = self.waiting.get(event.path)
+        self.waiting[event.path] = event
+        lane = get_lane(event.change, event.path)
+        if previous is None or get_lane(previous.change, previous.path) != lane:
+            self.queues[self.worker_index(event.path)].put_nowait(
+                (lane, next(self._order), event.path)
+            )
+
+    async def get(self, worker: int) -> WatchEvent:
+        while True:
+            lane, _, path = await self.queues[worker].get()
+            # Not there if it was moved under a directory scan and in another
+            # lane if a newer change replaced it, it was queued again there
+            event = self.waiting.get(path)
+            if event and get_lane(event.change, path) == lane:
+                del self.waiting[path]
+                return event
+
+    def done(self, event: WatchEvent) -> None:
+        if event.path in self.waiting:
+            # Scanned again, hold the changes until that scan is done
+            return
+        for e in self.directories.pop(event.path, []):
+            self.put(e)
+
+    def get_scanned_directory(self, path: str) -> str | None:
+        while True:
+            parent = os.path.dirname(path)
+            if not parent or parent == path:
+                return None
+            if parent in self.directories:
+                return parent
+            path = parent
+
+    def worker_index(self, path: str) -> int:
+        return zlib.crc32(path.encode()) % len(self.queues)
+
+
+def is_directory(path: str) -> bool:
+    return not os.path.splitext(path)[1]
+
+
+def get_lane(change: Change, path: str) -> int:
+    if change == Change.deleted:
+        return LANE_DELETE
+    if os.path.splitext(path)[1][1:].lower() in config.subtitle_types:
+        return LANE_SUBTITLE
+    return LANE_MEDIA
+
+
+@dataclass
+class WrittenFile:
+    change: Change
+    scan_info: ConfigPlayScanModel
+    stat: tuple[int, int] | None = None  # size and modified time
+    stable_since: float = 0.0
+
+
+class WriteWatcher:
+    """
+    Holds back added and modified paths until they are no longer being written.
+
+    One task checks the size and modified time of all the waiting paths every
+    `CHECK_INTERVAL` seconds. A path is queued once neither has changed for
+    `config.scan_watch_stable_seconds`, a directory also waits for the paths
+    under it.
+    """
+
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, queue: WatchQueue) -> None:
+        self.queue = queue
+        self.files: dict[str, WrittenFile] = {}
+        self._task: asyncio.Task[None] | None = None
+
+    def add(self, change: Change, path: str, scan_info: ConfigPlayScanModel) -> None:
+        if change == Change.deleted:
+            self.files.pop(path, None)
+            self.queue.put(WatchEvent(change, path, scan_info))
+            return
+        if path in self.files:
+            self.files[path].change = change
+        else:
+            self.files[path] = WrittenFile(change=change, scan_info=scan_info)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while self.files:
+            await asyncio.sleep(self.CHECK_INTERVAL)
+            await self.check()
+
+    async def check(self) -> None:
+        stats = await asyncio.to_thread(get_stats, list(self.files))
+        now = time.monotonic()
+        for path, stat in stats.items():
+            file = self.files.get(path)
+            if not file:
+                continue
+            if stat is None:
+                # Gone again, the delete event takes care of it
+                del self.files[path]
+            elif stat != file.stat:
+                file.stat = stat
+                file.stable_since = now
+            elif now - file.stable_since >= config.scan_watch_stable_seconds:
+                if is_directory(path) and self.is_writing_under(path):
+                    # A directory's stat doesn't change while the files in it
+                    # are written, don't scan it before they are done
+                    continue
+                del self.files[path]
+                self.queue.put(WatchEvent(file.change, path, file.scan_info))
+
+    def is_writing_under(self, directory: str) -> bool:
+        prefix = directory + os.sep
+        return any(path.startswith(prefix) for path in self.files)
+
+
+def get_stats(paths: list[str]) -> dict[str, tuple[int, int] | None]:
+    stats: dict[str, tuple[int, int] | None] = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stats[path] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            stats[path] = None
+    return stats
+
+
+scan_queue = WatchQueue(config.scan_watch_workers or os.cpu_count() or 1)
+write_watcher = WriteWatcher(scan_queue)
 
 
 async def main() -> None:
-    w: asyncio.Task[None] = asyncio.create_task(worker(scan_queue))
+    workers = [
+        asyncio.create_task(worker(scan_queue, i)) for i in range(len(scan_queue.queues))
+    ]
     for scan in config.scan:
         logger.info(f'Watching: {scan.path} ({scan.type})')
+    try:
+        await watch()
+    finally:
+        for w in workers:
+            w.cancel()
+        await episode_index.flush()
+        await movie_index.flush()
+
+
+async def watch() -> None:
     async for changes in awatch(*[str(scan.path) for scan in config.scan]):
-        for c in changes:
-            change, path = c
+        events: list[WatchEvent] = []
+        for change, path in changes:
             scan_info: ConfigPlayScanModel | None = None
             for scan in config.scan:
                 if path.lower().startswith(str(scan.path).lower()):
@@ -31,20 +226,54 @@ async def main() -> None:
                     break
             if not scan_info:
                 continue
+            events.append(WatchEvent(change, path, scan_info))
 
-            # if the file is being written it will trigger a change event multiple times
-            # so we try and wait for the file to be written before parsing it.
-            if path in files_waiting_to_finish:
-                files_waiting_to_finish[path].cancel()
-            files_waiting_to_finish[path] = asyncio.create_task(
-                parse(
-                    path=path,
-                    change=change,
-                    scan_info=scan_info,
-                )
-            )
+        for event in find_moves(events):
+            # The moved file is already written
+            if event.old_path:
+                scan_queue.put(event)
+            else:
+                # A file that is being written triggers a lot of change events,
+                # wait until it's done before handling it.
+                write_watcher.add(event.change, event.path, event.scan_info)
 
-    w.cancel()
+
+def find_moves(events: list[WatchEvent]) -> list[WatchEvent]:
+    """
+    A move is seen as a delete and an add in the same batch of changes.
+    They are paired when the name is the same (moved to another directory)
+    or when they are the only delete and add of a type in a directory (renamed).
+
+    :returns: the events with the pairs replaced by an add with `old_path` set.
+    """
+    moves: dict[int, int] = {}  # add: delete, indexes in events
+    for key in (
+        lambda e: (str(e.scan_info.path), os.path.basename(e.path)),
+        lambda e: (
+            str(e.scan_info.path),
+            os.path.dirname(e.path),
+            is_directory(e.path),
+            os.path.splitext(e.path)[1].lower(),
+        ),
+    ):
+        groups: defaultdict[tuple[Any, ...], tuple[list[int], list[int]]] = defaultdict(
+            lambda: ([], [])
+        )
+        moved_from = set(moves.values())
+        for i, e in enumerate(events):
+            if e.change == Change.deleted and i not in moved_from:
+                groups[key(e)][0].append(i)
+            elif e.change == Change.added and i not in moves:
+                groups[key(e)][1].append(i)
+        for deleted, added in groups.values():
+            if len(deleted) == 1 and len(added) == 1:
+                moves[added[0]] = deleted[0]
+    moved_from = set(moves.values())
+    return [
+        e._replace(old_path=events[moves[i]].path) if i in moves else e
+        for i, e in enumerate(events)
+        if i not in moved_from
+    ]
 
 
 def get_scanner(
@@ -73,56 +302,63 @@ def get_scanner(
     raise ValueError(f'Unknown scan type: {effective_type!r}')
 
 
-async def worker(
-    queue: asyncio.Queue[tuple[Change, str, ConfigPlayScanModel] | None],
-) -> None:
+async def worker(queue: WatchQueue, index: int) -> None:
     while True:
-        item = await queue.get()
-        if item is None:
-            break
-        change, path, scan_info = item
+        event = await queue.get(index)
         try:
-            logger.info(f'[Event detected: {change.name}]: {path} ({scan_info.type})')
-            info = os.path.splitext(path)
-            if len(info) == 2 and info[1]:
-                s: PlayScan
-                if info[1][1:].lower() in config.media_types:
-                    s = get_scanner(scan_info)
-                elif info[1][1:].lower() in config.subtitle_types:
-                    s = get_scanner(scan_info, type_='subtitles')
-                else:
-                    continue
-                if change in (Change.added, Change.modified):
-                    parsed = s.parse(path)
-                    if parsed:
-                        await s.save_item(parsed, path)
-                elif change == Change.deleted:
-                    await s.delete_path(path)
-                else:
-                    logger.warning(f'Unknown: {path}')
-            else:
-                scanner = get_scanner(scan_info)
-                scanner_subtitles = get_scanner(scan_info, type_='subtitles')
-                # if path is a directory scan it
-                if change == Change.added:
-                    for s in (scanner, scanner_subtitles):
-                        s.scan_path = path
-                        await s.scan()
-                elif change == Change.deleted:
-                    for s in (scanner, scanner_subtitles):
-                        dir_paths = await s.get_paths_matching_base_path(path)
-                        for dir_path in dir_paths:
-                            await s.delete_path(dir_path)
+            await handle_change(event)
         except Exception as e:
             logger.exception(e)
-
-        queue.task_done()
+        finally:
+            queue.done(event)
 
 
-async def parse(path: str, change: Change, scan_info: ConfigPlayScanModel) -> None:
-    # wait so we don't execute for the same file multiple times within a short time
-    # incase the file is being written.
-    if change in (Change.added, Change.modified):
-        await asyncio.sleep(3)
-    files_waiting_to_finish.pop(path, None)
-    await scan_queue.put((change, path, scan_info))
+async def handle_change(event: WatchEvent) -> None:
+    change, path, scan_info, old_path = event
+    if old_path:
+        logger.info(f'[Event detected: moved]: {old_path} -> {path} ({scan_info.type})')
+    else:
+        logger.info(f'[Event detected: {change.name}]: {path} ({scan_info.type})')
+    info = os.path.splitext(path)
+    if len(info) == 2 and info[1]:
+        s: PlayScan
+        if info[1][1:].lower() in config.media_types:
+            s = get_scanner(scan_info)
+        elif info[1][1:].lower() in config.subtitle_types:
+            s = get_scanner(scan_info, type_='subtitles')
+        else:
+            return
+        if old_path:
+            if await s.move_path(old_path, path):
+                return
+            await s.delete_path(old_path)
+            # Not the moved file, it could be a replacement still being copied
+            write_watcher.add(change, path, scan_info)
+            return
+        if change in (Change.added, Change.modified):
+            parsed = s.parse(path)
+            if parsed:
+                await s.save_item(parsed, path)
+        elif change == Change.deleted:
+            await s.delete_path(path)
+        else:
+            logger.warning(f'Unknown: {path}')
+    else:
+        scanner = get_scanner(scan_info)
+        scanner_subtitles = get_scanner(scan_info, type_='subtitles')
+        if old_path:
+            await scanner.move_path(old_path, path)
+            for dir_path in await scanner_subtitles.get_paths_matching_base_path(
+                old_path
+            ):
+                await scanner_subtitles.delete_path(dir_path)
+        # if path is a directory scan it, moved files that are unchanged are skipped
+        if change == Change.added:
+            for s in (scanner, scanner_subtitles):
+                s.scan_path = path
+                await s.scan()
+        elif change == Change.deleted:
+            for s in (scanner, scanner_subtitles):
+                dir_paths = await s.get_paths_matching_base_path(path)
+                for dir_path in dir_paths:
+                    await s.delete_path(dir_path)
@@ -0,0 +1,155 @@
+import asyncio
+import os
+from collections import defaultdict
+from collections.abc import AsyncIterator, Callable, Iterable
+from datetime import datetime
+from typing import Any, cast
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
+
+from seplis_play import database
+from seplis_play.schemas.source_metadata_schemas import SourceMetadata
+from seplis_play.utils.json_utils import json_dumps
+
+DELETE_BATCH_SIZE = 500
+INDEX_STREAM_BATCH_SIZE = 1000
+
+
+async def find_missing_paths(paths: Iterable[str]) -> set[str]:
+    """
+    Checks which of the paths no longer exist.
+
+    The paths are grouped by directory and every directory is listed once
+    in a thread, so a slow (network) file system doesn't block the loop.
+    """
+    directories: defaultdict[str, set[str]] = defaultdict(set)
+    for path in paths:
+        directory, name = os.path.split(path)
+        directories[directory].add(name)
+    results = await asyncio.gather(
+        *[
+            asyncio.to_thread(_missing_in_directory, directory, names)
+            for directory, names in directories.items()
+        ]
+    )
+    return {path for missing in results for path in missing}
+
+
+def _missing_in_directory(directory: str, names: set[str]) -> list[str]:
+    try:
+        with os.scandir(directory) as it:
+            existing = {entry.name for entry in it}
+    except FileNotFoundError, NotADirectoryError:
+        existing = set()
+    except OSError:
+        # Not allowed to list it, check the files one by one instead
+        return [
+            path
+            for path in (os.path.join(directory, name) for name in names)
+            if not os.path.exists(path)
+        ]
+    return [os.path.join(directory, name) for name in names - existing]
+
+
+async def delete_paths(
+    session: AsyncSession, column: InstrumentedAttribute[str], paths: Iterable[str]
+) -> None:
+    """
+    Deletes the rows where `column` is one of the paths, in batches.
+    """
+    paths = list(paths)
+    for i in range(0, len(paths), DELETE_BATCH_SIZE):
+        await session.execute(
+            sa.delete(column.class_).where(column.in_(paths[i : i + DELETE_BATCH_SIZE]))
+        )
+
+
+async def move_paths(
+    session: AsyncSession,
+    path: InstrumentedAttribute[str],
+    modified_time: InstrumentedAttribute[datetime | None],
+    old_path: str,
+    new_path: str,
+    new_modified_time: datetime | None,
+) -> int:
+    """
+    Points the rows at `new_path` after a file or a directory was moved.
+
+    A file is only moved if it still has the saved modified time,
+    otherwise it's another file. The `format.filename` of the `meta_data`
+    and `summary` columns is changed as well, it's the path ffmpeg reads.
+
+    :returns: the number of moved rows.
+    """
+    model = path.class_
+    if os.path.isdir(new_path):
+        where = path.startswith(old_path + os.sep, autoescape=True)
+    else:
+        where = sa.and_(path == old_path, modified_time == new_modified_time)
+    rows = (
+        await session.execute(
+            sa.select(path, model.meta_data, model.summary).where(where)
+        )
+    ).all()
+    if not rows:
+        return 0
+    moves = []
+    for row_path, meta_data, summary in rows:
+        moved = new_path + row_path[len(old_path) :]
+        moves.append(
+            {
+                'old_path': row_path,
+                'new_path': moved,
+                'new_meta_data': set_format_filename(meta_data, moved),
+                'new_summary': set_format_filename(summary, moved),
+            }
+        )
+    columns = sa.inspect(model).columns
+    await session.execute(
+        sa.update(model.__table__)
+        .where(columns[path.key] == sa.bindparam('old_path'))
+        .values(
+            {
+                columns[path.key]: sa.bindparam('new_path'),
+                columns['meta_data']: sa.bindparam(
+                    'new_meta_data', type_=columns['meta_data'].type
+                ),
+                columns['summary']: sa.bindparam(
+                    'new_summary', type_=columns['summary'].type
+                ),
+            }
+        ),
+        moves,
+    )
+    return len(rows)
+
+
+def set_format_filename(
+    metadata: SourceMetadata | None, filename: str
+) -> SourceMetadata | None:
+    if not metadata or 'format' not in metadata:
+        return metadata
+    return cast(
+        SourceMetadata,
+        {**metadata, 'format': {**metadata['format'], 'filename': filename}},
+    )
+
+
+async def stream_index(
+    query: sa.Select[Any], item: Callable[[sa.Row[Any]], dict[str, Any]]
+) -> AsyncIterator[bytes]:
+    """
+    Streams the rows of `query` as a JSON list, made with `item` for each row,
+    without loading all of them.
+    """
+    async with database.session() as session:
+        result = await session.stream(
+            query.execution_options(yield_per=INDEX_STREAM_BATCH_SIZE)
+        )
+        separator = b'['
+        async for rows in result.partitions():
+            yield separator + json_dumps([item(row) for row in rows])[1:-1].encode()
+            separator = b','
+        yield b']' if separator == b',' else b'[]'
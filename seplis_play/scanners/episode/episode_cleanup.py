@@ -1,63 +1,43 @@
-import os
-from datetime import UTC, datetime
-
 import sqlalchemy as sa
 
-from seplis_play import client, config, database, logger
+from seplis_play import config, database, logger
+from seplis_play.metadata_cache import metadata_cache
 
-from .episode_models import MEpisode
-from .episode_schemas import PlayServerEpisodeCreate
+from ..cleanup_base import delete_paths, find_missing_paths
+from ..index_sync import sync_index
+from .episode_models import MEpisode, MIndexedEpisode
 
 
-async def cleanup_episodes() -> None:
+async def cleanup_episodes(full_index_sync: bool = False) -> None:
     logger.info('Cleanup episodes started')
-    episodes: list[PlayServerEpisodeCreate] = []
     async with database.session() as session:
-        deleted_count = 0
-        rows = await session.scalars(sa.select(MEpisode))
-        for e in rows:
-            logger.debug(f'Checking if exists: {e.path}')
-            if os.path.exists(e.path):
-                episodes.append(
-                    PlayServerEpisodeCreate(
-                        series_id=e.series_id,
-                        episode_number=e.number or 0,
-                        created_at=e.modified_time or datetime.now(tz=UTC),
-                    )
-                )
-                continue
-            deleted_count += 1
-            await session.execute(
-                sa.delete(MEpisode).where(
-                    MEpisode.series_id == e.series_id,
-                    MEpisode.number == e.number,
-                    MEpisode.path == e.path,
-                )
-            )
+        paths = await session.scalars(sa.select(MEpisode.path))
+        missing = await find_missing_paths(paths)
+        await delete_paths(session, MEpisode.path, missing)
         await session.commit()
+        deleted_count = len(missing)
+        if deleted_count:
+            metadata_cache.clear()
         logger.info(f'{deleted_count} episodes were deleted from the database')
 
-        if not config.server_id:
-            logger.warning(
-                'No server_id specified episodes not sent to play server index'
-            )
-        else:
-            r = await client.put(  # noqa: F821
-                f'/2/play-servers/{config.server_id}/episodes',
-                json=[r.model_dump(mode='json') for r in episodes],
-                headers={
-                    'Authorization': f'Secret {config.secret}',
-                    'Content-Type': 'application/json',
-                },
-                timeout=900,
-            )
-            if r.status_code >= 400:
-                logger.error(
-                    f'Failed to add {len(episodes)} episodes to the episode '
-                    f'play server index ({config.server_id}): {r.content}'
-                )
-            else:
-                logger.info(
-                    f'Updated {len(episodes)} episodes to the episode play '
-                    f'server index ({config.server_id})'
-                )
+    if not config.server_id:
+        logger.warning('No server_id specified episodes not sent to play server index')
+        return
+    # The index has one entry per episode, so an episode with more than one
+    # file gets the time the latest was added, which is also what the scanner
+    # sends when saving it. A missing number is sent as 0 like before.
+    number = sa.func.coalesce(MEpisode.number, 0)
+    await sync_index(
+        'episodes',
+        sa.select(
+            MEpisode.series_id,
+            number.label('episode_number'),
+            sa.func.max(MEpisode.modified_time).label('created_at'),
+        )
+        .group_by(MEpisode.series_id, number)
+        .subquery(),
+        MIndexedEpisode,
+        ('series_id', 'episode_number'),
+        lambda e: f'series/{e.series_id}/episodes/{e.episode_number}',
+        full=full_index_sync,
+    )
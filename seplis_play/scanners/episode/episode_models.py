@@ -23,7 +23,13 @@ class MEpisode(SABase):
     series_id: Mapped[int] = mapped_column(sa.Integer, nullable=False)
     number: Mapped[int | None] = mapped_column(sa.Integer)
     path: Mapped[str] = mapped_column(sa.Text, primary_key=True)
+    # The full ffprobe output
     meta_data: Mapped[SourceMetadata | None] = mapped_column('metadata', sa.JSON)
+    # The fields of `meta_data` that are read when playing, see
+    # `source_metadata_summary`
+    summary: Mapped[SourceMetadata | None] = mapped_column(sa.JSON)
+    # Packed keyframe timestamps, see `keyframes_utils`
+    keyframes: Mapped[bytes | None] = mapped_column(sa.LargeBinary(2**24 - 1))
     modified_time: Mapped[datetime | None] = mapped_column(UtcDateTime)
 
 
@@ -34,3 +40,14 @@ class MEpisodeNumberLookup(SABase):
     lookup_type: Mapped[int] = mapped_column(sa.Integer, primary_key=True)
     lookup_value: Mapped[str] = mapped_column(sa.String(45), primary_key=True)
     number: Mapped[int | None] = mapped_column(sa.Integer)
+
+
+class MIndexedEpisode(SABase):
+    """What was last sent to a play server's episode index, see `sync_index`."""
+
+    __tablename__ = 'indexed_episodes'
+
+    server_id: Mapped[str] = mapped_column(sa.String(100), primary_key=True)
+    series_id: Mapped[int] = mapped_column(sa.Integer, primary_key=True)
+    episode_number: Mapped[int] = mapped_column(sa.Integer, primary_key=True)
+    created_at: Mapped[datetime | None] = mapped_column(UtcDateTime)
@@ -1,9 +1,10 @@
 import asyncio
 import os.path
 import re
-from datetime import UTC, date, datetime
+from datetime import UTC, date, datetime, timedelta
 from typing import Any
 
+import httpx
 import sqlalchemy as sa
 from guessit import guessit
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -11,14 +12,33 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from seplis_play import config, logger
 from seplis_play.client import client
 from seplis_play.database import database
+from seplis_play.metadata_cache import invalidate_episode, metadata_cache
 from seplis_play.schemas.page_cursor_schema import PageCursorResult
+from seplis_play.schemas.source_metadata_schemas import source_metadata_summary
+from seplis_play.utils.coalesce_utils import Coalescer
+from seplis_play.utils.lru_cache_utils import LRUCache
 
+from ..cleanup_base import move_paths
+from ..index_batcher import IndexBatcher, forget_indexed, send_to_index
 from ..scan_base import PlayScan
 from ..subtitles.subtitle_scan import SubtitleScan
 from .episode_constants import EPISODE_FILENAME_PATTERNS
-from .episode_models import MEpisode, MEpisodeNumberLookup, MSeriesIdLookup
+from .episode_models import (
+    MEpisode,
+    MEpisodeNumberLookup,
+    MIndexedEpisode,
+    MSeriesIdLookup,
+)
 from .episode_schemas import Episode, ParsedFileEpisode, PlayServerEpisodeCreate
 
+episode_index = IndexBatcher[PlayServerEpisodeCreate]('episodes', MIndexedEpisode)
+
+series_searches = Coalescer[str, int | None]()
+episode_list_requests = Coalescer[int, dict[str, int] | None]()
+# Episode numbers of a series by their lookup value, see
+# `EpisodeNumberLookup.get_lookup_value`
+series_episode_numbers = LRUCache[int, dict[str, int]](maxsize=100, ttl=60 * 60)
+
 
 class EpisodeScan(PlayScan):
     SCANNER_NAME = 'Episodes'
@@ -33,7 +53,7 @@ class EpisodeScan(PlayScan):
         super().__init__(scan_path, make_thumbnails, cleanup_mode, parser)
         self.series_id = SeriesIdLookup(scanner=self)
         self.episode_number = EpisodeNumberLookup(scanner=self)
-        self.not_found_series: list[str] = []
+        self.not_found_series: set[str] = set()
         self.subtitles_scan = SubtitleScan(scan_path=scan_path)
 
     def parse(self, filename: str) -> ParsedFileEpisode | None:
@@ -57,7 +77,7 @@ class EpisodeScan(PlayScan):
             logger.debug(f'[series-{series_id}] Found: "{episode.title}"')
             episode.series_id = series_id
             return True
-        self.not_found_series.append(episode.title or '')
+        self.not_found_series.add(episode.title or '')
         logger.info(f'No series found for "{episode.title}" ({path})')
         return False
 
@@ -84,84 +104,106 @@ class EpisodeScan(PlayScan):
         logger.info(f'[series-{episode.series_id}] No episode found for {value} ({path})')
         return False
 
+    async def lookup_episode(self, item: ParsedFileEpisode, path: str) -> bool:
+        """
+        Sets the series id and episode number of `item` if they are missing.
+        """
+        if not item.series_id:
+            async with self.lock(('series', item.title)):
+                if not await self.episode_series_id_lookup(item, path):
+                    return False
+        if not item.episode_number:
+            async with self.lock(
+                (
+                    'episode',
+                    item.series_id,
+                    EpisodeNumberLookup.get_lookup_value(item),
+                )
+            ):
+                if not await self.episode_number_lookup(item, path):
+                    return False
+        return True
+
     async def save_item(self, item: ParsedFileEpisode, path: str) -> bool:
         if not os.path.exists(path):
             logger.debug(f"Path doesn't exist any longer: {path}")
             return False
+        # No session is kept open during the lookups and the probe, with many
+        # workers they would otherwise use up the connection pool.
         async with database.session() as session:
             ep = await session.scalar(
                 sa.select(MEpisode).where(
                     MEpisode.path == path,
                 )
             )
-            if ep:
-                item.series_id = ep.series_id
-                item.episode_number = ep.number
-            modified_time = self.get_file_modified_time(path)
-            if not ep or (ep.modified_time != modified_time) or not ep.meta_data:
-                if not ep:
-                    if not item.series_id:
-                        if not await self.episode_series_id_lookup(item, path):
-                            return False
-                    if not item.episode_number:
-                        if not await self.episode_number_lookup(item, path):
-                            return False
-                try:
-                    metadata = await self.get_metadata(path)
-
-                    if ep:
-                        sql = (
-                            sa.update(MEpisode)
-                            .where(
-                                MEpisode.path == path,
-                            )
-                            .values(
-                                {
-                                    MEpisode.meta_data: metadata,
-                                    MEpisode.modified_time: modified_time,
-                                }
-                            )
+        if ep:
+            item.series_id = ep.series_id
+            item.episode_number = ep.number
+        modified_time = self.get_file_modified_time(path)
+        if not ep or (ep.modified_time != modified_time) or not ep.meta_data:
+            if not ep and not await self.lookup_episode(item, path):
+                return False
+            try:
+                metadata, keyframes = await self.probe(path)
+                summary = source_metadata_summary(metadata)
+
+                if ep:
+                    sql = (
+                        sa.update(MEpisode)
+                        .where(
+                            MEpisode.path == path,
                         )
-                    else:
-                        sql = sa.insert(MEpisode).values(
+                        .values(
                             {
-                                MEpisode.series_id: item.series_id,
-                                MEpisode.number: item.episode_number,
-                                MEpisode.path: path,
                                 MEpisode.meta_data: metadata,
+                                MEpisode.summary: summary,
+                                MEpisode.keyframes: keyframes,
                                 MEpisode.modified_time: modified_time,
                             }
                         )
+                    )
+                else:
+                    sql = sa.insert(MEpisode).values(
+                        {
+                            MEpisode.series_id: item.series_id,
+                            MEpisode.number: item.episode_number,
+                            MEpisode.path: path,
+                            MEpisode.meta_data: metadata,
+                            MEpisode.summary: summary,
+                            MEpisode.keyframes: keyframes,
+                            MEpisode.modified_time: modified_time,
+                        }
+                    )
+                async with database.session() as session:
                     await session.execute(sql)
                     await session.commit()
+                invalidate_episode(item.series_id, item.episode_number)
+
+                assert item.series_id
+                assert item.episode_number
+                await self.add_to_index(
+                    series_id=item.series_id,
+                    episode_number=item.episode_number,
+                    created_at=modified_time,
+                )
 
-                    assert item.series_id
-                    assert item.episode_number
-                    await self.add_to_index(
-                        series_id=item.series_id,
-                        episode_number=item.episode_number,
-                        created_at=modified_time,
-                    )
-
-                    logger.info(
-                        f'[episode-{item.series_id}-{item.episode_number}] Saved {path}'
-                    )
-                except Exception as e:
-                    logger.exception(
-                        f'[episode-{item.series_id}-{item.episode_number}]: {str(e)}'
-                    )
-            else:
-                logger.debug(
-                    f'[episode-{item.series_id}-{item.episode_number}] Nothing changed '
-                    f'for {path}'
+                logger.info(
+                    f'[episode-{item.series_id}-{item.episode_number}] Saved {path}'
                 )
-            if self.make_thumbnails:
-                asyncio.create_task(
-                    self.thumbnails(
-                        f'episode-{item.series_id}-{item.episode_number}', path
-                    )
+            except Exception as e:
+                logger.exception(
+                    f'[episode-{item.series_id}-{item.episode_number}]: {str(e)}'
                 )
-            return True
+        else:
+            logger.debug(
+                f'[episode-{item.series_id}-{item.episode_number}] Nothing changed '
+                f'for {path}'
+            )
+        if self.make_thumbnails:
+            asyncio.create_task(
+                self.thumbnails(f'episode-{item.series_id}-{item.episode_number}', path)
+            )
+        return True
 
     async def add_to_index(
         self, series_id: int, episode_number: int, created_at: datetime | None = None
@@ -175,30 +217,16 @@ class EpisodeScan(PlayScan):
             )
             return
 
-        r = await client.patch(
-            f'/2/play-servers/{config.server_id}/episodes',
-            json=[
-                PlayServerEpisodeCreate(
-                    series_id=series_id,
-                    episode_number=episode_number,
-                    created_at=created_at or datetime.now(tz=UTC),
-                ).model_dump(mode='json')
-            ],
-            headers={
-                'Authorization': f'Secret {config.secret}',
-                'Content-Type': 'application/json',
-            },
-        )
-        if r.status_code >= 400:
-            logger.error(
-                f'[episode-{series_id}-{episode_number}] Failed to add '
-                f'the episode to the play server index: {r.content}'
-            )
-        else:
-            logger.info(
-                f'[episode-{series_id}-{episode_number}] Added to play '
-                f'server index ({config.server_id})'
+        await episode_index.add(
+            PlayServerEpisodeCreate(
+                series_id=series_id,
+                episode_number=episode_number,
+                created_at=created_at or datetime.now(tz=UTC),
             )
+        )
+
+    async def flush_index(self) -> None:
+        await episode_index.flush()
 
     async def delete_path(self, path: str) -> bool:
         async with database.session() as session:
@@ -214,6 +242,7 @@ class EpisodeScan(PlayScan):
                     )
                 )
                 await session.commit()
+                invalidate_episode(episode.series_id, episode.number)
 
                 await self.delete_from_index(
                     series_id=episode.series_id,
@@ -248,19 +277,17 @@ class EpisodeScan(PlayScan):
             )
             return
 
-        r = await client.delete(
-            f'/2/play-servers/{config.server_id}/series/{series_id}/episodes/{episode_number}',
-            headers={'Authorization': f'Secret {config.secret}'},
+        if not await send_to_index(
+            'DELETE', f'series/{series_id}/episodes/{episode_number}'
+        ):
+            return
+        await forget_indexed(
+            MIndexedEpisode,
+            [{'series_id': series_id, 'episode_number': episode_number}],
+        )
+        logger.info(
+            f'[episode-{series_id}-{episode_number}] Removed from play server index'
         )
-        if r.status_code >= 400:
-            logger.error(
-                f'[episode-{series_id}-{episode_number}] Faild to remove the episode '
-                f'from the play server index: {r.content}'
-            )
-        else:
-            logger.info(
-                f'[episode-{series_id}-{episode_number}] Removed from play server index'
-            )
 
     def regex_parse_file_name(self, filename: str) -> ParsedFileEpisode | None:
         result = ParsedFileEpisode()
@@ -343,6 +370,69 @@ class EpisodeScan(PlayScan):
         logger.info(f"{filename} doesn't look like an episode")
         return None
 
+    async def get_known_files(self) -> dict[str, datetime | None]:
+        async with database.session() as session:
+            rows = await session.execute(
+                sa.select(MEpisode.path, MEpisode.modified_time).where(
+                    MEpisode.path.like(f'{self.scan_path}%'),
+                    MEpisode.summary.is_not(None),
+                )
+            )
+            return {path: modified_time for path, modified_time in rows}
+
+    async def move_path(self, old_path: str, new_path: str) -> bool:
+        modified_time = self.get_file_modified_time(new_path)
+        if not os.path.isdir(new_path) and not await self.is_same_episode(
+            old_path, new_path, modified_time
+        ):
+            return False
+        async with database.session() as session:
+            moved = await move_paths(
+                session,
+                MEpisode.path,
+                MEpisode.modified_time,
+                old_path,
+                new_path,
+                modified_time,
+            )
+            await session.commit()
+        if moved:
+            # The cached sources have the old paths
+            metadata_cache.clear()
+            logger.info(f'Moved {moved} episodes from {old_path} to {new_path}')
+        return moved > 0
+
+    async def is_same_episode(
+        self, old_path: str, new_path: str, modified_time: datetime | None
+    ) -> bool:
+        """
+        Whether the file at `new_path` is the one saved for `old_path`.
+
+        It must have the saved modified time and since a renamed file keeps
+        it, the new name must also be parsed as the same episode.
+        """
+        async with database.session() as session:
+            ep = (
+                await session.execute(
+                    sa.select(MEpisode.series_id, MEpisode.number).where(
+                        MEpisode.path == old_path,
+                        MEpisode.modified_time == modified_time,
+                    )
+                )
+            ).first()
+        if not ep:
+            return False
+        item = self.parse(new_path)
+        if not item or not await self.lookup_episode(item, new_path):
+            return False
+        if (item.series_id, item.episode_number) != (ep.series_id, ep.number):
+            logger.info(
+                f'[episode-{ep.series_id}-{ep.number}] {new_path} is another '
+                f'episode than {old_path}'
+            )
+            return False
+        return True
+
     async def get_paths_matching_base_path(self, base_path: str) -> list[str]:
         async with database.session() as session:
             results = await session.scalars(
@@ -365,12 +455,26 @@ class SeriesIdLookup:
         """
         Tries to find the series on SEPLIS by it's title.
 
+        A title that wasn't found is not searched for again
+        until `config.series_not_found_ttl` has passed.
+
         :param file_title: str
         :returns: int
         """
-        series_id = await self.db_lookup(file_title)
-        if series_id:
-            return series_id
+        async with database.session() as session:
+            series = await session.get(MSeriesIdLookup, file_title)
+        if series:
+            if series.series_id:
+                return series.series_id
+            if series.updated_at and series.updated_at > datetime.now(tz=UTC) - timedelta(
+                seconds=config.series_not_found_ttl
+            ):
+                return None
+        return await series_searches.run(
+            file_title, lambda: self.web_lookup_and_save(file_title)
+        )
+
+    async def web_lookup_and_save(self, file_title: str) -> int | None:
         series = await self.web_lookup(file_title)
         series_id = series[0]['id'] if series else None
         series_title = series[0]['title'] if series else None
@@ -385,17 +489,6 @@ class SeriesIdLookup:
             await session.commit()
         return series_id
 
-    async def db_lookup(self, file_title: str) -> int | None:
-        async with database.session() as session:
-            series = await session.scalar(
-                sa.select(MSeriesIdLookup).where(
-                    MSeriesIdLookup.file_title == file_title,
-                )
-            )
-            if not series or not series.series_id:
-                return None
-            return series.series_id
-
     async def web_lookup(self, file_title: str) -> list[dict[str, Any]]:
         r = await client.get(
             '/2/search',
@@ -464,6 +557,18 @@ class EpisodeNumberLookup:
         return value
 
     async def web_lookup(self, episode: ParsedFileEpisode) -> int | None:
+        """
+        Looks for the episode in the series' episode list, which is only
+        requested once, and asks for the episode directly if it's not there.
+        """
+        assert episode.series_id
+        value = self.get_lookup_value(episode)
+        if not value:
+            raise Exception('Unknown parsed episode object')
+        numbers = await self.get_episode_numbers(episode.series_id)
+        if numbers and value in numbers:
+            return numbers[value]
+
         params: dict[str, Any] = {}
         if episode.season and episode.episode:
             params = {
@@ -474,11 +579,44 @@ class EpisodeNumberLookup:
             params = {
                 'air_date': episode.date.strftime('%Y-%m-%d'),
             }
-        else:
-            raise Exception('Unknown parsed episode object')
         r = await client.get(f'/2/series/{episode.series_id}/episodes', params=params)
         r.raise_for_status()
         episodes = PageCursorResult[Episode].model_validate(r.json())
         if not episodes.items:
             return None
         return episodes.items[0].number
+
+    async def get_episode_numbers(self, series_id: int) -> dict[str, int] | None:
+        numbers = series_episode_numbers.get(series_id)
+        if numbers is None:
+            numbers = await episode_list_requests.run(
+                series_id, lambda: self.web_episode_numbers(series_id)
+            )
+        return numbers
+
+    async def web_episode_numbers(self, series_id: int) -> dict[str, int] | None:
+        numbers: dict[str, int] = {}
+        cursor: str | None = None
+        while True:
+            params: dict[str, Any] = {'per_page': 500}
+            if cursor:
+                params['cursor'] = cursor
+            r = await client.get(f'/2/series/{series_id}/episodes', params=params)
+            try:
+                r.raise_for_status()
+            except httpx.HTTPStatusError:
+                logger.warning(
+                    f'[series-{series_id}] Failed to get the episodes: {r.content}'
+                )
+                return None
+            episodes = PageCursorResult[Episode].model_validate(r.json())
+            for e in episodes.items:
+                if e.season and e.episode:
+                    numbers[f'{e.season}-{e.episode}'] = e.number
+                if e.air_date:
+                    numbers.setdefault(e.air_date.strftime('%Y-%m-%d'), e.number)
+            cursor = episodes.cursor
+            if not cursor or not episodes.items:
+                break
+        series_episode_numbers.set(series_id, numbers)
+        return numbers
@@ -1,19 +1,28 @@
-from datetime import date, datetime
+import asyncio
+import time
+from datetime import UTC, date, datetime
+from pathlib import Path
 from typing import Any, cast
 from unittest import mock
 
 import httpx
+import jwt
 import pytest
 import respx
 import sqlalchemy as sa
 
+from seplis_play import config
 from seplis_play.database import Database
+from seplis_play.dependencies import get_sources
+from seplis_play.metadata_cache import metadata_cache
 from seplis_play.scan import EpisodeScan
-from seplis_play.scanners.episode.episode_models import MEpisode
+from seplis_play.scanners.episode.episode_models import MEpisode, MIndexedEpisode
+from seplis_play.scanners.episode.episode_scan import series_episode_numbers
 from seplis_play.scanners.episode.episode_schemas import Episode, ParsedFileEpisode
 from seplis_play.schemas.page_cursor_schema import PageCursorResult
 from seplis_play.schemas.source_metadata_schemas import SourceMetadata
 from seplis_play.testbase import run_file
+from seplis_play.utils.json_utils import json_loads
 
 
 @pytest.mark.asyncio
@@ -69,7 +78,7 @@ async def test_series_id_lookup(play_db_test: Database) -> None:
 
     scanner = EpisodeScan(scan_path='/', cleanup_mode=True, make_thumbnails=False)
 
-    respx.get('/2/search').mock(
+    search = respx.get('/2/search').mock(
         return_value=httpx.Response(
             200,
             json=[
@@ -81,9 +90,33 @@ async def test_series_id_lookup(play_db_test: Database) -> None:
         )
     )
 
-    assert not await scanner.series_id.db_lookup('test series')
     assert 1 == await scanner.series_id.lookup('test series')
-    assert 1 == await scanner.series_id.db_lookup('test series')
+    # Found in the db the next time
+    assert 1 == await scanner.series_id.lookup('test series')
+    assert search.call_count == 1
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_series_id_lookup_not_found(play_db_test: Database) -> None:
+    from seplis_play.scanners import EpisodeScan
+
+    scanner = EpisodeScan(scan_path='/', cleanup_mode=True, make_thumbnails=False)
+    search = respx.get('/2/search').mock(return_value=httpx.Response(200, json=[]))
+
+    # Concurrent lookups of the same title share one search
+    assert await asyncio.gather(
+        scanner.series_id.lookup('unknown series'),
+        scanner.series_id.lookup('unknown series'),
+    ) == [None, None]
+    assert search.call_count == 1
+
+    # Not found is remembered until the ttl has passed
+    assert await scanner.series_id.lookup('unknown series') is None
+    assert search.call_count == 1
+    with mock.patch.object(config, 'series_not_found_ttl', 0):
+        assert await scanner.series_id.lookup('unknown series') is None
+    assert search.call_count == 2
 
 
 @pytest.mark.asyncio
@@ -175,6 +208,46 @@ async def test_save_item(play_db_test: Database) -> None:
         assert len(r) == 2
 
 
+@pytest.mark.asyncio
+async def test_save_item_invalidates_cached_sources(
+    play_db_test: Database, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config, 'secret', 'secret')
+    metadata_cache.clear()
+    scanner = EpisodeScan(scan_path='/', cleanup_mode=True, make_thumbnails=False)
+    mock_get_file_modified_time = mock.MagicMock(
+        return_value=datetime(2014, 11, 14, 21, 25, 58)
+    )
+    cast(Any, scanner).get_file_modified_time = mock_get_file_modified_time
+    mock_get_metadata = mock.AsyncMock(
+        return_value={'format': {'duration': '1.0', 'probe_score': 100}}
+    )
+    cast(Any, scanner).get_metadata = mock_get_metadata
+    item = ParsedFileEpisode(series_id=1, title='ncis', episode_number=2)
+    path = '/ncis/ncis.s01e02.mp4'
+    play_id = jwt.encode(
+        {'type': 'series', 'series_id': 1, 'number': 2, 'exp': int(time.time()) + 60},
+        'secret',
+        algorithm='HS256',
+    )
+
+    with mock.patch('os.path.exists', return_value=True):
+        await scanner.save_item(item, path)
+    sources = await get_sources(play_id)
+    # Only the summary is loaded
+    assert sources == [{'streams': [], 'format': {'duration': '1.0'}}]
+    assert await get_sources(play_id) is sources
+
+    mock_get_file_modified_time.return_value = datetime(2014, 11, 15, 21, 25, 58)
+    mock_get_metadata.return_value = {'format': {'duration': '2.0'}}
+    with mock.patch('os.path.exists', return_value=True):
+        await scanner.save_item(item, path)
+    assert await get_sources(play_id) == [{'streams': [], 'format': {'duration': '2.0'}}]
+
+    await scanner.delete_path(path)
+    assert await get_sources(play_id) == []
+
+
 @pytest.mark.asyncio
 @respx.mock
 async def test_episode_number_lookup(play_db_test: Database) -> None:
@@ -182,10 +255,17 @@ async def test_episode_number_lookup(play_db_test: Database) -> None:
 
     scanner = EpisodeScan(scan_path='/', cleanup_mode=True, make_thumbnails=False)
 
-    respx.get('/2/series/1/episodes', params={'season': '1', 'episode': '2'}).mock(
+    series_episode_numbers.clear()
+    # The episode list doesn't have the air date episode yet
+    episode_list = respx.get('/2/series/1/episodes', params={'per_page': '500'}).mock(
         return_value=httpx.Response(
             200,
-            json=PageCursorResult[Episode](items=[Episode(number=2)]).model_dump(),
+            json=PageCursorResult[Episode](
+                items=[
+                    Episode(number=1, season=1, episode=1),
+                    Episode(number=2, season=1, episode=2),
+                ]
+            ).model_dump(mode='json'),
         )
     )
     episode = ParsedFileEpisode(
@@ -197,6 +277,9 @@ async def test_episode_number_lookup(play_db_test: Database) -> None:
     assert not await scanner.episode_number.db_lookup(episode)
     assert 2 == await scanner.episode_number.lookup(episode)
     assert 2 == await scanner.episode_number.db_lookup(episode)
+    episode = ParsedFileEpisode(series_id=1, title='NCIS', season=1, episode=1)
+    assert 1 == await scanner.episode_number.lookup(episode)
+    assert episode_list.call_count == 1
 
     respx.get('/2/series/1/episodes', params={'air_date': '2014-11-14'}).mock(
         return_value=httpx.Response(
@@ -212,6 +295,7 @@ async def test_episode_number_lookup(play_db_test: Database) -> None:
     assert not await scanner.episode_number.db_lookup(episode)
     assert 3 == await scanner.episode_number.lookup(episode)
     assert 3 == await scanner.episode_number.db_lookup(episode)
+    assert episode_list.call_count == 1
 
     episode = ParsedFileEpisode(
         series_id=1,
@@ -309,5 +393,51 @@ async def test_parse_episodes(play_db_test: Database) -> None:
     assert info.title == 'the last of us'
 
 
+@pytest.mark.asyncio
+@respx.mock
+async def test_cleanup_episodes(
+    play_db_test: Database, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    from seplis_play.scanners import cleanup_episodes
+
+    monkeypatch.setattr(config, 'server_id', '123')
+    put_index = respx.put('/2/play-servers/123/episodes').mock(
+        return_value=httpx.Response(204)
+    )
+    episodes = [
+        (1, 1, 'Show.S01E01.mkv', datetime(2024, 1, 1, tzinfo=UTC)),
+        (1, 1, 'Show.S01E01.1080p.mkv', datetime(2024, 2, 1, tzinfo=UTC)),
+        (2, 1, 'Other.S01E01.mkv', datetime(2024, 3, 1, tzinfo=UTC)),
+    ]
+    async with play_db_test.session() as session:
+        for series_id, number, filename, modified_time in episodes:
+            (tmp_path / filename).touch()
+            await session.execute(
+                sa.insert(MEpisode).values(
+                    series_id=series_id,
+                    number=number,
+                    path=str(tmp_path / filename),
+                    modified_time=modified_time,
+                )
+            )
+        await session.commit()
+
+    await cleanup_episodes()
+
+    # One entry per episode with the time its latest file was added
+    assert sorted(
+        json_loads(put_index.calls[0].request.content),
+        key=lambda e: e['series_id'],
+    ) == [
+        {'series_id': 1, 'episode_number': 1, 'created_at': '2024-02-01T00:00:00Z'},
+        {'series_id': 2, 'episode_number': 1, 'created_at': '2024-03-01T00:00:00Z'},
+    ]
+    async with play_db_test.session() as session:
+        assert sorted(await session.scalars(sa.select(MIndexedEpisode.series_id))) == [
+            1,
+            2,
+        ]
+
+
 if __name__ == '__main__':
     run_file(__file__)
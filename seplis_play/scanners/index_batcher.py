@@ -0,0 +1,175 @@
+import asyncio
+from collections.abc import AsyncIterator, Callable
+from typing import Any, Literal
+
+import httpx
+import sqlalchemy as sa
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from seplis_play import config, database, logger
+from seplis_play.client import client
+from seplis_play.utils.json_utils import json_dumps
+
+RETRY_DELAY = 1.0  # Seconds, doubled for every attempt
+
+
+class IndexBatcher[T: BaseModel]:
+    """
+    Collects play server index entries and sends them with one PATCH per batch.
+
+    A batch is sent when `config.index_batch_size` entries are waiting or
+    `config.index_batch_wait` seconds after the first entry was added.
+    Call `flush` when done to send what is left.
+
+    The sent entries are recorded in the `indexed` table, so the next
+    `sync_index` doesn't send them again.
+    """
+
+    def __init__(self, name: str, indexed: Any) -> None:
+        self.name = name
+        self.indexed = indexed
+        self.items: list[T] = []
+        self._timer: asyncio.Task[None] | None = None
+        self._lock = asyncio.Lock()
+
+    async def add(self, item: T) -> None:
+        self.items.append(item)
+        if len(self.items) >= config.index_batch_size:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        if self._timer and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            while self.items:
+                batch = self.items[: config.index_batch_size]
+                del self.items[: config.index_batch_size]
+                if await send_to_index('PATCH', self.name, json_dumps(batch).encode()):
+                    await record_indexed(
+                        self.indexed, [item.model_dump() for item in batch]
+                    )
+                    logger.info(
+                        f'Added {len(batch)} {self.name} to the play server index '
+                        f'({config.server_id})'
+                    )
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(config.index_batch_wait)
+        await self.flush()
+
+
+async def send_to_index(
+    method: Literal['PATCH', 'PUT', 'DELETE'],
+    name: str,
+    content: bytes | Callable[[], AsyncIterator[bytes]] | None = None,
+    timeout: float = 30,
+) -> bool:
+    """
+    Sends `content` to the play server's `name` index, `name` can also be
+    the path of an item in the index.
+
+    Connection errors, 429 and 5xx responses are retried with backoff,
+    A streamed body is given as a function that is called for every attempt,
+    so it starts over.
+
+    :returns: False if it failed, the error has been logged.
+    """
+    error = ''
+    for attempt in range(config.index_batch_retries + 1):
+        if attempt:
+            await asyncio.sleep(min(RETRY_DELAY * 2 ** (attempt - 1), 30))
+        try:
+            r = await client.request(
+                method,
+                f'/2/play-servers/{config.server_id}/{name}',
+                content=content() if callable(content) else content,
+                headers={
+                    'Authorization': f'Secret {config.secret}',
+                    'Content-Type': 'application/json',
+                },
+                timeout=timeout,
+            )
+        except httpx.TransportError as e:
+            error = str(e) or e.__class__.__name__
+            continue
+        if r.status_code < 400 or (method == 'DELETE' and r.status_code == 404):
+            return True
+        error = r.text
+        # Retrying won't fix a bad request
+        if r.status_code < 500 and r.status_code != 429:
+            break
+    logger.error(
+        f'Failed to update the {name} play server index ({config.server_id}): {error}'
+    )
+    return False
+
+
+def get_indexed_keys(indexed: Any) -> tuple[str, ...]:
+    return tuple(c.name for c in sa.inspect(indexed).primary_key if c.name != 'server_id')
+
+
+async def record_indexed(indexed: Any, items: list[dict[str, Any]]) -> None:
+    """
+    Records `items` as sent to the play server's index in the `indexed`
+    table, replacing what was recorded for them before.
+
+    An item can be in `items` more than once, e.g. when two files of an
+    episode were saved in the same batch, the latest `created_at` is kept.
+    """
+    if not items:
+        return
+    keys = get_indexed_keys(indexed)
+    latest: dict[tuple[Any, ...], dict[str, Any]] = {}
+    for item in items:
+        key = tuple(item[k] for k in keys)
+        recorded = latest.get(key)
+        if recorded is None or (
+            item['created_at'] is not None
+            and (
+                recorded['created_at'] is None
+                or item['created_at'] > recorded['created_at']
+            )
+        ):
+            latest[key] = item
+    async with database.session() as session:
+        await forget_indexed(indexed, list(latest.values()), session=session)
+        await session.execute(
+            sa.insert(indexed),
+            [
+                {
+                    'server_id': config.server_id,
+                    **{k: item[k] for k in keys},
+                    'created_at': item['created_at'],
+                }
+                for item in latest.values()
+            ],
+        )
+        await session.commit()
+
+
+async def forget_indexed(
+    indexed: Any, items: list[dict[str, Any]], session: AsyncSession | None = None
+) -> None:
+    """
+    Removes `items` from the `indexed` table after they were removed from
+    the play server's index.
+    """
+    if not items:
+        return
+    keys = get_indexed_keys(indexed)
+    query = sa.delete(indexed).where(
+        indexed.server_id == config.server_id,
+        sa.tuple_(*[getattr(indexed, k) for k in keys]).in_(
+            [tuple(item[k] for k in keys) for item in items]
+        ),
+    )
+    if session:
+        await session.execute(query)
+        return
+    async with database.session() as session:
+        await session.execute(query)
+        await session.commit()
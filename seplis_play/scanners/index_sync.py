@@ -0,0 +1,126 @@
+import asyncio
+from collections.abc import Callable
+from datetime import UTC, datetime
+from typing import Any
+
+import sqlalchemy as sa
+
+from seplis_play import config, database, logger
+from seplis_play.utils.json_utils import json_dumps
+
+from .cleanup_base import stream_index
+from .index_batcher import forget_indexed, record_indexed, send_to_index
+
+# DELETE requests sent at a time
+REMOVE_CONCURRENCY = 10
+
+
+async def sync_index(
+    name: str,
+    current: sa.Subquery,
+    indexed: Any,
+    keys: tuple[str, ...],
+    item_path: Callable[[sa.Row[Any]], str],
+    full: bool = False,
+) -> None:
+    """
+    Brings the play server's `name` index up to date with `current`,
+    a subquery of the `keys` followed by `created_at` of the saved items.
+
+    What was sent is kept in the `indexed` table, so only the items added,
+    changed or removed since the last sync are sent. The whole index is
+    replaced if nothing has been sent to the server yet, if `full` is set or
+    if more items were removed than fit in a batch.
+    """
+    server_id = config.server_id
+    indexed_keys = [getattr(indexed, k) for k in keys]
+    current_keys = [current.c[k] for k in keys]
+
+    def item(row: sa.Row[Any]) -> dict[str, Any]:
+        return {
+            **{k: row._mapping[k] for k in keys},
+            'created_at': row.created_at or datetime.now(tz=UTC),
+        }
+
+    async def replace() -> None:
+        if not await send_to_index(
+            'PUT',
+            name,
+            lambda: stream_index(sa.select(current), item),
+            timeout=900,
+        ):
+            return
+        async with database.session() as session:
+            await session.execute(
+                sa.delete(indexed).where(indexed.server_id == server_id)
+            )
+            await session.execute(
+                sa.insert(indexed).from_select(
+                    ['server_id', *keys, 'created_at'],
+                    sa.select(sa.literal(server_id), *current_keys, current.c.created_at),
+                )
+            )
+            await session.commit()
+        logger.info(f'Replaced the {name} play server index ({server_id})')
+
+    async with database.session() as session:
+        synced = await session.scalar(
+            sa.select(sa.exists().where(indexed.server_id == server_id))
+        )
+    if full or not synced:
+        await replace()
+        return
+
+    joined = sa.and_(
+        indexed.server_id == server_id,
+        *[a == b for a, b in zip(indexed_keys, current_keys, strict=True)],
+    )
+    async with database.session() as session:
+        additions = (
+            await session.execute(
+                sa.select(current)
+                .outerjoin(indexed, joined)
+                .where(
+                    sa.or_(
+                        indexed.server_id.is_(None),
+                        indexed.created_at != current.c.created_at,
+                    )
+                )
+            )
+        ).all()
+        removals = (
+            await session.execute(
+                sa.select(*indexed_keys)
+                .outerjoin(current, joined)
+                .where(indexed.server_id == server_id, current_keys[0].is_(None))
+            )
+        ).all()
+
+    if len(removals) > config.index_batch_size:
+        # There is no batch delete, one PUT is cheaper than this many DELETEs
+        await replace()
+        return
+
+    for i in range(0, len(additions), config.index_batch_size):
+        batch = [item(row) for row in additions[i : i + config.index_batch_size]]
+        if not await send_to_index('PATCH', name, json_dumps(batch).encode()):
+            # The rest is sent with the next sync
+            return
+        await record_indexed(indexed, batch)
+
+    limit = asyncio.Semaphore(REMOVE_CONCURRENCY)
+
+    async def remove(row: sa.Row[Any]) -> bool:
+        async with limit:
+            return await send_to_index('DELETE', item_path(row))
+
+    removed = await asyncio.gather(*[remove(row) for row in removals])
+    await forget_indexed(
+        indexed,
+        [row._asdict() for row, ok in zip(removals, removed, strict=True) if ok],
+    )
+
+    logger.info(
+        f'Sent {len(additions)} added and {len(removals)} removed {name} '
+        f'to the play server index ({server_id})'
+    )
@@ -0,0 +1,195 @@
+from array import array
+from collections.abc import Iterator
+from typing import BinaryIO
+
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CLUSTER = 0x1F43B675
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TIME = 0xB3
+CUE_TRACK_POSITIONS = 0xB7
+CUE_TRACK = 0xF7
+
+TRACK_TYPE_VIDEO = 1
+DEFAULT_TIMESTAMP_SCALE = 1_000_000  # nanoseconds
+# The cues of a long movie are a few hundred KB, don't read anything silly
+MAX_ELEMENT_SIZE = 64 * 1024 * 1024
+
+
+class MatroskaError(Exception):
+    pass
+
+
+def read_cue_keyframes(path: str) -> array | None:
+    """
+    Read the video keyframe timestamps, in microseconds, from the Cues element
+    of a Matroska file.
+
+    Only the elements before the first cluster and the ones the SeekHead points
+    to are read, the clusters are skipped.
+
+    :returns: None if the file has no cues for a video track.
+    """
+    with open(path, 'rb') as f:
+        return _read_cue_keyframes(f)
+
+
+def _read_cue_keyframes(f: BinaryIO) -> array | None:
+    header = _read_header(f, 0)
+    if not header or header[0] != EBML_HEADER or header[1] is None:
+        return None
+    segment = _read_header(f, header[2] + header[1])
+    if not segment or segment[0] != SEGMENT:
+        return None
+    _, segment_size, segment_start = segment
+    segment_end = segment_start + segment_size if segment_size is not None else None
+
+    elements: dict[int, memoryview] = {}
+    positions: dict[int, int] = {}
+    pos = segment_start
+    while segment_end is None or pos < segment_end:
+        element = _read_header(f, pos)
+        if not element:
+            break
+        id_, size, data_pos = element
+        if id_ == CLUSTER or size is None:
+            break
+        if id_ in (SEEK_HEAD, INFO, TRACKS, CUES) and id_ not in elements:
+            elements[id_] = _read_body(f, data_pos, size)
+            if id_ == SEEK_HEAD:
+                for seek_id, seek_position in _seek_entries(elements[id_]):
+                    positions.setdefault(seek_id, segment_start + seek_position)
+        pos = data_pos + size
+
+    # The cues are usually written after the clusters
+    for id_ in (INFO, TRACKS, CUES):
+        if id_ in elements or id_ not in positions:
+            continue
+        element = _read_header(f, positions[id_])
+        if element and element[0] == id_ and element[1] is not None:
+            elements[id_] = _read_body(f, element[2], element[1])
+
+    if CUES not in elements or TRACKS not in elements:
+        return None
+    timestamp_scale = DEFAULT_TIMESTAMP_SCALE
+    if INFO in elements:
+        for id_, body in _children(elements[INFO]):
+            if id_ == TIMESTAMP_SCALE:
+                timestamp_scale = _uint(body)
+    video_tracks = _video_tracks(elements[TRACKS])
+    if not video_tracks:
+        return None
+
+    keyframes = array('q')
+    for id_, cue_point in _children(elements[CUES]):
+        if id_ != CUE_POINT:
+            continue
+        time: int | None = None
+        tracks: set[int] = set()
+        for child_id, body in _children(cue_point):
+            if child_id == CUE_TIME:
+                time = _uint(body)
+            elif child_id == CUE_TRACK_POSITIONS:
+                tracks.update(_uint(b) for i, b in _children(body) if i == CUE_TRACK)
+        if time is not None and tracks & video_tracks:
+            keyframes.append(time * timestamp_scale // 1000)
+    if not keyframes:
+        return None
+    return array('q', sorted(set(keyframes)))
+
+
+def _video_tracks(tracks: memoryview) -> set[int]:
+    result: set[int] = set()
+    for id_, entry in _children(tracks):
+        if id_ != TRACK_ENTRY:
+            continue
+        number = type_ = None
+        for child_id, body in _children(entry):
+            if child_id == TRACK_NUMBER:
+                number = _uint(body)
+            elif child_id == TRACK_TYPE:
+                type_ = _uint(body)
+        if number is not None and type_ == TRACK_TYPE_VIDEO:
+            result.add(number)
+    return result
+
+
+def _seek_entries(seek_head: memoryview) -> Iterator[tuple[int, int]]:
+    for id_, seek in _children(seek_head):
+        if id_ != SEEK:
+            continue
+        seek_id = seek_position = None
+        for child_id, body in _children(seek):
+            if child_id == SEEK_ID:
+                seek_id = _uint(body)
+            elif child_id == SEEK_POSITION:
+                seek_position = _uint(body)
+        if seek_id is not None and seek_position is not None:
+            yield seek_id, seek_position
+
+
+def _read_header(f: BinaryIO, pos: int) -> tuple[int, int | None, int] | None:
+    """
+    :returns: element id, data size (None if unknown) and the data position.
+    """
+    f.seek(pos)
+    data = f.read(12)
+    if len(data) < 2:
+        return None
+    id_, p = _read_vint(data, 0, keep_marker=True)
+    size, p = _read_vint(data, p, keep_marker=False)
+    assert id_ is not None
+    return id_, size, pos + p
+
+
+def _read_body(f: BinaryIO, pos: int, size: int) -> memoryview:
+    if size > MAX_ELEMENT_SIZE:
+        raise MatroskaError(f'Element at {pos} is too large: {size}')
+    f.seek(pos)
+    data = f.read(size)
+    if len(data) != size:
+        raise MatroskaError(f'Element at {pos} is truncated')
+    return memoryview(data)
+
+
+def _children(data: memoryview) -> Iterator[tuple[int, memoryview]]:
+    pos = 0
+    while pos < len(data):
+        id_, pos = _read_vint(data, pos, keep_marker=True)
+        size, pos = _read_vint(data, pos, keep_marker=False)
+        if id_ is None or size is None:
+            raise MatroskaError('Child element with an unknown size')
+        yield id_, data[pos : pos + size]
+        pos += size
+
+
+def _read_vint(
+    data: bytes | memoryview, pos: int, keep_marker: bool
+) -> tuple[int | None, int]:
+    if pos >= len(data):
+        raise MatroskaError('Unexpected end of data')
+    first = data[pos]
+    length = 9 - first.bit_length()
+    if first == 0 or pos + length > len(data):
+        raise MatroskaError(f'Invalid variable size integer at {pos}')
+    value = first if keep_marker else first & (0xFF >> length)
+    for i in range(1, length):
+        value = (value << 8) | data[pos + i]
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None, pos + length
+    return value, pos + length
+
+
+def _uint(data: memoryview) -> int:
+    return int.from_bytes(data, 'big')
@@ -22,5 +22,21 @@ class MMovie(SABase):
 
     movie_id: Mapped[int] = mapped_column(sa.Integer, nullable=False)
     path: Mapped[str] = mapped_column(sa.String(400), primary_key=True)
+    # The full ffprobe output
     meta_data: Mapped[SourceMetadata | None] = mapped_column('metadata', sa.JSON)
+    # The fields of `meta_data` that are read when playing, see
+    # `source_metadata_summary`
+    summary: Mapped[SourceMetadata | None] = mapped_column(sa.JSON)
+    # Packed keyframe timestamps, see `keyframes_utils`
+    keyframes: Mapped[bytes | None] = mapped_column(sa.LargeBinary(2**24 - 1))
     modified_time: Mapped[datetime | None] = mapped_column(UtcDateTime)
+
+
+class MIndexedMovie(SABase):
+    """What was last sent to a play server's movie index, see `sync_index`."""
+
+    __tablename__ = 'indexed_movies'
+
+    server_id: Mapped[str] = mapped_column(sa.String(100), primary_key=True)
+    movie_id: Mapped[int] = mapped_column(sa.Integer, primary_key=True)
+    created_at: Mapped[datetime | None] = mapped_column(UtcDateTime)
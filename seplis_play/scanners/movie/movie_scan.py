@@ -10,12 +10,23 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from seplis_play import config, logger
 from seplis_play.client import client
 from seplis_play.database import database
-from seplis_play.scanners.movie.movie_models import MMovie, MMovieIdLookup
+from seplis_play.metadata_cache import invalidate_movie, metadata_cache
+from seplis_play.scanners.movie.movie_models import (
+    MIndexedMovie,
+    MMovie,
+    MMovieIdLookup,
+)
 from seplis_play.scanners.movie.movie_schemas import PlayServerMovieCreate
-from seplis_play.schemas.source_metadata_schemas import SourceMetadata
+from seplis_play.schemas.source_metadata_schemas import (
+    source_metadata_summary,
+)
 
+from ..cleanup_base import move_paths
+from ..index_batcher import IndexBatcher, forget_indexed, send_to_index
 from ..scan_base import PlayScan
 
+movie_index = IndexBatcher[PlayServerMovieCreate]('movies', MIndexedMovie)
+
 
 class MovieScan(PlayScan):
     SCANNER_NAME = 'Movies'
@@ -43,62 +54,72 @@ class MovieScan(PlayScan):
         if not os.path.exists(path):
             logger.debug(f"Path doesn't exist any longer: {path}")
             return False
+        # No session is kept open during the lookup and the probe, with many
+        # workers they would otherwise use up the connection pool.
         async with database.session() as session:
             movie = await session.scalar(
                 sa.select(MMovie).where(
                     MMovie.path == path,
                 )
             )
-            movie_id: int | None = movie.movie_id if movie else None
-            modified_time: datetime | None = self.get_file_modified_time(path)
+        movie_id: int | None = movie.movie_id if movie else None
+        modified_time: datetime | None = self.get_file_modified_time(path)
 
-            if not movie or (movie.modified_time != modified_time) or not movie.meta_data:  # type: ignore[operator]
-                if not movie_id:
+        if not movie or (movie.modified_time != modified_time) or not movie.meta_data:  # type: ignore[operator]
+            if not movie_id:
+                async with self.lock(('movie', item)):
                     movie_id = await self.lookup(item)
-                    if not movie_id:
-                        logger.info(f'No movie found for {item} ({path})')
-                        return False
-                try:
-                    metadata: SourceMetadata = await self.get_metadata(path)
-                    if not metadata:
-                        return False
-
-                    if movie:
-                        sql = (
-                            sa.update(MMovie)
-                            .where(
-                                MMovie.path == path,
-                            )
-                            .values(
-                                {
-                                    MMovie.movie_id: movie_id,
-                                    MMovie.meta_data: metadata,
-                                    MMovie.modified_time: modified_time,
-                                }
-                            )
+                if not movie_id:
+                    logger.info(f'No movie found for {item} ({path})')
+                    return False
+            try:
+                metadata, keyframes = await self.probe(path)
+                if not metadata:
+                    return False
+                summary = source_metadata_summary(metadata)
+
+                if movie:
+                    sql = (
+                        sa.update(MMovie)
+                        .where(
+                            MMovie.path == path,
                         )
-                    else:
-                        sql = sa.insert(MMovie).values(
+                        .values(
                             {
                                 MMovie.movie_id: movie_id,
-                                MMovie.path: path,
                                 MMovie.meta_data: metadata,
+                                MMovie.summary: summary,
+                                MMovie.keyframes: keyframes,
                                 MMovie.modified_time: modified_time,
                             }
                         )
+                    )
+                else:
+                    sql = sa.insert(MMovie).values(
+                        {
+                            MMovie.movie_id: movie_id,
+                            MMovie.path: path,
+                            MMovie.meta_data: metadata,
+                            MMovie.summary: summary,
+                            MMovie.keyframes: keyframes,
+                            MMovie.modified_time: modified_time,
+                        }
+                    )
+                async with database.session() as session:
                     await session.execute(sql)
                     await session.commit()
+                invalidate_movie(movie_id)
 
-                    await self.add_to_index(movie_id=movie_id, created_at=modified_time)
+                await self.add_to_index(movie_id=movie_id, created_at=modified_time)
 
-                    logger.info(f'[movie-{movie_id}] Saved {path}')
-                except Exception as e:
-                    logger.error(str(e))
-            else:
-                logger.debug(f'[movie-{movie_id}] Nothing changed for {path}')
-            if self.make_thumbnails:
-                asyncio.create_task(self.thumbnails(f'movie-{movie_id}', path))
-            return True
+                logger.info(f'[movie-{movie_id}] Saved {path}')
+            except Exception as e:
+                logger.error(str(e))
+        else:
+            logger.debug(f'[movie-{movie_id}] Nothing changed for {path}')
+        if self.make_thumbnails:
+            asyncio.create_task(self.thumbnails(f'movie-{movie_id}', path))
+        return True
 
     async def add_to_index(
         self, movie_id: int, created_at: datetime | None = None
@@ -108,29 +129,17 @@ class MovieScan(PlayScan):
 
         if not config.server_id:
             logger.warning(f'[movie-{movie_id}] No server_id specified')
+            return
 
-        r = await client.patch(
-            f'/2/play-servers/{config.server_id}/movies',
-            json=[
-                PlayServerMovieCreate(
-                    movie_id=movie_id,
-                    created_at=created_at or datetime.now(tz=UTC),
-                ).model_dump(mode='json')
-            ],
-            headers={
-                'Authorization': f'Secret {config.secret}',
-                'Content-Type': 'application/json',
-            },
-        )
-        if r.status_code >= 400:
-            logger.error(
-                f'[movie-{movie_id}] Faild to add the movie to '
-                f'the play server index ({config.server_id}): {r.content}'
-            )
-        else:
-            logger.info(
-                f'[movie-{movie_id}] Added to play server index ({config.server_id})'
+        await movie_index.add(
+            PlayServerMovieCreate(
+                movie_id=movie_id,
+                created_at=created_at or datetime.now(tz=UTC),
             )
+        )
+
+    async def flush_index(self) -> None:
+        await movie_index.flush()
 
     async def lookup(self, title: str) -> int | None:
         logger.debug(f'Looking for a movie with title: "{title}"')
@@ -140,32 +149,33 @@ class MovieScan(PlayScan):
                     MMovieIdLookup.file_title == title,
                 )
             )
-            if not movie:
-                r = await client.get(
-                    '/2/search',
-                    params={
-                        'title': title,
-                        'type': 'movie',
-                    },
-                )
-                r.raise_for_status()
-                movies: list[dict[str, Any]] = r.json()
-                if not movies:
-                    return None
-                logger.debug(f'[movie-{movies[0]["id"]}] Found: {movies[0]["title"]}')
-                movie = MMovieIdLookup(
-                    file_title=title,
-                    movie_title=movies[0]['title'],
-                    movie_id=movies[0]['id'],
-                    updated_at=datetime.now(tz=UTC),
-                )
-                await session.merge(movie)
-                await session.commit()
-                return movie.movie_id
+        if movie:
             logger.debug(
                 f'[movie-{movie.movie_id}] Found from cache: {movie.movie_title}'
             )
             return movie.movie_id
+        r = await client.get(
+            '/2/search',
+            params={
+                'title': title,
+                'type': 'movie',
+            },
+        )
+        r.raise_for_status()
+        movies: list[dict[str, Any]] = r.json()
+        if not movies:
+            return None
+        logger.debug(f'[movie-{movies[0]["id"]}] Found: {movies[0]["title"]}')
+        movie = MMovieIdLookup(
+            file_title=title,
+            movie_title=movies[0]['title'],
+            movie_id=movies[0]['id'],
+            updated_at=datetime.now(tz=UTC),
+        )
+        async with database.session() as session:
+            await session.merge(movie)
+            await session.commit()
+        return movie.movie_id
 
     async def delete_path(self, path: str) -> bool:
         async with database.session() as session:
@@ -181,6 +191,7 @@ class MovieScan(PlayScan):
                     )
                 )
                 await session.commit()
+                invalidate_movie(movie_id)
 
                 await self.delete_from_index(movie_id=movie_id, session=session)
 
@@ -200,19 +211,72 @@ class MovieScan(PlayScan):
             )
             if m:
                 return
-            r = await client.delete(
-                f'/2/play-servers/{config.server_id}/movies/{movie_id}',
-                headers={'Authorization': f'Secret {config.secret}'},
-            )
-            if r.status_code >= 400:
-                logger.error(
-                    f'[movie-{movie_id}] Failed to add the movie '
-                    f'to the play server index: {r.content}'
-                )
-            else:
-                logger.info(f'[movie-{movie_id}] Deleted from play server index')
+            if not await send_to_index('DELETE', f'movies/{movie_id}'):
+                return
+            await forget_indexed(MIndexedMovie, [{'movie_id': movie_id}])
+            logger.info(f'[movie-{movie_id}] Deleted from play server index')
         else:
             logger.warning(f'[movie-{movie_id}] No server_id specified')
+            return
+
+    async def get_known_files(self) -> dict[str, datetime | None]:
+        async with database.session() as session:
+            rows = await session.execute(
+                sa.select(MMovie.path, MMovie.modified_time).where(
+                    MMovie.path.like(f'{self.scan_path}%'),
+                    MMovie.summary.is_not(None),
+                )
+            )
+            return {path: modified_time for path, modified_time in rows}
+
+    async def move_path(self, old_path: str, new_path: str) -> bool:
+        modified_time = self.get_file_modified_time(new_path)
+        if not os.path.isdir(new_path) and not await self.is_same_movie(
+            old_path, new_path, modified_time
+        ):
+            return False
+        async with database.session() as session:
+            moved = await move_paths(
+                session,
+                MMovie.path,
+                MMovie.modified_time,
+                old_path,
+                new_path,
+                modified_time,
+            )
+            await session.commit()
+        if moved:
+            # The cached sources have the old paths
+            metadata_cache.clear()
+            logger.info(f'Moved {moved} movies from {old_path} to {new_path}')
+        return moved > 0
+
+    async def is_same_movie(
+        self, old_path: str, new_path: str, modified_time: datetime | None
+    ) -> bool:
+        """
+        Whether the file at `new_path` is the one saved for `old_path`.
+
+        It must have the saved modified time and since a renamed file keeps
+        it, the new name must also be parsed as the same movie.
+        """
+        async with database.session() as session:
+            movie_id = await session.scalar(
+                sa.select(MMovie.movie_id).where(
+                    MMovie.path == old_path, MMovie.modified_time == modified_time
+                )
+            )
+        if not movie_id:
+            return False
+        item = self.parse(new_path)
+        if not item:
+            return False
+        async with self.lock(('movie', item)):
+            new_movie_id = await self.lookup(item)
+        if new_movie_id != movie_id:
+            logger.info(f'[movie-{movie_id}] {new_path} is another movie than {old_path}')
+            return False
+        return True
 
     async def get_paths_matching_base_path(self, base_path: str) -> list[str]:
         async with database.session() as session:
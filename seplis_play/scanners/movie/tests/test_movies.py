@@ -1,4 +1,7 @@
-from datetime import datetime
+import os
+from array import array
+from datetime import UTC, datetime
+from pathlib import Path
 from typing import Any, cast
 from unittest import mock
 
@@ -7,10 +10,13 @@ import pytest
 import respx
 import sqlalchemy as sa
 
+from seplis_play import config
 from seplis_play.database import Database
-from seplis_play.scanners.movie.movie_models import MMovie, MMovieIdLookup
+from seplis_play.scanners.movie.movie_models import MIndexedMovie, MMovie, MMovieIdLookup
 from seplis_play.schemas.source_metadata_schemas import SourceMetadata
 from seplis_play.testbase import run_file
+from seplis_play.utils.json_utils import json_loads
+from seplis_play.utils.keyframes_utils import pack_keyframes
 
 
 @pytest.mark.asyncio
@@ -25,12 +31,10 @@ async def test_movies(play_db_test: Database) -> None:
             'Uncharted.mkv',
         ]
     )
-    cast(Any, scanner).get_metadata = mock.AsyncMock(
-        return_value=cast(
-            SourceMetadata,
-            {
-                'some': 'data',
-            },
+    cast(Any, scanner).get_metadata_and_keyframes = mock.AsyncMock(
+        return_value=(
+            cast(SourceMetadata, {'some': 'data'}),
+            array('q', [0, 6_006_000, 12_012_000]),
         )
     )
     cast(Any, scanner).get_file_modified_time = mock.MagicMock(
@@ -63,6 +67,7 @@ async def test_movies(play_db_test: Database) -> None:
         assert r
         assert r.path == 'Uncharted.mkv'
         assert r.meta_data == {'some': 'data'}
+        assert r.keyframes == pack_keyframes([0, 6_006_000, 12_012_000])
 
     await scanner.delete_path('Uncharted.mkv')
     async with play_db_test.session() as session:
@@ -70,6 +75,257 @@ async def test_movies(play_db_test: Database) -> None:
     assert not r
 
 
+@pytest.mark.asyncio
+async def test_rescan_skips_unchanged_files(play_db_test: Database) -> None:
+    from seplis_play.scanners import MovieScan
+
+    async with play_db_test.session() as session:
+        await session.execute(
+            sa.insert(MMovie).values(
+                movie_id=1,
+                path='/movies/Uncharted.mkv',
+                meta_data={},
+                summary={'streams': [], 'format': {}},
+                modified_time=datetime(2014, 11, 14, 21, 25, 58, tzinfo=UTC),
+            )
+        )
+        await session.commit()
+
+    with mock.patch('os.path.exists', return_value=True):
+        scanner = MovieScan(scan_path='/movies', cleanup_mode=True)
+    cast(Any, scanner).get_files = mock.MagicMock(
+        return_value=['/movies/Uncharted.mkv', '/movies/F9 (2021).mkv']
+    )
+    cast(Any, scanner).get_file_modified_time = mock.MagicMock(
+        return_value=datetime(2014, 11, 14, 21, 25, 58, tzinfo=UTC)
+    )
+    save_item = mock.AsyncMock(return_value=True)
+    cast(Any, scanner).save_item = save_item
+
+    with mock.patch('os.path.exists', return_value=True):
+        await scanner.scan()
+
+    save_item.assert_called_once_with('F9 (2021)', '/movies/F9 (2021).mkv')
+    assert scanner.progress.unchanged == 1
+    assert scanner.progress.done == 2
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_cleanup_movies(
+    play_db_test: Database, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    from seplis_play.scanners import cleanup_movies
+
+    monkeypatch.setattr(config, 'server_id', '123')
+    put_index = respx.put('/2/play-servers/123/movies').mock(
+        return_value=httpx.Response(204)
+    )
+    (tmp_path / 'Uncharted.mkv').touch()
+    paths = [
+        str(tmp_path / 'Uncharted.mkv'),
+        str(tmp_path / 'F9 (2021).mkv'),
+        str(tmp_path / 'missing' / 'Parasite (2019).mkv'),
+    ]
+    async with play_db_test.session() as session:
+        for movie_id, path in enumerate(paths, start=1):
+            await session.execute(
+                sa.insert(MMovie).values(
+                    movie_id=movie_id,
+                    path=path,
+                    modified_time=datetime(2014, 11, 14, 21, 25, 58, tzinfo=UTC),
+                )
+            )
+        await session.commit()
+
+    await cleanup_movies()
+
+    async with play_db_test.session() as session:
+        assert list(await session.scalars(sa.select(MMovie.path))) == paths[:1]
+    # The remaining movies replace the play server index
+    assert put_index.call_count == 1
+    assert json_loads(put_index.calls[0].request.content) == [
+        {'movie_id': 1, 'created_at': '2014-11-14T21:25:58Z'}
+    ]
+
+    # After that only the changes are sent
+    patch_index = respx.patch('/2/play-servers/123/movies').mock(
+        return_value=httpx.Response(204)
+    )
+    delete_movie = respx.delete('/2/play-servers/123/movies/1').mock(
+        return_value=httpx.Response(204)
+    )
+    (tmp_path / 'F9 (2021).mkv').touch()
+    os.remove(paths[0])
+    async with play_db_test.session() as session:
+        await session.execute(sa.insert(MMovie).values(movie_id=2, path=paths[1]))
+        await session.commit()
+
+    await cleanup_movies()
+
+    assert put_index.call_count == 1
+    assert json_loads(patch_index.calls[0].request.content) == [
+        {'movie_id': 2, 'created_at': mock.ANY}
+    ]
+    assert delete_movie.call_count == 1
+
+    await cleanup_movies()
+    assert patch_index.call_count == 1
+    assert delete_movie.call_count == 1
+    async with play_db_test.session() as session:
+        assert list(await session.scalars(sa.select(MIndexedMovie.movie_id))) == [2]
+
+    # Replacing the index is cheaper than more removals than fit in a batch
+    monkeypatch.setattr(config, 'index_batch_size', 1)
+    async with play_db_test.session() as session:
+        await session.execute(
+            sa.insert(MIndexedMovie),
+            [{'server_id': '123', 'movie_id': movie_id} for movie_id in (3, 4)],
+        )
+        await session.commit()
+
+    await cleanup_movies()
+    assert put_index.call_count == 2
+    assert json_loads(put_index.calls[1].request.content) == [
+        {'movie_id': 2, 'created_at': mock.ANY}
+    ]
+    assert delete_movie.call_count == 1
+    async with play_db_test.session() as session:
+        assert list(await session.scalars(sa.select(MIndexedMovie.movie_id))) == [2]
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_delete_path_removes_from_the_index(play_db_test: Database) -> None:
+    from seplis_play.scanners import MovieScan
+
+    delete_movie = respx.delete('/2/play-servers/123/movies/1').mock(
+        return_value=httpx.Response(204)
+    )
+    async with play_db_test.session() as session:
+        await session.execute(
+            sa.insert(MMovie).values(movie_id=1, path='/movies/Uncharted.mkv')
+        )
+        await session.execute(
+            sa.insert(MIndexedMovie).values(server_id='123', movie_id=1)
+        )
+        await session.commit()
+    with mock.patch('os.path.exists', return_value=True):
+        scanner = MovieScan(scan_path='/movies')
+
+    assert await scanner.delete_path('/movies/Uncharted.mkv')
+
+    assert delete_movie.call_count == 1
+    async with play_db_test.session() as session:
+        assert not await session.scalar(sa.select(MIndexedMovie))
+
+
+@pytest.mark.asyncio
+async def test_move_path(play_db_test: Database, tmp_path: Path) -> None:
+    from seplis_play.scanners import MovieScan
+
+    scanner = MovieScan(scan_path=str(tmp_path), cleanup_mode=True)
+    (tmp_path / 'b').mkdir()
+    (tmp_path / 'b' / 'F9 (2021).mkv').touch()
+    (tmp_path / 'Uncharted.mkv').touch()
+    async with play_db_test.session() as session:
+        await session.execute(
+            sa.insert(MMovie).values(
+                movie_id=1,
+                path=str(tmp_path / 'a' / 'F9 (2021).mkv'),
+                meta_data={
+                    'streams': [],
+                    'format': {'filename': str(tmp_path / 'a' / 'F9 (2021).mkv')},
+                },
+                summary={
+                    'streams': [],
+                    'format': {'filename': str(tmp_path / 'a' / 'F9 (2021).mkv')},
+                },
+                modified_time=scanner.get_file_modified_time(
+                    str(tmp_path / 'b' / 'F9 (2021).mkv')
+                ),
+            )
+        )
+        await session.execute(
+            sa.insert(MMovie).values(
+                movie_id=2,
+                path=str(tmp_path / 'Uncharted (2016).mkv'),
+                modified_time=datetime(2014, 11, 14, 21, 25, 58, tzinfo=UTC),
+            )
+        )
+        await session.commit()
+
+    assert await scanner.move_path(str(tmp_path / 'a'), str(tmp_path / 'b'))
+    # Not the same file when the modified time doesn't match
+    assert not await scanner.move_path(
+        str(tmp_path / 'Uncharted (2016).mkv'), str(tmp_path / 'Uncharted.mkv')
+    )
+
+    async with play_db_test.session() as session:
+        assert list(
+            await session.scalars(sa.select(MMovie.path).order_by(MMovie.movie_id))
+        ) == [
+            str(tmp_path / 'b' / 'F9 (2021).mkv'),
+            str(tmp_path / 'Uncharted (2016).mkv'),
+        ]
+        movie = await session.scalar(sa.select(MMovie).where(MMovie.movie_id == 1))
+        assert movie and movie.meta_data and movie.summary
+        # ffmpeg is given the filename of the metadata
+        assert movie.meta_data['format']['filename'] == str(
+            tmp_path / 'b' / 'F9 (2021).mkv'
+        )
+        assert movie.summary['format']['filename'] == str(
+            tmp_path / 'b' / 'F9 (2021).mkv'
+        )
+
+
+@pytest.mark.asyncio
+async def test_move_path_checks_the_new_name(
+    play_db_test: Database, tmp_path: Path
+) -> None:
+    from seplis_play.scanners import MovieScan
+
+    scanner = MovieScan(scan_path=str(tmp_path), cleanup_mode=True)
+    (tmp_path / 'Uncharted.2016.1080p.mkv').touch()
+    modified_time = scanner.get_file_modified_time(
+        str(tmp_path / 'Uncharted.2016.1080p.mkv')
+    )
+    async with play_db_test.session() as session:
+        await session.execute(
+            sa.insert(MMovie).values(
+                movie_id=1,
+                path=str(tmp_path / 'Uncharted (2016).mkv'),
+                modified_time=modified_time,
+            )
+        )
+        for movie_id, title in ((1, 'Uncharted (2016)'), (2, 'F9 (2021)')):
+            await session.execute(
+                sa.insert(MMovieIdLookup).values(
+                    file_title=title,
+                    movie_title=title,
+                    movie_id=movie_id,
+                    updated_at=datetime.now(tz=UTC),
+                )
+            )
+        await session.commit()
+
+    # Same modified time, but renamed to another movie
+    os.rename(tmp_path / 'Uncharted.2016.1080p.mkv', tmp_path / 'F9 (2021).mkv')
+    assert not await scanner.move_path(
+        str(tmp_path / 'Uncharted (2016).mkv'), str(tmp_path / 'F9 (2021).mkv')
+    )
+    os.rename(tmp_path / 'F9 (2021).mkv', tmp_path / 'Uncharted.2016.1080p.mkv')
+    assert await scanner.move_path(
+        str(tmp_path / 'Uncharted (2016).mkv'),
+        str(tmp_path / 'Uncharted.2016.1080p.mkv'),
+    )
+
+    async with play_db_test.session() as session:
+        assert list(await session.scalars(sa.select(MMovie.path))) == [
+            str(tmp_path / 'Uncharted.2016.1080p.mkv')
+        ]
+
+
 @pytest.mark.asyncio
 async def test_movie_parse() -> None:
     from seplis_play.scanners import MovieScan
@@ -2,13 +2,123 @@ import asyncio
 import os
 import os.path
 import subprocess
-from collections.abc import Generator
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Generator, Hashable
+from dataclasses import dataclass, field
 from datetime import UTC, datetime
+from itertools import pairwise
 from typing import Any
+from weakref import WeakValueDictionary
 
-from seplis_play import config, logger
+from seplis_play import config, logger, metrics
 from seplis_play.schemas.source_metadata_schemas import SourceMetadata
+from seplis_play.transcoding.segment_timeline import (
+    from_microseconds,
+    to_microseconds,
+)
 from seplis_play.utils.json_utils import json_loads
+from seplis_play.utils.keyframes_utils import pack_keyframes
+
+from .matroska_cues import MatroskaError, read_cue_keyframes
+
+_locks: WeakValueDictionary[Hashable, asyncio.Lock] = WeakValueDictionary()
+# Shared by all the scanners, the watcher makes one for every change
+_ffprobe_limit = asyncio.Semaphore(config.scan_ffprobe_workers or os.cpu_count() or 1)
+
+# Stream lines with a lot of tags are long, the packet lines are short
+FFPROBE_LINE_LIMIT = 2**20
+
+# Keyframes further apart than two segments of copied video are rare enough
+# that the cues are more likely to be sparse
+MAX_CUE_GAP = 12_000_000
+# The part of the file ffprobe reads to check the cues against
+CUE_SAMPLE_LENGTH = 20_000_000
+# Cue times are rounded to the timestamp scale, usually milliseconds
+CUE_TOLERANCE = 1_000
+
+
+@dataclass
+class ScanProgress:
+    total: int = 0
+    done: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    probes: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def files_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f'{self.done}/{self.total} files, {self.unchanged} unchanged, '
+            f'{self.failed} failed, '
+            f'{self.probes} probes, {self.files_per_second():.1f} files/s'
+        )
+
+
+class FFprobeOutputParser:
+    """
+    Parses the output of ffprobe with `-print_format json=compact=1`.
+
+    The compact json writer puts every packet on its own line, so the packets
+    are reduced to keyframe timestamps line by line and only the streams and
+    format are parsed as a json document. Only the video keyframe lines are
+    parsed, the audio and subtitle packets are far more and are skipped on
+    the raw bytes.
+
+    `position` is the latest video keyframe timestamp read, in microseconds.
+    """
+
+    def __init__(self) -> None:
+        self.position = 0
+        self._keyframes = array('q')
+        self._keyframes_sorted = True
+        self._document: list[bytes] = []
+        self._in_packets = False
+
+    def feed(self, line: bytes) -> None:
+        stripped = line.strip()
+        if self._in_packets:
+            if stripped.startswith(b']'):
+                self._in_packets = False
+            elif (
+                stripped.startswith(b'{') and b'"video"' in stripped and b'"K' in stripped
+            ):
+                self._add_packet(json_loads(stripped.rstrip(b',')))
+        elif stripped.startswith(b'"packets"'):
+            # ffprobe writes the packets before the streams and format
+            self._in_packets = not stripped.rstrip(b',').endswith(b']')
+        else:
+            self._document.append(line)
+
+    def _add_packet(self, packet: dict[str, Any]) -> None:
+        pts_time = packet.get('pts_time')
+        if packet.get('codec_type') != 'video' or not pts_time or pts_time == 'N/A':
+            return
+        pts = to_microseconds(pts_time)
+        self.position = max(self.position, pts)
+        if packet.get('flags', '').startswith('K'):
+            if self._keyframes and pts < self._keyframes[-1]:
+                self._keyframes_sorted = False
+            self._keyframes.append(pts)
+
+    @property
+    def keyframe_count(self) -> int:
+        return len(self._keyframes)
+
+    def keyframes(self) -> array:
+        if self._keyframes_sorted:
+            return self._keyframes
+        return array('q', sorted(self._keyframes))
+
+    def metadata(self) -> SourceMetadata | None:
+        if not any(line.strip() for line in self._document):
+            return None
+        return json_loads(b''.join(self._document))
 
 
 class PlayScan:
@@ -31,6 +141,7 @@ class PlayScan:
         self.make_thumbnails = make_thumbnails
         self.cleanup_mode = cleanup_mode
         self.parser = parser
+        self.progress = ScanProgress()
 
     async def save_item(self, item: Any, path: str) -> bool:
         raise NotImplementedError()
@@ -44,13 +155,99 @@ class PlayScan:
     async def get_paths_matching_base_path(self, base_path: str) -> Any:
         raise NotImplementedError()
 
+    async def move_path(self, old_path: str, new_path: str) -> bool:
+        """
+        Updates the saved paths after a file or a directory was moved,
+        so the files don't have to be probed again.
+
+        :returns: False if nothing was moved, the new path must be scanned.
+        """
+        return False
+
+    async def get_known_files(self) -> dict[str, datetime | None]:
+        """
+        :returns: dict
+            path and modified time of the saved files in the scan path.
+        """
+        return {}
+
+    async def flush_index(self) -> None:
+        """
+        Send the play server index updates that are waiting to be batched.
+        """
+
     async def scan(self) -> None:
+        """
+        Saves the files with `scan_workers` files in progress at a time,
+        the ffprobe calls are limited to `scan_ffprobe_workers`.
+        """
         logger.info(f'Scanning: {self.scan_path} ({self.SCANNER_NAME})')
-        files = self.get_files()
+        files = await asyncio.to_thread(self.get_files)
+        self.progress = ScanProgress(total=len(files))
+        # Thumbnails are created from save_item so every file has to go through it
+        if not self.make_thumbnails:
+            files = await asyncio.to_thread(
+                self.get_changed_files, files, await self.get_known_files()
+            )
+            self.progress.unchanged = self.progress.done = self.progress.total - len(
+                files
+            )
+        queue: asyncio.Queue[str] = asyncio.Queue()
         for f in files:
-            title = self.parse(f)
-            if title:
-                await self.save_item(title, f)
+            queue.put_nowait(f)
+        workers = min(len(files), config.scan_workers or 2 * (os.cpu_count() or 1))
+        reporter = asyncio.create_task(self._report_progress())
+        try:
+            await asyncio.gather(*[self._scan_worker(queue) for _ in range(workers)])
+        finally:
+            reporter.cancel()
+            await self.flush_index()
+        logger.info(f'Scanned: {self.scan_path} ({self.SCANNER_NAME}) {self.progress}')
+
+    def get_changed_files(
+        self, files: list[str], known_files: dict[str, datetime | None]
+    ) -> list[str]:
+        return [
+            f
+            for f in files
+            if f not in known_files
+            or known_files[f] is None
+            or known_files[f] != self.get_file_modified_time(f)
+        ]
+
+    async def _scan_worker(self, queue: asyncio.Queue[str]) -> None:
+        while not queue.empty():
+            path = queue.get_nowait()
+            try:
+                title = self.parse(path)
+                if title:
+                    await self.save_item(title, path)
+                metrics.scanned_files_total.inc(self.SCANNER_NAME, 'ok')
+            except Exception:
+                self.progress.failed += 1
+                metrics.scanned_files_total.inc(self.SCANNER_NAME, 'failed')
+                logger.exception(f'Failed to scan: {path}')
+            self.progress.done += 1
+
+    async def _report_progress(self) -> None:
+        while True:
+            await asyncio.sleep(10)
+            logger.info(
+                f'Scanning: {self.scan_path} ({self.SCANNER_NAME}) {self.progress}'
+            )
+
+    def lock(self, key: Hashable) -> asyncio.Lock:
+        """
+        Lock for work that must not run concurrently for the same key,
+        e.g. looking up and storing the id of a title.
+
+        The locks are shared by all the scanners, scan_watch uses a scanner
+        per change. A lock is dropped when nothing holds it.
+        """
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = asyncio.Lock()
+        return lock
 
     def get_files(self) -> list[str]:
         files: list[str] = []
@@ -95,13 +292,17 @@ class PlayScan:
             'json',
             path,
         ]
-        process = await asyncio.create_subprocess_exec(
-            ffprobe,
-            *cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        data, error = await process.communicate()
+        async with _ffprobe_limit:
+            self.progress.probes += 1
+            started = time.monotonic()
+            process = await asyncio.create_subprocess_exec(
+                ffprobe,
+                *cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            data, error = await process.communicate()
+            metrics.ffprobe_seconds.observe(time.monotonic() - started)
         if error:
             if isinstance(error, bytes):
                 error = error.decode('utf-8')
@@ -114,62 +315,182 @@ class PlayScan:
         if isinstance(data, bytes):
             data = data.decode('utf-8')
         result: SourceMetadata = json_loads(data)
-        if config.extract_keyframes and path.endswith('.mkv'):
-            result['keyframes'] = await self.get_keyframes(path)
         return result
 
-    async def get_keyframes(self, path: str) -> list[str] | None:
+    async def probe(self, path: str) -> tuple[SourceMetadata, bytes | None]:
+        """
+        :returns: tuple
+            metadata and the packed keyframes for the keyframes column,
+            if they should be extracted.
+        """
+        if not config.extract_keyframes or not path.endswith('.mkv'):
+            return await self.get_metadata(path), None
+        keyframes = await self.get_cue_keyframes(path)
+        if keyframes:
+            metadata = await self.get_metadata(path)
+            if await self.cues_are_complete(path, keyframes, metadata):
+                return metadata, pack_keyframes(keyframes)
+        metadata, keyframes = await self.get_metadata_and_keyframes(path)
+        return metadata, pack_keyframes(keyframes) if keyframes else None
+
+    async def get_cue_keyframes(self, path: str) -> array | None:
+        """
+        Keyframes from the Matroska cues, which saves reading the whole file
+        through ffprobe.
+        """
+        try:
+            keyframes = await asyncio.to_thread(read_cue_keyframes, path)
+        except (OSError, MatroskaError) as e:
+            logger.debug(f'Failed to read the cues of {path}: {e}')
+            return None
+        if not keyframes:
+            logger.debug(f'No video cues in {path}, falling back to ffprobe')
+        return keyframes
+
+    async def cues_are_complete(
+        self, path: str, keyframes: array, metadata: SourceMetadata
+    ) -> bool:
+        """
+        Matroska doesn't require a cue for every keyframe and some muxers only
+        write one per cluster. The cues are used if there are no long gaps
+        between them and they have every keyframe ffprobe finds in a sample
+        from the middle of the file.
+        """
+        duration = to_microseconds(metadata.get('format', {}).get('duration') or 0)
+        largest_gap = max(
+            b - a for a, b in pairwise([*keyframes, max(duration, keyframes[-1])])
+        )
+        if largest_gap > MAX_CUE_GAP:
+            logger.debug(
+                f'Cues of {path} are {from_microseconds(largest_gap):.1f}s apart, '
+                'falling back to ffprobe'
+            )
+            return False
+        start = max(0, duration // 2 - CUE_SAMPLE_LENGTH // 2)
+        sample = await self.get_sample_keyframes(path, start, CUE_SAMPLE_LENGTH)
+        if sample is None:
+            return False
+        for keyframe in sample:
+            i = bisect_left(keyframes, keyframe - CUE_TOLERANCE)
+            if i == len(keyframes) or keyframes[i] > keyframe + CUE_TOLERANCE:
+                logger.debug(
+                    f'No cue for the keyframe at {from_microseconds(keyframe)}s '
+                    f'in {path}, falling back to ffprobe'
+                )
+                return False
+        return True
+
+    async def get_sample_keyframes(
+        self, path: str, start: int, length: int
+    ) -> array | None:
+        """
+        The video keyframes ffprobe finds from `start` and `length`
+        microseconds on.
+        """
+        ffprobe = os.path.join(config.ffmpeg_folder, 'ffprobe')
+        cmd = [
+            '-loglevel',
+            'error',
+            '-select_streams',
+            'v:0',
+            '-read_intervals',
+            f'{from_microseconds(start):f}%+{from_microseconds(length):f}',
+            '-show_entries',
+            'packet=codec_type,pts_time,flags',
+            '-print_format',
+            'json=compact=1',
+            path,
+        ]
+        async with _ffprobe_limit:
+            self.progress.probes += 1
+            started = time.monotonic()
+            process = await asyncio.create_subprocess_exec(
+                ffprobe,
+                *cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            data, error = await process.communicate()
+            metrics.ffprobe_seconds.observe(time.monotonic() - started)
+        if error or process.returncode:
+            logger.debug(f'Failed to sample the keyframes of {path}: {error!r}')
+            return None
+        parser = FFprobeOutputParser()
+        for line in data.splitlines():
+            parser.feed(line)
+        return parser.keyframes()
+
+    async def get_metadata_and_keyframes(
+        self, path: str
+    ) -> tuple[SourceMetadata, array | None]:
+        """
+        Streams, format and the video keyframes from one ffprobe run.
+        """
         if not os.path.exists(path):
             raise Exception(f'Path "{path}" does not exist')
         ffprobe = os.path.join(config.ffmpeg_folder, 'ffprobe')
         if not os.path.exists(ffprobe):
             raise Exception(f'ffprobe not found in "{config.ffmpeg_folder}"')
-        logger.debug(f'Getting keyframes from: {path}')
+        logger.debug(f'Getting metadata and keyframes from: {path}')
         cmd = [
             '-fflags',
             '+genpts',
-            '-v',
+            '-loglevel',
             'error',
-            '-skip_frame',
-            'nokey',
+            '-show_streams',
+            '-show_format',
             '-show_entries',
-            'packet=pts_time,flags',
-            '-select_streams',
-            'v',
-            '-of',
-            'json',
+            'packet=codec_type,pts_time,flags',
+            '-print_format',
+            'json=compact=1',
             path,
         ]
-        process = await asyncio.create_subprocess_exec(
-            ffprobe,
-            *cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        data, error = await process.communicate()
-
-        if error:
-            if isinstance(error, bytes):
-                error = error.decode('utf-8')
-            logger.error(f'FFprobe error {path}:  {error}')
-            return None
-
-        if not data:
-            logger.error(
-                f'Failed to get keyframes from {path}, either this is '
+        parser = FFprobeOutputParser()
+        async with _ffprobe_limit:
+            self.progress.probes += 1
+            process = await asyncio.create_subprocess_exec(
+                ffprobe,
+                *cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                limit=FFPROBE_LINE_LIMIT,
+            )
+            assert process.stdout and process.stderr
+            try:
+                _, error = await asyncio.gather(
+                    self._read_ffprobe_output(path, process.stdout, parser),
+                    process.stderr.read(),
+                )
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                await process.wait()
+        metadata = parser.metadata()
+        if not metadata:
+            raise Exception(
+                f'Failed to get metadata from {path}, either this is '
                 'not a media file or it is corrupt.'
             )
-            return None
+        if error:
+            # The metadata is fine but the packets could have been cut short
+            logger.error(f'FFprobe error {path}: {error.decode("utf-8")}')
+            return metadata, None
+        return metadata, parser.keyframes()
 
-        if isinstance(data, bytes):
-            data = data.decode('utf-8')
-        parsed: dict[str, Any] = json_loads(data)
-        keyframes: list[str] = [
-            r['pts_time']
-            for r in parsed['packets']
-            if r['flags'].startswith('K_') and r.get('pts_time')
-        ]
-        return keyframes
+    async def _read_ffprobe_output(
+        self, path: str, stdout: asyncio.StreamReader, parser: FFprobeOutputParser
+    ) -> None:
+        next_report = time.monotonic() + 10
+        async for line in stdout:
+            parser.feed(line)
+            if time.monotonic() >= next_report:
+                next_report += 10
+                logger.info(
+                    f'Getting keyframes from: {path} '
+                    f'({from_microseconds(parser.position):.0f}s read, '
+                    f'{parser.keyframe_count} keyframes)'
+                )
 
     def get_file_modified_time(self, path: str) -> datetime | None:
         try:
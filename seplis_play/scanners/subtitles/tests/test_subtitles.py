@@ -42,7 +42,7 @@ async def test_subtitles(play_db_test: Database) -> None:
 
         async with play_db_test.session() as session:
             r = await session.scalars(
-                sa.select(MExternalSubtitle).order_by(MExternalSubtitle.id)
+                sa.select(MExternalSubtitle).order_by(MExternalSubtitle.path)
             )
             r = list(r)
 
@@ -0,0 +1,124 @@
+import asyncio
+import json
+from datetime import UTC, datetime
+
+import httpx
+import pytest
+import respx
+import sqlalchemy as sa
+
+from seplis_play import config
+from seplis_play.database import Database, database
+from seplis_play.scanners import index_batcher
+from seplis_play.scanners.index_batcher import IndexBatcher
+from seplis_play.scanners.movie.movie_models import MIndexedMovie
+from seplis_play.scanners.movie.movie_schemas import PlayServerMovieCreate
+from seplis_play.testbase import run_file
+
+
+@pytest.fixture
+def batch_config(play_db_test: Database, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, 'server_id', '123')
+    monkeypatch.setattr(config, 'index_batch_size', 2)
+    monkeypatch.setattr(config, 'index_batch_wait', 0.01)
+    monkeypatch.setattr(index_batcher, 'RETRY_DELAY', 0)
+
+
+def movie(movie_id: int) -> PlayServerMovieCreate:
+    return PlayServerMovieCreate(
+        movie_id=movie_id, created_at=datetime(2024, 1, 1, tzinfo=UTC)
+    )
+
+
+def sent_movie_ids(route: respx.Route) -> list[list[int]]:
+    return [
+        [m['movie_id'] for m in json.loads(call.request.content)] for call in route.calls
+    ]
+
+
+async def indexed_movie_ids() -> list[int]:
+    async with database.session() as session:
+        return list(
+            await session.scalars(
+                sa.select(MIndexedMovie.movie_id).order_by(MIndexedMovie.movie_id)
+            )
+        )
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_entries_are_sent_in_batches(batch_config: None) -> None:
+    route = respx.patch('/2/play-servers/123/movies').mock(
+        return_value=httpx.Response(204)
+    )
+    batcher = IndexBatcher[PlayServerMovieCreate]('movies', MIndexedMovie)
+
+    for movie_id in (1, 2, 3):
+        await batcher.add(movie(movie_id))
+    assert sent_movie_ids(route) == [[1, 2]]
+
+    # The rest is sent when the batch has waited long enough
+    await asyncio.sleep(0.05)
+    assert sent_movie_ids(route) == [[1, 2], [3]]
+
+    await batcher.add(movie(4))
+    await batcher.flush()
+    assert sent_movie_ids(route) == [[1, 2], [3], [4]]
+    assert await indexed_movie_ids() == [1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_failed_batches_are_retried(batch_config: None) -> None:
+    route = respx.patch('/2/play-servers/123/movies').mock(
+        side_effect=[
+            httpx.ConnectError('Connection refused'),
+            httpx.Response(503),
+            httpx.Response(204),
+        ]
+    )
+    batcher = IndexBatcher[PlayServerMovieCreate]('movies', MIndexedMovie)
+
+    await batcher.add(movie(1))
+    await batcher.flush()
+    assert sent_movie_ids(route) == [[1], [1], [1]]
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_bad_requests_are_not_retried(batch_config: None) -> None:
+    route = respx.patch('/2/play-servers/123/movies').mock(
+        return_value=httpx.Response(400)
+    )
+    batcher = IndexBatcher[PlayServerMovieCreate]('movies', MIndexedMovie)
+
+    await batcher.add(movie(1))
+    await batcher.flush()
+    assert route.call_count == 1
+    assert batcher.items == []
+    # Left for the next sync to send
+    assert await indexed_movie_ids() == []
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_an_entry_twice_in_a_batch_is_recorded_once(batch_config: None) -> None:
+    respx.patch('/2/play-servers/123/movies').mock(return_value=httpx.Response(204))
+    batcher = IndexBatcher[PlayServerMovieCreate]('movies', MIndexedMovie)
+
+    # Two files of the same movie saved in one scan
+    await batcher.add(movie(1))
+    await batcher.add(
+        PlayServerMovieCreate(movie_id=1, created_at=datetime(2024, 2, 1, tzinfo=UTC))
+    )
+
+    async with database.session() as session:
+        assert list(
+            await session.execute(
+                sa.select(MIndexedMovie.movie_id, MIndexedMovie.created_at)
+            )
+        ) == [(1, datetime(2024, 2, 1, tzinfo=UTC))]
+
+
+if __name__ == '__main__':
+    run_file(__file__)
@@ -0,0 +1,76 @@
+from pathlib import Path
+
+from seplis_play.scanners import matroska_cues as mkv
+from seplis_play.testbase import run_file
+
+
+def element(id_: int, payload: bytes) -> bytes:
+    size = len(payload) | (1 << 56)  # 8 byte size
+    return (
+        id_.to_bytes((id_.bit_length() + 7) // 8, 'big')
+        + size.to_bytes(8, 'big')
+        + payload
+    )
+
+
+def uint(id_: int, value: int) -> bytes:
+    return element(id_, value.to_bytes(8, 'big'))
+
+
+def cue_point(time: int, track: int) -> bytes:
+    return element(
+        mkv.CUE_POINT,
+        uint(mkv.CUE_TIME, time)
+        + element(mkv.CUE_TRACK_POSITIONS, uint(mkv.CUE_TRACK, track)),
+    )
+
+
+def make_mkv(cues: bool = True) -> bytes:
+    info = element(mkv.INFO, uint(mkv.TIMESTAMP_SCALE, 1_000_000))
+    tracks = element(
+        mkv.TRACKS,
+        element(mkv.TRACK_ENTRY, uint(mkv.TRACK_NUMBER, 1) + uint(mkv.TRACK_TYPE, 1))
+        + element(mkv.TRACK_ENTRY, uint(mkv.TRACK_NUMBER, 2) + uint(mkv.TRACK_TYPE, 2)),
+    )
+    cluster = element(mkv.CLUSTER, b'\x00' * 1000)
+    cues_element = element(
+        mkv.CUES,
+        cue_point(12_012, 1) + cue_point(0, 1) + cue_point(0, 2) + cue_point(6_006, 1),
+    )
+
+    def seek_head(cues_position: int) -> bytes:
+        return element(
+            mkv.SEEK_HEAD,
+            element(
+                mkv.SEEK,
+                uint(mkv.SEEK_ID, mkv.CUES) + uint(mkv.SEEK_POSITION, cues_position),
+            ),
+        )
+
+    # The seek head has a fixed size so the cues position can be calculated
+    cues_position = len(seek_head(0) + info + tracks + cluster)
+    body = seek_head(cues_position) + info + tracks + cluster
+    if cues:
+        body += cues_element
+    return element(mkv.EBML_HEADER, b'') + element(mkv.SEGMENT, body)
+
+
+def test_keyframes_are_read_from_the_cues(tmp_path: Path) -> None:
+    path = tmp_path / 'movie.mkv'
+    path.write_bytes(make_mkv())
+
+    keyframes = mkv.read_cue_keyframes(str(path))
+
+    assert keyframes is not None
+    assert keyframes.tolist() == [0, 6_006_000, 12_012_000]
+
+
+def test_no_keyframes_without_cues(tmp_path: Path) -> None:
+    path = tmp_path / 'movie.mkv'
+    path.write_bytes(make_mkv(cues=False))
+
+    assert mkv.read_cue_keyframes(str(path)) is None
+
+
+if __name__ == '__main__':
+    run_file(__file__)
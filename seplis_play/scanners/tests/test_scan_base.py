@@ -0,0 +1,189 @@
+import asyncio
+import stat
+from array import array
+from pathlib import Path
+from typing import Any, cast
+from unittest import mock
+
+import pytest
+
+from seplis_play import config
+from seplis_play.scanners import scan_base
+from seplis_play.scanners.scan_base import FFprobeOutputParser, PlayScan
+from seplis_play.testbase import run_file
+from seplis_play.utils.keyframes_utils import pack_keyframes
+
+
+class FakeScan(PlayScan):
+    def __init__(self) -> None:
+        super().__init__(scan_path='/')
+        self.running = 0
+        self.max_running = 0
+
+    def parse(self, filename: str) -> str:
+        return filename
+
+    async def save_item(self, item: str, path: str) -> bool:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if path == '/broken.mkv':
+            raise Exception('Broken file')
+        return True
+
+
+@pytest.mark.asyncio
+async def test_scan_saves_files_concurrently(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, 'scan_workers', 3)
+    scanner = FakeScan()
+    files = [f'/{i}.mkv' for i in range(10)] + ['/broken.mkv']
+    cast(Any, scanner).get_files = mock.MagicMock(return_value=files)
+
+    await scanner.scan()
+
+    assert scanner.max_running == 3
+    assert scanner.progress.total == 11
+    assert scanner.progress.done == 11
+    assert scanner.progress.failed == 1
+
+
+FFPROBE_OUTPUT = """{
+    "packets": [
+        { "codec_type": "audio", "pts_time": "0.000000", "flags": "K__" },
+        { "codec_type": "video", "pts_time": "6.006000", "flags": "K__" },
+        { "codec_type": "video", "pts_time": "0.000000", "flags": "K__" },
+        { "codec_type": "video", "pts_time": "0.041708", "flags": "___" },
+        { "codec_type": "video", "pts_time": "12.012000", "flags": "K_D" }
+    ],
+    "streams": [
+        { "index": 0, "codec_name": "h264", "codec_type": "video" },
+        { "index": 1, "codec_name": "aac", "codec_type": "audio" }
+    ],
+    "format": {
+        "filename": "movie.mkv",
+        "duration": "18.018000"
+    }
+}
+"""
+
+
+@pytest.mark.asyncio
+async def test_metadata_and_keyframes_from_one_ffprobe_run(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    (tmp_path / 'output.json').write_text(FFPROBE_OUTPUT)
+    ffprobe = tmp_path / 'ffprobe'
+    ffprobe.write_text(
+        f'#!/bin/sh\necho "$@" >> {tmp_path}/calls\ncat {tmp_path}/output.json\n'
+    )
+    ffprobe.chmod(ffprobe.stat().st_mode | stat.S_IEXEC)
+    movie = tmp_path / 'movie.mkv'
+    movie.touch()
+    monkeypatch.setattr(config, 'ffmpeg_folder', tmp_path)
+    scanner = FakeScan()
+
+    metadata, keyframes = await scanner.get_metadata_and_keyframes(str(movie))
+
+    assert [s['codec_name'] for s in metadata['streams']] == ['h264', 'aac']
+    assert metadata['format']['duration'] == '18.018000'
+    assert keyframes is not None
+    assert keyframes.tolist() == [0, 6_006_000, 12_012_000]
+    assert len((tmp_path / 'calls').read_text().splitlines()) == 1
+
+
+def write_fake_ffprobe(tmp_path: Path, sample_keyframes: list[str]) -> None:
+    (tmp_path / 'output.json').write_text(FFPROBE_OUTPUT)
+    packets = ',\n'.join(
+        f'{{ "codec_type": "video", "pts_time": "{pts}", "flags": "K__" }}'
+        for pts in sample_keyframes
+    )
+    (tmp_path / 'sample.json').write_text(f'{{\n"packets": [\n{packets}\n]\n}}\n')
+    ffprobe = tmp_path / 'ffprobe'
+    ffprobe.write_text(
+        '#!/bin/sh\n'
+        f'echo "$@" >> {tmp_path}/calls\n'
+        'case "$*" in\n'
+        f'  *-read_intervals*) cat {tmp_path}/sample.json ;;\n'
+        f'  *) cat {tmp_path}/output.json ;;\n'
+        'esac\n'
+    )
+    ffprobe.chmod(ffprobe.stat().st_mode | stat.S_IEXEC)
+    (tmp_path / 'movie.mkv').touch()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'cues, sample_keyframes, uses_cues',
+    [
+        # The cues have every keyframe in the sample
+        ([0, 6_006_000, 12_012_000], ['6.006000', '12.012000'], True),
+        # A keyframe between the cues, they are only written per cluster
+        ([0, 6_006_000, 12_012_000], ['6.006000', '9.009000', '12.012000'], False),
+        # Too far apart to be every keyframe
+        ([0, 18_000_000], ['18.000000'], False),
+    ],
+)
+async def test_probe_uses_the_cues_only_if_they_are_complete(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    cues: list[int],
+    sample_keyframes: list[str],
+    uses_cues: bool,
+) -> None:
+    write_fake_ffprobe(tmp_path, sample_keyframes)
+    monkeypatch.setattr(config, 'ffmpeg_folder', tmp_path)
+    monkeypatch.setattr(config, 'extract_keyframes', True)
+    monkeypatch.setattr(scan_base, 'read_cue_keyframes', lambda path: array('q', cues))
+    scanner = FakeScan()
+
+    metadata, keyframes = await scanner.probe(str(tmp_path / 'movie.mkv'))
+
+    assert metadata['format']['duration'] == '18.018000'
+    # The full ffprobe run is the only one with both packets and streams
+    full_runs = [
+        call
+        for call in (tmp_path / 'calls').read_text().splitlines()
+        if '-show_streams' in call and '-show_entries' in call
+    ]
+    if uses_cues:
+        assert not full_runs
+        assert keyframes == pack_keyframes(array('q', cues))
+    else:
+        assert len(full_runs) == 1
+        assert keyframes == pack_keyframes(array('q', [0, 6_006_000, 12_012_000]))
+
+
+def test_ffprobe_output_parser_keeps_only_keyframes() -> None:
+    parser = FFprobeOutputParser()
+    lines = [
+        b'{\n',
+        b'    "packets": [\n',
+        *[
+            f'        {{ "codec_type": "video", "pts_time": "{i / 10:.6f}", '
+            f'"flags": "{"K__" if i % 10 == 0 else "___"}" }},\n'.encode()
+            for i in range(100)
+        ],
+        *[
+            f'        {{ "codec_type": "audio", "pts_time": "{i / 10:.6f}", '
+            f'"flags": "K__" }},\n'.encode()
+            for i in range(100)
+        ],
+        b'    ],\n',
+        b'    "streams": [\n',
+        b'    ]\n',
+        b'}\n',
+    ]
+    with mock.patch.object(scan_base, 'json_loads', wraps=scan_base.json_loads) as loads:
+        for line in lines:
+            parser.feed(line)
+
+    assert parser.keyframes().tolist() == [i * 1_000_000 for i in range(10)]
+    assert parser.position == 9_000_000
+    # Only the video keyframes are parsed
+    assert loads.call_count == 10
+    assert parser.metadata() == {'streams': []}
+
+
+if __name__ == '__main__':
+    run_file(__file__)
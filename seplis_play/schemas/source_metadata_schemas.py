@@ -1,4 +1,5 @@
-from typing import Literal, NotRequired, TypedDict
+from array import array
+from typing import Literal, NotRequired, TypedDict, cast
 
 type SourceNumber = str | int | float
 
@@ -74,4 +75,53 @@ class SourceMetadataFormat(TypedDict):
 class SourceMetadata(TypedDict):
     streams: list[SourceMetadataStream]
     format: SourceMetadataFormat
-    keyframes: NotRequired[list[str] | None]
+    # Keyframe timestamps in microseconds, loaded from their own column
+    keyframes: NotRequired[array | None]
+
+
+def _keys(typed_dict: type) -> frozenset[str]:
+    return typed_dict.__required_keys__ | typed_dict.__optional_keys__
+
+
+_STREAM_KEYS = {
+    'video': _keys(SourceMetadataVideoStream),
+    'audio': _keys(SourceMetadataAudioStream),
+    'subtitle': _keys(SourceMetadataSubtitleStream),
+}
+_NESTED_KEYS = {
+    'tags': _keys(SourceMetadataStreamTags),
+    'disposition': _keys(SourceMetadataDisposition),
+}
+_SIDE_DATA_KEYS = _keys(SourceMetadataSideData)
+_FORMAT_KEYS = _keys(SourceMetadataFormat)
+
+
+def _pick(data: dict, keys: frozenset[str]) -> dict:
+    return {k: v for k, v in data.items() if k in keys}
+
+
+def source_metadata_summary(metadata: SourceMetadata) -> SourceMetadata:
+    """
+    Strip the ffprobe output down to the fields declared above, which is all
+    the play and transcode logic reads.
+    """
+    streams = []
+    for stream in metadata.get('streams') or []:
+        keys = _STREAM_KEYS.get(
+            stream.get('codec_type', ''),
+            _keys(SourceMetadataBaseStream) | {'codec_type'},
+        )
+        s = _pick(dict(stream), keys)
+        for key, nested_keys in _NESTED_KEYS.items():
+            if key in s:
+                s[key] = _pick(s[key], nested_keys)
+        if 'side_data_list' in s:
+            s['side_data_list'] = [_pick(d, _SIDE_DATA_KEYS) for d in s['side_data_list']]
+        streams.append(s)
+    return cast(
+        SourceMetadata,
+        {
+            'streams': streams,
+            'format': _pick(dict(metadata.get('format') or {}), _FORMAT_KEYS),
+        },
+    )
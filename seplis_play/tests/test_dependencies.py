@@ -0,0 +1,49 @@
+import time
+from unittest import mock
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+from seplis_play import config, dependencies
+from seplis_play.testbase import run_file
+
+
+def test_decode_play_id_is_memoized_until_it_expires(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(config, 'secret', 'secret')
+    dependencies.play_ids.clear()
+    exp = int(time.time()) + 60
+    play_id = jwt.encode(
+        {'type': 'movie', 'movie_id': 1, 'exp': exp}, 'secret', algorithm='HS256'
+    )
+
+    with mock.patch.object(dependencies.jwt, 'decode', wraps=jwt.decode) as decode:
+        first = dependencies.decode_play_id(play_id)
+        assert dependencies.decode_play_id(play_id) is first
+        assert first.movie_id == 1
+        assert decode.call_count == 1
+
+        # An expired entry is verified again by jwt
+        with mock.patch.object(dependencies.time, 'time', return_value=exp + 1):
+            dependencies.decode_play_id(play_id)
+        assert decode.call_count == 2
+
+
+def test_invalid_play_id_is_not_memoized(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, 'secret', 'secret')
+    dependencies.play_ids.clear()
+    play_id = jwt.encode(
+        {'type': 'movie', 'movie_id': 1, 'exp': int(time.time()) + 60},
+        'wrong',
+        algorithm='HS256',
+    )
+
+    with pytest.raises(HTTPException):
+        dependencies.decode_play_id(play_id)
+    assert len(dependencies.play_ids) == 0
+
+
+if __name__ == '__main__':
+    run_file(__file__)
@@ -0,0 +1,69 @@
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from seplis_play import metrics
+from seplis_play.routes import metrics_routes
+from seplis_play.testbase import run_file
+from seplis_play.utils.metrics_utils import Counter, Histogram, MetricsRegistry
+
+
+def test_render() -> None:
+    registry = MetricsRegistry()
+    counter = registry.register(Counter('requests_total', 'Requests', labels=('result',)))
+    histogram = registry.register(
+        Histogram('request_seconds', 'Request time', buckets=(0.1, 1))
+    )
+
+    counter.inc('hit')
+    counter.inc('hit')
+    counter.inc('mi"ss', value=0.5)
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(3)
+
+    assert registry.render() == (
+        '# HELP requests_total Requests\n'
+        '# TYPE requests_total counter\n'
+        'requests_total{result="hit"} 2\n'
+        'requests_total{result="mi\\"ss"} 0.5\n'
+        '# HELP request_seconds Request time\n'
+        '# TYPE request_seconds histogram\n'
+        'request_seconds_bucket{le="0.1"} 1\n'
+        'request_seconds_bucket{le="1"} 2\n'
+        'request_seconds_bucket{le="+Inf"} 3\n'
+        'request_seconds_sum 3.6\n'
+        'request_seconds_count 3\n'
+    )
+
+
+def test_metrics_route() -> None:
+    app = FastAPI()
+    app.include_router(metrics_routes.router)
+    metrics.source_bytes_total.inc(value=100)
+
+    r = TestClient(app).get('/metrics')
+
+    assert r.status_code == 200
+    assert r.headers['content-type'].startswith('text/plain; version=0.0.4')
+    assert '# TYPE seplis_play_source_bytes_total counter' in r.text
+
+
+def test_write_metrics_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    registry = MetricsRegistry()
+    registry.register(Counter('scanned_total', 'Scanned')).inc()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    path = tmp_path / 'seplis_play_scan.prom'
+
+    metrics.write_metrics_file(path)
+
+    assert path.read_text() == (
+        '# HELP scanned_total Scanned\n# TYPE scanned_total counter\nscanned_total 1\n'
+    )
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
+
+
+if __name__ == '__main__':
+    run_file(__file__)
@@ -0,0 +1,200 @@
+from pathlib import Path
+from typing import Any
+from unittest import mock
+
+import pytest
+from watchfiles import Change
+
+from seplis_play import config, scan_watch
+from seplis_play.config import ConfigPlayScanModel
+from seplis_play.scan_watch import (
+    WatchEvent,
+    WatchQueue,
+    WriteWatcher,
+    find_moves,
+    handle_change,
+)
+from seplis_play.testbase import run_file
+
+scan_info = ConfigPlayScanModel(type='series', path=Path('/series'))
+
+
+@pytest.mark.asyncio
+async def test_watch_queue_lanes() -> None:
+    queue = WatchQueue(workers=1)
+    queue.put(WatchEvent(Change.added, '/series/a.mkv', scan_info))
+    queue.put(WatchEvent(Change.added, '/series/a.en.srt', scan_info))
+    queue.put(WatchEvent(Change.deleted, '/series/b.mkv', scan_info))
+    queue.put(WatchEvent(Change.added, '/series/c.mkv', scan_info))
+
+    assert [(await queue.get(0))[:2] for _ in range(4)] == [
+        (Change.deleted, '/series/b.mkv'),
+        (Change.added, '/series/a.en.srt'),
+        (Change.added, '/series/a.mkv'),
+        (Change.added, '/series/c.mkv'),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_watch_queue_keeps_the_latest_change_of_a_path() -> None:
+    queue = WatchQueue(workers=4)
+    queue.put(WatchEvent(Change.added, '/series/a.mkv', scan_info))
+    queue.put(WatchEvent(Change.modified, '/series/a.mkv', scan_info))
+    worker = queue.worker_index('/series/a.mkv')
+
+    assert sum(q.qsize() for q in queue.queues) == 1
+    assert (await queue.get(worker))[:2] == (Change.modified, '/series/a.mkv')
+
+
+@pytest.mark.asyncio
+async def test_watch_queue_moves_a_replaced_change_to_its_lane() -> None:
+    queue = WatchQueue(workers=1)
+    queue.put(WatchEvent(Change.added, '/series/a.mkv', scan_info))
+    queue.put(WatchEvent(Change.added, '/series/b.mkv', scan_info))
+    queue.put(WatchEvent(Change.deleted, '/series/b.mkv', scan_info))
+
+    assert (await queue.get(0))[:2] == (Change.deleted, '/series/b.mkv')
+    assert (await queue.get(0))[:2] == (Change.added, '/series/a.mkv')
+    # The entry left in the media lane is skipped
+    assert queue.queues[0].qsize() == 1
+    queue.put(WatchEvent(Change.added, '/series/c.mkv', scan_info))
+    assert (await queue.get(0))[:2] == (Change.added, '/series/c.mkv')
+
+
+@pytest.mark.asyncio
+async def test_watch_queue_holds_back_changes_under_a_scanned_directory() -> None:
+    queue = WatchQueue(workers=1)
+    queue.put(WatchEvent(Change.added, '/series/NCIS/s01e01.mkv', scan_info))
+    queue.put(WatchEvent(Change.added, '/series/NCIS', scan_info))
+    queue.put(WatchEvent(Change.added, '/series/NCIS/s01e02.mkv', scan_info))
+    queue.put(WatchEvent(Change.deleted, '/series/NCIS/s01e03.mkv', scan_info))
+
+    assert (await queue.get(0)).path == '/series/NCIS/s01e03.mkv'
+    directory = await queue.get(0)
+    assert directory.path == '/series/NCIS'
+    assert queue.waiting == {}
+
+    # Added again while being scanned, the changes are held until the next scan
+    queue.put(WatchEvent(Change.added, '/series/NCIS', scan_info))
+    queue.done(directory)
+    assert len(queue.directories['/series/NCIS']) == 2
+    directory = await queue.get(0)
+
+    # The held back changes are queued when the scan is done
+    queue.done(directory)
+    assert sorted(queue.waiting) == [
+        '/series/NCIS/s01e01.mkv',
+        '/series/NCIS/s01e02.mkv',
+    ]
+
+
+def test_find_moves() -> None:
+    events = [
+        WatchEvent(Change.deleted, '/series/NCIS/a/s01e01.mkv', scan_info),
+        WatchEvent(Change.added, '/series/NCIS/b/s01e01.mkv', scan_info),
+        WatchEvent(Change.deleted, '/series/NCIS/s01e02.mkv', scan_info),
+        WatchEvent(Change.added, '/series/NCIS/NCIS.S01E02.mkv', scan_info),
+        WatchEvent(Change.added, '/series/NCIS/NCIS.S01E02.en.srt', scan_info),
+        WatchEvent(Change.deleted, '/series/Lost/s01e03.mkv', scan_info),
+        WatchEvent(Change.deleted, '/series/Lost/s01e04.mkv', scan_info),
+        WatchEvent(Change.added, '/series/Lost/Lost.S01E03.mkv', scan_info),
+    ]
+
+    assert [(e.change, e.path, e.old_path) for e in find_moves(events)] == [
+        (Change.added, '/series/NCIS/b/s01e01.mkv', '/series/NCIS/a/s01e01.mkv'),
+        (Change.added, '/series/NCIS/NCIS.S01E02.mkv', '/series/NCIS/s01e02.mkv'),
+        (Change.added, '/series/NCIS/NCIS.S01E02.en.srt', None),
+        # Two deletes for one add can't be told apart
+        (Change.deleted, '/series/Lost/s01e03.mkv', None),
+        (Change.deleted, '/series/Lost/s01e04.mkv', None),
+        (Change.added, '/series/Lost/Lost.S01E03.mkv', None),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_write_watcher_waits_for_the_file_to_be_written(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config, 'scan_watch_stable_seconds', 0)
+    queue = WatchQueue(workers=1)
+    watcher = WriteWatcher(queue)
+    path = tmp_path / 'a.mkv'
+    path.write_bytes(b'a')
+
+    watcher.add(Change.added, str(path), scan_info)
+    await watcher.check()
+    with path.open('ab') as f:
+        f.write(b'b')
+    await watcher.check()
+    assert queue.queues[0].empty()
+
+    # Unchanged since the last check
+    await watcher.check()
+    assert (await queue.get(0))[:2] == (Change.added, str(path))
+    assert watcher.files == {}
+
+    # Deletes are not held back
+    watcher.add(Change.deleted, str(tmp_path / 'b.mkv'), scan_info)
+    assert (await queue.get(0))[:2] == (Change.deleted, str(tmp_path / 'b.mkv'))
+    assert watcher._task
+    watcher._task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_write_watcher_waits_for_the_files_in_a_directory(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config, 'scan_watch_stable_seconds', 0)
+    queue = WatchQueue(workers=1)
+    watcher = WriteWatcher(queue)
+    directory = tmp_path / 'NCIS'
+    directory.mkdir()
+    path = directory / 's01e01.mkv'
+    path.write_bytes(b'a')
+
+    watcher.add(Change.added, str(directory), scan_info)
+    watcher.add(Change.added, str(path), scan_info)
+    await watcher.check()
+    with path.open('ab') as f:
+        f.write(b'b')
+    await watcher.check()
+    assert queue.queues[0].empty()
+    assert str(directory) in watcher.files
+
+    await watcher.check()
+    assert list(queue.waiting) == [str(path)]
+
+    await watcher.check()
+    assert watcher.files == {}
+    # The file is then held back by the directory scan
+    assert (await queue.get(0))[:2] == (Change.added, str(directory))
+    assert queue.waiting == {}
+    assert watcher._task
+    watcher._task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_a_move_of_another_item_waits_for_the_file_to_be_written(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    scanner: Any = mock.MagicMock()
+    scanner.move_path = mock.AsyncMock(return_value=False)
+    scanner.delete_path = mock.AsyncMock()
+    scanner.save_item = mock.AsyncMock()
+    monkeypatch.setattr(scan_watch, 'get_scanner', lambda *args, **kwargs: scanner)
+    watcher = WriteWatcher(WatchQueue(workers=1))
+    monkeypatch.setattr(scan_watch, 'write_watcher', watcher)
+
+    await handle_change(
+        WatchEvent(Change.added, '/series/b.mkv', scan_info, old_path='/series/a.mkv')
+    )
+
+    scanner.delete_path.assert_called_once_with('/series/a.mkv')
+    scanner.save_item.assert_not_called()
+    assert list(watcher.files) == ['/series/b.mkv']
+    assert watcher._task
+    watcher._task.cancel()
+
+
+if __name__ == '__main__':
+    run_file(__file__)
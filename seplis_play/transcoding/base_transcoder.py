@@ -2,8 +2,10 @@ import asyncio
 import os
 import shutil
 import sys
+import time
 from collections.abc import Mapping, Sequence
 from dataclasses import dataclass
+from uuid import uuid4
 from weakref import WeakValueDictionary
 
 from loguru import logger
@@ -12,13 +14,15 @@ from pydantic import (
     ConfigDict,
 )
 
-from seplis_play import config
+from seplis_play import config, metrics
 from seplis_play.ffmpeg.ffmpeg_runner import FFmpegRunner
+from seplis_play.ffmpeg.ffmpeg_schemas import TranscodeProgress
 from seplis_play.schemas.source_metadata_schemas import (
     SourceMetadata,
     SourceMetadataVideoStream,
 )
 from seplis_play.schemas.source_schemas import Source, SourceStream
+from seplis_play.transcoding.hls_segment_tracker import HlsSegmentTracker
 from seplis_play.transcoding.transcode_decision_schema import (
     BlockerCode,
     DecisionBlocker,
@@ -34,7 +38,12 @@ from seplis_play.transcoding.transcode_decision_schema import (
     TranscodeDecision,
     format_blocker,
 )
+from seplis_play.transcoding.transcode_scheduler import (
+    TranscodeKind,
+    transcode_scheduler,
+)
 from seplis_play.transcoding.transcode_settings_schema import TranscodeSettings
+from seplis_play.utils.metrics_utils import Gauge
 
 
 class VideoColor(BaseModel):
@@ -51,6 +60,12 @@ class SessionModel:
     start_segment: int = 0
     transcode_decision: TranscodeDecision | None = None
     timeout_generation: int = 0
+    segment_tracker: HlsSegmentTracker | None = None
+    max_width: int | None = None  # Lowered when the session started under load
+    progress: TranscodeProgress | None = None
+    started_at: float = 0  # time.monotonic() when the transcoder was requested
+    playback_segment: int = -1  # Last segment requested by the player
+    transcoder_restarts: int = 0
 
     model_config = ConfigDict(
         arbitrary_types_allowed=True,
@@ -58,6 +73,16 @@ class SessionModel:
 
 
 sessions: dict[str, SessionModel] = {}
+metrics.registry.register(
+    Gauge('seplis_play_sessions', 'Active sessions', lambda: len(sessions))
+)
+metrics.registry.register(
+    Gauge(
+        'seplis_play_paused_sessions',
+        'Sessions with a paused transcoder',
+        lambda: sum(1 for s in sessions.values() if s.ffmpeg_runner.paused),
+    )
+)
 session_locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
 
 
@@ -122,32 +147,99 @@ class BaseTranscoder:
         self.ffmpeg_args: list[Mapping[str, str | float | int | None]] = []
         self.transcode_folder = ''
         self.ffmpeg_runner = FFmpegRunner()
+        self.job_id = f'{self.settings.session}:{uuid4().hex[:8]}'
+        self.preset: str = config.ffmpeg_preset
+        self.threads = 0
+        self.max_width: int | None = None
+        self.progress: TranscodeProgress | None = None
+        self.started_at = 0.0
 
     async def start(self) -> bool | bytes:
-        self.transcode_folder = self.create_transcode_folder()
+        """
+        :raises TranscodeSlotsFull: if the transcode limit was reached.
+        """
+        self.started_at = time.monotonic()
+        await transcode_scheduler.acquire(
+            self.job_id, self.metadata['format']['filename'], self.transcode_kind
+        )
+        try:
+            self.degrade()
+            self.transcode_folder = self.create_transcode_folder()
 
-        await self.set_ffmpeg_args()
+            await self.set_ffmpeg_args()
+            await transcode_scheduler.registry.update_status(
+                self.job_id, 'running', encoder=self.video_output_codec_lib
+            )
 
-        args = [
-            os.path.join(config.ffmpeg_folder, 'ffmpeg'),
-            *to_subprocess_arguments(self.ffmpeg_args),
-        ]
+            args = [
+                os.path.join(config.ffmpeg_folder, 'ffmpeg'),
+                *to_subprocess_arguments(self.ffmpeg_args),
+            ]
 
-        try:
-            self.process = await self.ffmpeg_runner.start(
-                args,
-                source=self.source,
-            )
-            if not self.process:
+            try:
+                self.process = await self.ffmpeg_runner.start(
+                    args,
+                    source=self.source,
+                    progress_callback=self.on_progress,
+                )
+                if not self.process:
+                    return False
+                metrics.transcoder_start_seconds.observe(
+                    time.monotonic() - self.started_at, self.transcode_kind
+                )
+            except RuntimeError as e:
+                logger.error(f'[{self.settings.session}] {e}')
+                # ffmpeg can still be running after the readiness timeout,
+                # it would keep the slot until it exits on its own
+                process = self.ffmpeg_runner.process
+                if process is not None and process.returncode is None:
+                    try:
+                        process.kill()
+                    except ProcessLookupError:
+                        pass
                 return False
-        except RuntimeError as e:
-            logger.error(f'[{self.settings.session}] {e}')
-            return False
+        finally:
+            transcode_scheduler.release_on_exit(self.job_id, self.ffmpeg_runner.process)
 
         await self.register_session()
 
         return True
 
+    def degrade(self) -> None:
+        """
+        Make new software encodes cheaper while the running ones struggle
+        to keep up.
+
+        The resolution is only lowered for new sessions so it doesn't
+        change when a session restarts its transcoder.
+        """
+        session_model = sessions.get(self.settings.session)
+        if session_model is not None:
+            self.max_width = session_model.max_width
+        if self.transcode_kind != 'software':
+            return
+        degradation = transcode_scheduler.get_degradation()
+        if degradation is None:
+            return
+        self.preset = degradation.preset
+        self.threads = degradation.threads
+        if session_model is None:
+            self.max_width = min(self.get_output_width(), degradation.max_width)
+        logger.info(
+            f'[{self.settings.session}] Degraded transcode under load '
+            f'(level={degradation.level}, preset={self.preset}, '
+            f'threads={self.threads}, width={self.get_output_width()})'
+        )
+
+    def on_progress(self, progress: TranscodeProgress) -> None:
+        self.progress = progress
+        session_model = sessions.get(self.settings.session)
+        if session_model and session_model.ffmpeg_runner is self.ffmpeg_runner:
+            session_model.progress = progress
+        transcode_scheduler.registry.update_progress(
+            self.job_id, float(progress.percent), progress.speed
+        )
+
     def ffmpeg_extend_args(self) -> None:
         pass
 
@@ -171,6 +263,14 @@ class BaseTranscoder:
     def media_path(self) -> str:
         raise NotImplementedError()
 
+    @property
+    def transcode_kind(self) -> TranscodeKind:
+        if self.can_copy_video:
+            return 'copy'
+        if config.ffmpeg_hwaccel_enabled:
+            return 'hardware'
+        return 'software'
+
     @property
     def media_name(self) -> str:
         raise NotImplementedError()
@@ -184,6 +284,11 @@ class BaseTranscoder:
             sessions[self.settings.session].start_segment = (
                 self.settings.start_segment or 0
             )
+            sessions[self.settings.session].max_width = self.max_width
+            sessions[self.settings.session].progress = self.progress
+            sessions[self.settings.session].started_at = self.started_at
+            sessions[self.settings.session].transcoder_restarts += 1
+            metrics.transcoder_restarts_total.inc()
         else:
             logger.info(f'[{self.settings.session}] Registered')
             sessions[self.settings.session] = SessionModel(
@@ -192,6 +297,9 @@ class BaseTranscoder:
                 call_later=None,
                 transcode_decision=self.transcode_decision,
                 start_segment=self.settings.start_segment or 0,
+                max_width=self.max_width,
+                progress=self.progress,
+                started_at=self.started_at,
             )
         reset_session_timeout(self.settings.session)
 
@@ -211,7 +319,7 @@ class BaseTranscoder:
                 {'-i': f'file:{self.metadata["format"]["filename"]}'},
                 {'-map_metadata': '-1'},
                 {'-map_chapters': '-1'},
-                {'-threads': '0'},
+                {'-threads': str(self.threads)},
                 {'-max_delay': '5000000'},
                 {'-max_muxing_queue_size': '2048'},
             ]
@@ -319,6 +427,8 @@ class BaseTranscoder:
 
     def get_output_width(self) -> int:
         width = self.settings.max_width or self.video_stream['width']
+        if self.max_width:
+            width = min(width, self.max_width)
         if width > self.video_stream['width']:
             width = self.video_stream['width']
         return width
@@ -679,7 +789,7 @@ class BaseTranscoder:
         self, width: int, output_codec: str
     ) -> list[Mapping[str, str]]:
         params = []
-        params.append({'-preset': config.ffmpeg_preset})
+        params.append({'-preset': self.preset})
         match output_codec:
             case 'libx264':
                 params.append(
@@ -1089,6 +1199,9 @@ async def _close_session(
     logger.info(f'[{session}] Closing')
     await close_transcoder(session)
     s = sessions[session]
+    metrics.session_transcoder_restarts.observe(s.transcoder_restarts)
+    if s.segment_tracker is not None:
+        await s.segment_tracker.close()
     try:
         if s.transcode_folder:
             if os.path.exists(s.transcode_folder):
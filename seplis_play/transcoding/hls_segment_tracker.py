@@ -0,0 +1,144 @@
+import asyncio
+import os
+import re
+import time
+
+from aiofile import AIOFile
+from watchfiles import awatch
+
+from seplis_play import logger, metrics
+
+SEGMENT_RE = re.compile(rb'(\d+)\.m4s')
+
+
+class HlsSegmentTracker:
+    """
+    Keeps track of the segments ffmpeg has listed in the live media playlist.
+
+    The playlist is only read when the file changes and requests waiting for
+    a segment are woken up through futures as soon as it has been written.
+
+    ffmpeg only appends to an event playlist, so every refresh continues from
+    the byte offset of the previous read. A playlist written by a restarted
+    transcoder is detected by its header and parsed from the top.
+    """
+
+    PREFIX_SIZE = 256
+
+    def __init__(self, media_path: str) -> None:
+        self.media_path = media_path
+        self.first = -1
+        self.last = -1
+        self.first_ready_at: float | None = None  # time.monotonic()
+        self._offset = 0
+        self._prefix = b''
+        self._waiters: list[tuple[int, asyncio.Future[bool]]] = []
+        self._stop_event = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def close(self) -> None:
+        self._stop_event.set()
+        for _, future in self._waiters:
+            if not future.done():
+                future.set_result(False)
+        self._waiters.clear()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=5)
+            except Exception as e:
+                logger.debug(f'[{self.media_path}] Segment watcher stopped: {e}')
+            self._task = None
+
+    def reset(self) -> None:
+        self.first = -1
+        self.last = -1
+        self.first_ready_at = None
+        self._offset = 0
+        self._prefix = b''
+
+    def is_ready(self, segment: int) -> bool:
+        return self.first <= segment <= self.last
+
+    async def refresh(self) -> None:
+        try:
+            async with AIOFile(self.media_path, 'rb') as afp:
+                size = os.fstat(afp.fileno()).st_size
+                if self._prefix and (
+                    size < self._offset
+                    or await afp.read(len(self._prefix), 0) != self._prefix
+                ):
+                    logger.debug(f'[{self.media_path}] Playlist was rewritten')
+                    self.reset()
+                if size > self._offset:
+                    self._parse(await afp.read(size - self._offset, self._offset))
+        except FileNotFoundError:
+            logger.debug(f'No media file {self.media_path}')
+            return
+        self._wake_waiters()
+
+    def _parse(self, data: bytes) -> None:
+        # Only consume complete lines, the rest is picked up by the next read.
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line.startswith(b'#'):
+                continue
+            m = SEGMENT_RE.search(line)
+            if m:
+                self.last = int(m.group(1))
+                if self.first < 0:
+                    self.first = self.last
+                    self.first_ready_at = time.monotonic()
+        if self._offset == 0:
+            self._prefix = data[: min(end, self.PREFIX_SIZE)]
+        self._offset += end
+
+    async def wait_for(self, segment: int, timeout: float = 10) -> bool:
+        if self.is_ready(segment):
+            return True
+        await self.refresh()
+        if self.is_ready(segment):
+            return True
+
+        future: asyncio.Future[bool] = asyncio.get_running_loop().create_future()
+        waiter = (segment, future)
+        self._waiters.append(waiter)
+        started = time.monotonic()
+        try:
+            ready = await asyncio.wait_for(future, timeout=timeout)
+            metrics.wait_for_segment_seconds.observe(
+                time.monotonic() - started, 'ready' if ready else 'closed'
+            )
+            return ready
+        except TimeoutError:
+            metrics.wait_for_segment_seconds.observe(
+                time.monotonic() - started, 'timeout'
+            )
+            logger.error(f'[{self.media_path}] Timeout waiting for segment {segment}')
+            return False
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _wake_waiters(self) -> None:
+        for segment, future in self._waiters:
+            if not future.done() and self.is_ready(segment):
+                future.set_result(True)
+
+    async def _watch(self) -> None:
+        folder = os.path.dirname(self.media_path)
+        await self.refresh()
+        try:
+            async for _ in awatch(
+                folder,
+                watch_filter=lambda _change, path: path == self.media_path,
+                stop_event=self._stop_event,
+                debounce=200,
+                step=10,
+            ):
+                await self.refresh()
+        except Exception as e:
+            logger.error(f'[{self.media_path}] Segment watcher failed: {e}')
@@ -1,14 +1,11 @@
-import asyncio
 import math
 import os
-import re
-from decimal import ROUND_CEILING, ROUND_HALF_UP, Decimal
+from array import array
+from decimal import ROUND_CEILING, Decimal
 from urllib.parse import urlencode
 
 import iso639
-from aiofile import AIOFile, LineReader
 
-from seplis_play import logger
 from seplis_play.scanners.subtitles.subtitles import get_external_subtitles
 from seplis_play.schemas.source_metadata_schemas import (
     SourceMetadata,
@@ -17,6 +14,13 @@ from seplis_play.schemas.source_schemas import SourceStream
 from seplis_play.transcoding.transcode_settings_schema import TranscodeSettings
 
 from . import base_transcoder
+from .hls_segment_tracker import HlsSegmentTracker
+from .segment_timeline import (
+    SegmentTimeline,
+    from_microseconds,
+    segment_timelines,
+    to_microseconds,
+)
 
 
 class HlsTranscoder(base_transcoder.BaseTranscoder):
@@ -103,47 +107,21 @@ class HlsTranscoder(base_transcoder.BaseTranscoder):
     def media_path(self) -> str:
         return os.path.join(self.transcode_folder, self.MEDIA_NAME)
 
-    @classmethod
-    async def wait_for_segment(cls, transcode_folder: str, segment: str | int) -> bool:
-        async def wait_for() -> bool:
-            while True:
-                if await cls.is_segment_ready(transcode_folder, segment):
-                    return True
-                await asyncio.sleep(0.1)
-
-        try:
-            return await asyncio.wait_for(wait_for(), timeout=10)
-        except TimeoutError:
-            logger.error(f'[{transcode_folder}] Timeout waiting for segment {segment}')
-            return False
-
-    @classmethod
-    async def first_last_transcoded_segment(
-        cls, transcode_folder: str
-    ) -> tuple[int, int]:
-        f = os.path.join(transcode_folder, cls.MEDIA_NAME)
-        first, last = (-1, -1)
-        if os.path.exists(f):
-            async with AIOFile(f, 'r') as afp:
-                async for line in LineReader(afp):
-                    if not isinstance(line, str):
-                        line = bytes(line).decode()
-                    if '#' not in line:
-                        m = re.search(r'(\d+)\.m4s', line)
-                        if m:
-                            last = int(m.group(1))
-                            if first < 0:
-                                first = last
+    async def register_session(self) -> None:
+        await super().register_session()
+        session_model = base_transcoder.sessions[self.settings.session]
+        if session_model.segment_tracker is None:
+            session_model.segment_tracker = HlsSegmentTracker(self.media_path)
+            session_model.segment_tracker.start()
         else:
-            logger.debug(f'No media file {f}')
-        return (first, last)
+            session_model.segment_tracker.reset()
 
-    @classmethod
-    async def is_segment_ready(cls, transcode_folder: str, segment: str | int) -> bool:
-        first_segment, last_segment = await cls.first_last_transcoded_segment(
-            transcode_folder
-        )
-        return int(segment) >= first_segment and int(segment) <= last_segment
+    @staticmethod
+    async def wait_for_segment(session: str, segment: int) -> bool:
+        session_model = base_transcoder.sessions.get(session)
+        if not session_model or not session_model.segment_tracker:
+            return False
+        return await session_model.segment_tracker.wait_for(segment)
 
     @staticmethod
     def get_segment_path(transcode_folder: str, segment: int) -> str:
@@ -154,17 +132,13 @@ class HlsTranscoder(base_transcoder.BaseTranscoder):
         settings_dict.pop('start_segment', None)
         settings_dict.pop('start_time', None)
         url_settings = urlencode(settings_dict)
-        segments = self.get_segments()
+        timeline = self.get_segment_timeline()
+        segments = timeline.durations()
         playlist = []
         playlist.append('#EXTM3U')
         playlist.append('#EXT-X-VERSION:7')
         playlist.append('#EXT-X-PLAYLIST-TYPE:VOD')
-        target_duration = self.segment_time()
-        if segments:
-            target_duration = max(
-                1,
-                int(max(segments).to_integral_value(rounding=ROUND_HALF_UP)),
-            )
+        target_duration = timeline.target_duration(default=self.segment_time())
         playlist.append(f'#EXT-X-TARGETDURATION:{target_duration}')
         playlist.append('#EXT-X-MEDIA-SEQUENCE:0')
         playlist.append(f'#EXT-X-MAP:URI="/hls/init.mp4?{url_settings}"')
@@ -288,43 +262,64 @@ class HlsTranscoder(base_transcoder.BaseTranscoder):
         return Decimal(numerator) / Decimal(denominator)
 
     def get_segments(self) -> list[Decimal]:
-        if self.can_copy_video:
-            return self.calculate_keyframe_segments()
-        return self.calculate_transcoded_segments()
-
-    def calculate_keyframe_segments(self) -> list[Decimal]:
-        result: list[Decimal] = []
-        target_duration = Decimal(self.segment_time())
-        keyframes = [Decimal(t) for t in (self.metadata.get('keyframes') or [])]
-        timeline_origin = keyframes[0] if keyframes else Decimal(0)
+        return self.get_segment_timeline().durations()
+
+    def get_segment_timeline(self) -> SegmentTimeline:
+        keyframes = self.metadata.get('keyframes') or []
+        key = (
+            self.metadata['format']['filename'],
+            str(self.source.duration),
+            self.video_stream.get('r_frame_rate'),
+            len(keyframes),
+            keyframes[0] if keyframes else None,
+            keyframes[-1] if keyframes else None,
+            self.segment_time(),
+            self.get_expected_video_encoder(),
+        )
+        timeline = segment_timelines.get(key)
+        if timeline is None:
+            if self.can_copy_video:
+                timeline = self.calculate_keyframe_segments()
+            else:
+                timeline = self.calculate_transcoded_segments()
+            segment_timelines.set(key, timeline)
+        return timeline
+
+    def calculate_keyframe_segments(self) -> SegmentTimeline:
+        target_duration = to_microseconds(Decimal(self.segment_time()))
+        keyframes = self.metadata.get('keyframes') or array('q')
+        timeline_origin = keyframes[0] if keyframes else 0
         break_time = timeline_origin + target_duration
-        prev_keyframe = timeline_origin
+        boundaries = array('q', [0])
         for keyframe in keyframes:
             if keyframe >= break_time:
-                result.append(keyframe - prev_keyframe)
-                prev_keyframe = keyframe
+                boundaries.append(keyframe - timeline_origin)
                 break_time += target_duration
-        result.append(self.source.duration - prev_keyframe)
-        return result
+        boundaries.append(to_microseconds(self.source.duration) - timeline_origin)
+        return SegmentTimeline(
+            boundaries=boundaries,
+            origin=timeline_origin,
+            keyframes=keyframes,
+        )
 
-    def calculate_transcoded_segments(self) -> list[Decimal]:
+    def calculate_transcoded_segments(self) -> SegmentTimeline:
         target_duration = Decimal(self.segment_time())
         duration = self.source.duration
         frame_rate = self.get_frame_rate_decimal()
+        boundaries = array('q', [0])
         if duration <= 0:
-            return []
+            return SegmentTimeline(boundaries=boundaries)
         if frame_rate <= 0:
             segment_count = int(duration // target_duration)
-            result = [target_duration for _ in range(segment_count)]
-            left_over = duration % target_duration
-            if left_over:
-                result.append(left_over)
-            return result
+            boundaries.extend(
+                to_microseconds(target_duration * i) for i in range(1, segment_count + 1)
+            )
+            if duration % target_duration:
+                boundaries.append(to_microseconds(duration))
+            return SegmentTimeline(boundaries=boundaries)
 
         codec_lib = self.get_expected_video_encoder()
         fixed_gop_frames = math.ceil(target_duration * frame_rate)
-        result = []
-        previous_boundary = Decimal(0)
         segment = 1
         while True:
             if codec_lib in self.FIXED_GOP_ENCODERS:
@@ -334,18 +329,11 @@ class HlsTranscoder(base_transcoder.BaseTranscoder):
                 boundary = target.to_integral_value(rounding=ROUND_CEILING) / frame_rate
             boundary = boundary.quantize(self.SEGMENT_TIMESTAMP_PRECISION)
             if boundary >= duration:
-                result.append(
-                    (duration - previous_boundary).quantize(
-                        self.SEGMENT_TIMESTAMP_PRECISION
-                    )
-                )
+                boundaries.append(to_microseconds(duration))
                 break
-            result.append(
-                (boundary - previous_boundary).quantize(self.SEGMENT_TIMESTAMP_PRECISION)
-            )
-            previous_boundary = boundary
+            boundaries.append(to_microseconds(boundary))
             segment += 1
-        return result
+        return SegmentTimeline(boundaries=boundaries)
 
     def get_expected_video_encoder(self) -> str:
         if self.can_copy_video:
@@ -361,14 +349,13 @@ class HlsTranscoder(base_transcoder.BaseTranscoder):
         )
 
     def start_time_from_segment(self, segment: int) -> Decimal:
-        segments = self.get_segments()
-        boundary = Decimal(sum(segments[:segment]))
+        timeline = self.get_segment_timeline()
+        boundary = timeline.segment_start(segment)
         if not self.can_copy_video or segment == 0:
             return boundary
 
-        keyframes = sorted(Decimal(t) for t in (self.metadata.get('keyframes') or []))
-        source_boundary = boundary + (keyframes[0] if keyframes else Decimal(0))
-        next_keyframe = next((time for time in keyframes if time > source_boundary), None)
+        source_boundary = boundary + from_microseconds(timeline.origin)
+        next_keyframe = timeline.next_keyframe_after(source_boundary)
         if next_keyframe is None:
             return source_boundary
 
@@ -378,15 +365,7 @@ class HlsTranscoder(base_transcoder.BaseTranscoder):
         )
 
     def start_segment_from_start_time(self, start_time: Decimal) -> int:
-        if start_time <= 0:
-            return 0
-        segments = self.get_segments()
-        time = Decimal(0)
-        for i, t in enumerate(segments):
-            time += t
-            if time > start_time:
-                return i
-        return max(0, len(segments) - 1)
+        return self.get_segment_timeline().segment_at(start_time)
 
     def keyframe_params(self) -> list[dict[str, str | None]]:
         if self.video_output_codec_lib == 'copy':
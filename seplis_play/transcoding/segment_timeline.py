@@ -0,0 +1,70 @@
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_UP, Decimal
+
+from seplis_play.utils.lru_cache_utils import LRUCache
+
+
+def to_microseconds(value: Decimal | str) -> int:
+    return int(Decimal(value).scaleb(6).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_microseconds(value: int) -> Decimal:
+    return Decimal(value).scaleb(-6)
+
+
+@dataclass(frozen=True)
+class SegmentTimeline:
+    """
+    Segment boundaries of a source, in microseconds from the start of the timeline.
+
+    `boundaries[i]` is where segment `i` starts and `boundaries[-1]` is the end
+    of the last segment. `origin` is the source timestamp the timeline starts at
+    and `keyframes` holds the sorted source keyframe timestamps when the video
+    is copied.
+    """
+
+    boundaries: array
+    origin: int = 0
+    keyframes: array = field(default_factory=lambda: array('q'))
+
+    def __len__(self) -> int:
+        return max(0, len(self.boundaries) - 1)
+
+    def durations(self) -> list[Decimal]:
+        return [
+            from_microseconds(self.boundaries[i + 1] - self.boundaries[i])
+            for i in range(len(self))
+        ]
+
+    def target_duration(self, default: int) -> int:
+        if not len(self):
+            return default
+        longest = max(
+            self.boundaries[i + 1] - self.boundaries[i] for i in range(len(self))
+        )
+        return max(
+            1,
+            int(from_microseconds(longest).to_integral_value(rounding=ROUND_HALF_UP)),
+        )
+
+    def segment_start(self, segment: int) -> Decimal:
+        if not len(self):
+            return Decimal(0)
+        return from_microseconds(self.boundaries[min(segment, len(self))])
+
+    def segment_at(self, time: Decimal) -> int:
+        if time <= 0 or not len(self):
+            return 0
+        segment = bisect_right(self.boundaries, to_microseconds(time)) - 1
+        return max(0, min(segment, len(self) - 1))
+
+    def next_keyframe_after(self, time: Decimal) -> Decimal | None:
+        i = bisect_right(self.keyframes, to_microseconds(time))
+        if i >= len(self.keyframes):
+            return None
+        return from_microseconds(self.keyframes[i])
+
+
+segment_timelines: LRUCache[tuple, SegmentTimeline] = LRUCache(maxsize=64)
@@ -1,3 +1,4 @@
+from array import array
 from uuid import uuid4
 
 from seplis_play.schemas.source_metadata_schemas import SourceMetadata
@@ -70,7 +71,7 @@ def test_client_audio_track_switch_unsupported() -> None:
             'size': '1000000',
             'bit_rate': '2500000',
         },
-        'keyframes': ['0.000000', '6.000000'],
+        'keyframes': array('q', [0, 6_000_000]),
     }
 
     transcoder = BaseTranscoder(settings, metadata)
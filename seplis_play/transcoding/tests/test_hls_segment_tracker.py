@@ -0,0 +1,97 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from seplis_play.testbase import run_file
+from seplis_play.transcoding.hls_segment_tracker import HlsSegmentTracker
+
+
+def write_playlist(path: Path, first: int, last: int) -> None:
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:7',
+        f'#EXT-X-MEDIA-SEQUENCE:{first}',
+        '#EXT-X-MAP:URI="init.mp4"',
+    ]
+    for i in range(first, last + 1):
+        lines.append('#EXTINF:6.000000,')
+        lines.append(f'media{i}.m4s')
+    path.write_text('\n'.join(lines) + '\n')
+
+
+@pytest.mark.asyncio
+async def test_waiting_request_is_woken_when_segment_is_listed(tmp_path: Path) -> None:
+    media_path = tmp_path / 'media.m3u8'
+    write_playlist(media_path, 5, 6)
+    tracker = HlsSegmentTracker(str(media_path))
+    await tracker.refresh()
+    assert (tracker.first, tracker.last) == (5, 6)
+    assert tracker.is_ready(6)
+    assert not tracker.is_ready(7)
+
+    waiter = asyncio.create_task(tracker.wait_for(7, timeout=5))
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+
+    write_playlist(media_path, 5, 7)
+    await tracker.refresh()
+
+    assert await waiter is True
+
+
+@pytest.mark.asyncio
+async def test_refresh_only_parses_appended_bytes(tmp_path: Path) -> None:
+    media_path = tmp_path / 'media.m3u8'
+    write_playlist(media_path, 0, 2)
+    tracker = HlsSegmentTracker(str(media_path))
+    await tracker.refresh()
+    offset = tracker._offset
+    assert offset == media_path.stat().st_size
+
+    with media_path.open('a') as f:
+        f.write('#EXTINF:6.000000,\nmedia3.m4s\n#EXTINF:6.0')
+    await tracker.refresh()
+
+    assert (tracker.first, tracker.last) == (0, 3)
+    assert tracker._offset == offset + len('#EXTINF:6.000000,\nmedia3.m4s\n')
+
+
+@pytest.mark.asyncio
+async def test_refresh_detects_a_playlist_from_a_restarted_transcoder(
+    tmp_path: Path,
+) -> None:
+    media_path = tmp_path / 'media.m3u8'
+    write_playlist(media_path, 0, 3)
+    tracker = HlsSegmentTracker(str(media_path))
+    await tracker.refresh()
+
+    write_playlist(media_path, 40, 45)
+    await tracker.refresh()
+
+    assert (tracker.first, tracker.last) == (40, 45)
+
+
+@pytest.mark.asyncio
+async def test_waiting_request_times_out(tmp_path: Path) -> None:
+    media_path = tmp_path / 'media.m3u8'
+    write_playlist(media_path, 0, 1)
+    tracker = HlsSegmentTracker(str(media_path))
+
+    assert await tracker.wait_for(3, timeout=0.05) is False
+    assert not tracker._waiters
+
+
+@pytest.mark.asyncio
+async def test_close_releases_waiting_requests(tmp_path: Path) -> None:
+    tracker = HlsSegmentTracker(str(tmp_path / 'media.m3u8'))
+
+    waiter = asyncio.create_task(tracker.wait_for(0, timeout=5))
+    await asyncio.sleep(0.01)
+    await tracker.close()
+
+    assert await waiter is False
+
+
+if __name__ == '__main__':
+    run_file(__file__)
@@ -1,4 +1,5 @@
 import asyncio
+from array import array
 from decimal import Decimal
 from pathlib import Path
 from typing import cast
@@ -10,6 +11,7 @@ from seplis_play import config
 from seplis_play.schemas.source_metadata_schemas import SourceMetadata
 from seplis_play.testbase import run_file
 from seplis_play.transcoding.hls_transcoder import HlsTranscoder
+from seplis_play.transcoding.segment_timeline import to_microseconds
 from seplis_play.transcoding.transcode_settings_schema import TranscodeSettings
 
 
@@ -66,34 +68,37 @@ def test_hls() -> None:
                 'size': '2743430123',
                 'bit_rate': '6294815',
             },
-            'keyframes': [
-                '0.000000',
-                '6.715000',
-                '10.761000',
-                '14.473000',
-                '24.900000',
-                '25.984000',
-                '27.819000',
-                '30.489000',
-                '31.865000',
-                '33.200000',
-                '36.787000',
-                '38.455000',
-                '41.208000',
-                '44.002000',
-                '46.505000',
-                '48.757000',
-                '50.634000',
-                '56.723000',
-                '60.352000',
-                '62.562000',
-                '68.527000',
-                '75.909000',
-                '86.336000',
-                '90.882000',
-                '92.384000',
-                '96.221000',
-            ],
+            'keyframes': array(
+                'q',
+                [
+                    0,
+                    6_715_000,
+                    10_761_000,
+                    14_473_000,
+                    24_900_000,
+                    25_984_000,
+                    27_819_000,
+                    30_489_000,
+                    31_865_000,
+                    33_200_000,
+                    36_787_000,
+                    38_455_000,
+                    41_208_000,
+                    44_002_000,
+                    46_505_000,
+                    48_757_000,
+                    50_634_000,
+                    56_723_000,
+                    60_352_000,
+                    62_562_000,
+                    68_527_000,
+                    75_909_000,
+                    86_336_000,
+                    90_882_000,
+                    92_384_000,
+                    96_221_000,
+                ],
+            ),
         },
     )
 
@@ -163,7 +168,7 @@ def test_hls_main_playlist_does_not_include_subtitles_by_default(
             'size': '1000000',
             'bit_rate': '2500000',
         },
-        'keyframes': ['0.000000', '6.000000'],
+        'keyframes': array('q', [0, 6_000_000]),
     }
 
     playlist = asyncio.run(HlsTranscoder(settings, metadata).generate_main_playlist())
@@ -237,7 +242,7 @@ def test_hls_main_playlist_includes_subtitles_when_enabled(
             'size': '1000000',
             'bit_rate': '2500000',
         },
-        'keyframes': ['0.000000', '6.000000'],
+        'keyframes': array('q', [0, 6_000_000]),
     }
 
     playlist = asyncio.run(HlsTranscoder(settings, metadata).generate_main_playlist())
@@ -320,7 +325,7 @@ def test_hls_main_playlist_only_includes_selected_subtitle_when_not_including_al
             'size': '1000000',
             'bit_rate': '2500000',
         },
-        'keyframes': ['0.000000', '6.000000'],
+        'keyframes': array('q', [0, 6_000_000]),
     }
 
     playlist = asyncio.run(HlsTranscoder(settings, metadata).generate_main_playlist())
@@ -383,7 +388,7 @@ def test_qsv_tonemap_filter_without_resize_has_valid_scale_expression(
             'size': '1000000',
             'bit_rate': '2500000',
         },
-        'keyframes': ['0.000000', '6.000000'],
+        'keyframes': array('q', [0, 6_000_000]),
     }
 
     transcoder = HlsTranscoder(settings, metadata)
@@ -435,7 +440,7 @@ def test_hls_h264_only_does_not_expose_hdr() -> None:
             'size': '1000000',
             'bit_rate': '2500000',
         },
-        'keyframes': ['0.000000', '6.000000'],
+        'keyframes': array('q', [0, 6_000_000]),
     }
 
     transcoder = HlsTranscoder(settings, metadata)
@@ -488,7 +493,7 @@ def test_hls_stream_info_uses_shared_output_resolution_and_codecs() -> None:
             'size': '1000000',
             'bit_rate': '2500000',
         },
-        'keyframes': ['0.000000', '6.000000'],
+        'keyframes': array('q', [0, 6_000_000]),
     }
 
     transcoder = HlsTranscoder(settings, metadata)
@@ -543,7 +548,7 @@ def test_hls_h264_source_is_treated_as_sdr_even_if_hevc_is_supported() -> None:
             'size': '1000000',
             'bit_rate': '2500000',
         },
-        'keyframes': ['0.000000', '6.000000'],
+        'keyframes': array('q', [0, 6_000_000]),
     }
 
     transcoder = HlsTranscoder(settings, metadata)
@@ -598,7 +603,7 @@ def test_hls_hevc_hdr10_stream_info_uses_main10_tier_and_pq() -> None:
             'size': '1000000',
             'bit_rate': '2500000',
         },
-        'keyframes': ['0.000000', '6.000000'],
+        'keyframes': array('q', [0, 6_000_000]),
     }
 
     transcoder = HlsTranscoder(settings, metadata)
@@ -657,7 +662,7 @@ def test_hls_hevc_stream_info_infers_high_tier_from_bitrate() -> None:
             'size': '1000000',
             'bit_rate': '50000000',
         },
-        'keyframes': ['0.000000', '6.000000'],
+        'keyframes': array('q', [0, 6_000_000]),
     }
 
     transcoder = HlsTranscoder(settings, metadata)
@@ -710,7 +715,7 @@ def test_hls_hevc_hdr10_transcode_uses_jellyfin_compatible_sdr_main_profile() ->
             'size': '1000000',
             'bit_rate': '50000000',
         },
-        'keyframes': ['0.000000', '6.000000'],
+        'keyframes': array('q', [0, 6_000_000]),
     }
 
     transcoder = HlsTranscoder(settings, metadata)
@@ -766,7 +771,13 @@ def make_hls_metadata(
             'size': '1000000',
             'bit_rate': '2500000',
         },
-        'keyframes': keyframes or ['0.000000', '6.006000', '12.012000'],
+        'keyframes': array(
+            'q',
+            (
+                to_microseconds(k)
+                for k in keyframes or ['0.000000', '6.006000', '12.012000']
+            ),
+        ),
     }
 
 
@@ -0,0 +1,73 @@
+from array import array
+from decimal import Decimal
+from uuid import uuid4
+
+from seplis_play.schemas.source_metadata_schemas import SourceMetadata
+from seplis_play.testbase import run_file
+from seplis_play.transcoding.hls_transcoder import HlsTranscoder
+from seplis_play.transcoding.segment_timeline import SegmentTimeline
+from seplis_play.transcoding.transcode_settings_schema import TranscodeSettings
+
+
+def test_segment_lookups_use_the_cumulative_boundaries() -> None:
+    timeline = SegmentTimeline(
+        boundaries=array('q', [0, 6_000_000, 12_500_000, 15_000_000]),
+        origin=21_000,
+        keyframes=array('q', [21_000, 6_021_000, 6_500_000, 12_521_000]),
+    )
+
+    assert len(timeline) == 3
+    assert timeline.durations() == [Decimal('6'), Decimal('6.5'), Decimal('2.5')]
+    assert timeline.target_duration(default=6) == 7
+    assert timeline.segment_start(2) == Decimal('12.5')
+    assert timeline.segment_start(10) == Decimal('15')
+    assert timeline.segment_at(Decimal(0)) == 0
+    assert timeline.segment_at(Decimal('5.999999')) == 0
+    assert timeline.segment_at(Decimal('6')) == 1
+    assert timeline.segment_at(Decimal('100')) == 2
+    assert timeline.next_keyframe_after(Decimal('6.021')) == Decimal('6.5')
+    assert timeline.next_keyframe_after(Decimal('12.521')) is None
+
+
+def test_segment_timeline_is_reused_for_the_same_source() -> None:
+    metadata: SourceMetadata = {
+        'streams': [
+            {
+                'index': 0,
+                'codec_name': 'h264',
+                'codec_type': 'video',
+                'width': 1920,
+                'height': 1080,
+                'pix_fmt': 'yuv420p',
+                'r_frame_rate': '24000/1001',
+            },
+            {
+                'index': 1,
+                'codec_name': 'aac',
+                'codec_type': 'audio',
+                'channels': 2,
+            },
+        ],
+        'format': {
+            'format_name': 'matroska,webm',
+            'filename': f'/tmp/{uuid4().hex}.mkv',
+            'duration': '18.000',
+            'size': '1000000',
+            'bit_rate': '2500000',
+        },
+        'keyframes': array('q', [0, 6_000_000, 12_000_000]),
+    }
+
+    def make_transcoder() -> HlsTranscoder:
+        return HlsTranscoder(
+            TranscodeSettings(play_id='a', session=uuid4().hex),
+            metadata,
+        )
+
+    timeline = make_transcoder().get_segment_timeline()
+
+    assert make_transcoder().get_segment_timeline() is timeline
+
+
+if __name__ == '__main__':
+    run_file(__file__)
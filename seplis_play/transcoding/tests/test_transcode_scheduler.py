@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from seplis_play import config
+from seplis_play.testbase import run_file
+from seplis_play.transcoding import transcode_scheduler
+from seplis_play.transcoding.transcode_scheduler import (
+    TranscodeScheduler,
+    TranscodeSlotsFull,
+)
+
+
+@pytest.mark.asyncio
+async def test_jobs_wait_for_a_free_slot(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, 'ffmpeg_max_software_transcodes', 1)
+    scheduler = TranscodeScheduler()
+
+    await scheduler.acquire('a', 'a.mkv', 'software')
+    waiting = asyncio.create_task(scheduler.acquire('b', 'b.mkv', 'software'))
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    assert [j.job_id for j in scheduler.registry.get_queued_jobs()] == ['b']
+
+    await scheduler.release('a')
+    await waiting
+    assert [j.job_id for j in scheduler.registry.get_running_jobs()] == ['b']
+
+
+@pytest.mark.asyncio
+async def test_rejected_when_no_slot_frees_up(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, 'ffmpeg_max_hardware_transcodes', 1)
+    monkeypatch.setattr(config, 'ffmpeg_transcode_queue_timeout', 0.01)
+    monkeypatch.setattr(config, 'ffmpeg_transcode_retry_after', 7)
+    scheduler = TranscodeScheduler()
+
+    await scheduler.acquire('a', 'a.mkv', 'hardware')
+    with pytest.raises(TranscodeSlotsFull) as e:
+        await scheduler.acquire('b', 'b.mkv', 'hardware')
+    assert e.value.retry_after == 7
+    assert await scheduler.registry.get_job('b') is None
+
+    # Copy jobs have their own slots
+    await scheduler.acquire('c', 'c.mkv', 'copy')
+
+
+@pytest.mark.asyncio
+async def test_copy_jobs_are_admitted_first(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, 'ffmpeg_max_transcodes', 2)
+    scheduler = TranscodeScheduler()
+    admitted: list[str] = []
+
+    async def acquire(job_id: str, kind: str) -> None:
+        await scheduler.acquire(job_id, f'{job_id}.mkv', kind)  # type: ignore[arg-type]
+        admitted.append(job_id)
+
+    await scheduler.acquire('a', 'a.mkv', 'software')
+    await scheduler.acquire('b', 'b.mkv', 'copy')
+    tasks = [
+        asyncio.create_task(acquire('c', 'software')),
+        asyncio.create_task(acquire('d', 'copy')),
+    ]
+    await asyncio.sleep(0)
+
+    await scheduler.release('a')
+    await asyncio.sleep(0.01)
+    assert admitted == ['d']
+
+    await scheduler.release('b')
+    await asyncio.gather(*tasks)
+    assert admitted == ['d', 'c']
+
+
+@pytest.mark.asyncio
+async def test_slot_is_released_when_the_process_exits() -> None:
+    scheduler = TranscodeScheduler()
+    await scheduler.acquire('a', 'a.mkv', 'software')
+    process = await asyncio.create_subprocess_exec('true')
+
+    scheduler.release_on_exit('a', process)
+    await asyncio.gather(*scheduler._watchers)
+
+    assert scheduler.registry.get_running_jobs() == []
+
+
+@pytest.mark.asyncio
+async def test_degrades_as_encodes_slow_down(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, 'ffmpeg_preset', 'veryfast')
+    monkeypatch.setattr(config, 'ffmpeg_degrade_speed', 1.5)
+    monkeypatch.setattr(config, 'ffmpeg_degrade_load', 0.9)
+    monkeypatch.setattr(config, 'ffmpeg_max_software_transcodes', 2)
+    monkeypatch.setattr(transcode_scheduler.os, 'cpu_count', lambda: 8)
+    monkeypatch.setattr(transcode_scheduler, 'get_system_load', lambda: 0.5)
+    scheduler = TranscodeScheduler()
+    await scheduler.acquire('a', 'a.mkv', 'software')
+    await scheduler.acquire('b', 'b.mkv', 'copy')
+
+    # No speed reported yet
+    assert scheduler.get_degradation() is None
+
+    scheduler.registry.update_progress('a', 10, 3.0)
+    scheduler.registry.update_progress('b', 10, 0.5)  # Copy jobs don't count
+    assert scheduler.get_degradation() is None
+
+    monkeypatch.setattr(transcode_scheduler, 'get_system_load', lambda: 1.0)
+    degradation = scheduler.get_degradation()
+    assert degradation is not None
+    assert degradation.level == 1
+    assert degradation.preset == 'superfast'
+    assert degradation.max_width == 1920
+
+    await scheduler.acquire('c', 'c.mkv', 'software')
+    scheduler.registry.update_progress('a', 10, 1.2)
+    scheduler.registry.update_progress('c', 10, 1.1)
+    degradation = scheduler.get_degradation()
+    assert degradation is not None
+    assert degradation.level == 2
+    assert degradation.preset == 'ultrafast'
+    assert degradation.threads == 4
+    assert degradation.max_width == 1280
+
+
+if __name__ == '__main__':
+    run_file(__file__)
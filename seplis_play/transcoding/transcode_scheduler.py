@@ -0,0 +1,194 @@
+import asyncio
+import os
+from collections import Counter
+from dataclasses import dataclass
+from typing import Literal
+
+from loguru import logger
+
+from seplis_play import config, metrics
+from seplis_play.ffmpeg.ffmpeg_job_context import JobRegistry, JobRegistryEntry
+
+TranscodeKind = Literal['copy', 'hardware', 'software']
+
+# Cheaper jobs are admitted first when the total limit is reached
+KIND_PRIORITY: dict[str, int] = {'copy': 0, 'hardware': 1, 'software': 2}
+
+
+PRESETS = (
+    'veryslow',
+    'slower',
+    'slow',
+    'medium',
+    'fast',
+    'faster',
+    'veryfast',
+    'superfast',
+    'ultrafast',
+)
+# Output width caps for new sessions per pressure level
+DEGRADED_WIDTHS = (1920, 1280)
+MAX_PRESSURE = len(DEGRADED_WIDTHS)
+
+
+@dataclass
+class Degradation:
+    level: int
+    preset: str
+    threads: int
+    max_width: int
+
+
+class TranscodeSlotsFull(Exception):
+    def __init__(self, kind: str, retry_after: int) -> None:
+        super().__init__(f'No free {kind} transcode slot')
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+def get_limit(kind: str | None) -> int:
+    if kind == 'copy':
+        return config.ffmpeg_max_copy_transcodes or config.ffmpeg_max_transcodes
+    if kind == 'hardware':
+        return config.ffmpeg_max_hardware_transcodes
+    return config.ffmpeg_max_software_transcodes or max(1, (os.cpu_count() or 1) // 2)
+
+
+def get_system_load() -> float | None:
+    """
+    The 1 minute load average per CPU.
+    """
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except AttributeError, OSError:
+        return None
+
+
+def get_priority(job: JobRegistryEntry) -> int:
+    return KIND_PRIORITY.get(job.kind or 'software', len(KIND_PRIORITY))
+
+
+class TranscodeScheduler:
+    """
+    Limits the number of ffmpeg processes running at a time.
+
+    Jobs wait in the registry as queued until a slot of their kind is free
+    and the total limit isn't reached.
+    """
+
+    def __init__(self) -> None:
+        self.registry = JobRegistry()
+        self._waiters: dict[str, asyncio.Future[None]] = {}
+        self._watchers: set[asyncio.Task[None]] = set()
+
+    async def acquire(self, job_id: str, source: str, kind: TranscodeKind) -> None:
+        """
+        Wait for a free slot for the job.
+
+        :raises TranscodeSlotsFull: if no slot was freed within
+            `ffmpeg_transcode_queue_timeout`.
+        """
+        await self.registry.register(job_id, source, kind=kind)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[job_id] = waiter
+        self.admit()
+        if not waiter.done():
+            logger.info(f'[{job_id}] Waiting for a free {kind} transcode slot')
+        try:
+            await asyncio.wait_for(waiter, config.ffmpeg_transcode_queue_timeout)
+        except TimeoutError:
+            await self.release(job_id)
+            logger.warning(f'[{job_id}] No free {kind} transcode slot')
+            metrics.transcodes_rejected_total.inc(kind)
+            raise TranscodeSlotsFull(kind, config.ffmpeg_transcode_retry_after) from None
+        except BaseException:
+            await self.release(job_id)
+            raise
+
+    async def release(self, job_id: str) -> None:
+        self._waiters.pop(job_id, None)
+        await self.registry.remove(job_id)
+        self.admit()
+
+    def release_on_exit(
+        self, job_id: str, process: asyncio.subprocess.Process | None
+    ) -> None:
+        """
+        Release the job's slot when its ffmpeg process exits.
+        """
+        task = asyncio.create_task(self._release_on_exit(job_id, process))
+        self._watchers.add(task)
+        task.add_done_callback(self._watchers.discard)
+
+    async def _release_on_exit(
+        self, job_id: str, process: asyncio.subprocess.Process | None
+    ) -> None:
+        try:
+            if process is not None:
+                await process.wait()
+        finally:
+            await self.release(job_id)
+
+    def admit(self) -> None:
+        running = Counter(job.kind for job in self.registry.get_running_jobs())
+        total = running.total()
+        for job in sorted(self.registry.get_queued_jobs(), key=get_priority):
+            if total >= config.ffmpeg_max_transcodes:
+                break
+            waiter = self._waiters.get(job.job_id)
+            if waiter is None or waiter.done():
+                continue
+            if running[job.kind] >= get_limit(job.kind):
+                continue
+            running[job.kind] += 1
+            total += 1
+            job.status = 'running'
+            del self._waiters[job.job_id]
+            waiter.set_result(None)
+
+    def get_pressure(self) -> int:
+        """
+        How far new software encodes should step down, from 0 to `MAX_PRESSURE`.
+
+        The average speed of the running encodes falling below
+        `ffmpeg_degrade_speed` is level 1 and below the halfway point to
+        real time level 2. The system load alone is at most level 1.
+        """
+        level = 0
+        load = get_system_load()
+        if load is not None and load >= config.ffmpeg_degrade_load:
+            level = 1
+        speeds = [
+            job.speed
+            for job in self.registry.get_running_jobs()
+            if job.kind != 'copy' and job.speed > 0
+        ]
+        if speeds:
+            speed = sum(speeds) / len(speeds)
+            if speed < (1 + config.ffmpeg_degrade_speed) / 2:
+                level = 2
+            elif speed < config.ffmpeg_degrade_speed:
+                level = max(level, 1)
+        return min(level, MAX_PRESSURE)
+
+    def get_degradation(self) -> Degradation | None:
+        level = self.get_pressure()
+        if level == 0:
+            return None
+        preset = PRESETS[
+            min(PRESETS.index(config.ffmpeg_preset) + level, len(PRESETS) - 1)
+        ]
+        # Leave the cores to the running encodes
+        encodes = sum(
+            1 for job in self.registry.get_running_jobs() if job.kind == 'software'
+        )
+        threads = max(1, (os.cpu_count() or 1) // max(encodes, 1))
+        return Degradation(
+            level=level,
+            preset=preset,
+            threads=threads,
+            max_width=DEGRADED_WIDTHS[level - 1],
+        )
+
+
+transcode_scheduler = TranscodeScheduler()
@@ -0,0 +1,26 @@
+import asyncio
+from collections.abc import Callable, Coroutine, Hashable
+from typing import Any
+
+
+class Coalescer[K: Hashable, V]:
+    """
+    Runs one call per key at a time, concurrent callers with the same key
+    share the result of the call that is already running.
+    """
+
+    def __init__(self) -> None:
+        self._running: dict[K, asyncio.Task[V]] = {}
+
+    async def run(self, key: K, func: Callable[[], Coroutine[Any, Any, V]]) -> V:
+        task = self._running.get(key)
+        if task is None:
+            task = asyncio.create_task(func())
+            self._running[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # A cancelled caller must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key: K, task: asyncio.Task[V]) -> None:
+        if self._running.get(key) is task:
+            del self._running[key]
@@ -0,0 +1,21 @@
+import sys
+from array import array
+from collections.abc import Iterable
+
+
+def pack_keyframes(keyframes: Iterable[int]) -> bytes:
+    """
+    Pack keyframe timestamps in microseconds as little endian int64 values.
+    """
+    data = array('q', keyframes)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def unpack_keyframes(data: bytes) -> array:
+    keyframes = array('q')
+    keyframes.frombytes(data)
+    if sys.byteorder == 'big':
+        keyframes.byteswap()
+    return keyframes
@@ -0,0 +1,136 @@
+import bisect
+import math
+from collections.abc import Callable, Iterator
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric:
+    """
+    A metric in the Prometheus text format.
+
+    The values are kept per label values, given in the order of `labels`.
+    Updating a value is a dict lookup so they can be left on in the hot paths.
+    """
+
+    TYPE = ''
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def label_string(self, values: tuple[str, ...], extra: str = '') -> str:
+        pairs = [
+            f'{name}="{escape_label(value)}"'
+            for name, value in zip(self.labels, values, strict=True)
+        ]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = [
+            f'# HELP {self.name} {self.help}',
+            f'# TYPE {self.name} {self.TYPE}',
+            *self.samples(),
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, value: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def get(self, *label_values: str) -> float:
+        return self.values.get(label_values, 0)
+
+    def samples(self) -> Iterator[str]:
+        for label_values, value in self.values.items():
+            yield f'{self.name}{self.label_string(label_values)} {format_value(value)}'
+
+
+class Gauge(Metric):
+    """
+    A gauge read from `func` when the metrics are rendered.
+    """
+
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, help: str, func: Callable[[], float]) -> None:
+        super().__init__(name, help)
+        self.func = func
+
+    def samples(self) -> Iterator[str]:
+        yield f'{self.name} {format_value(self.func())}'
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # The count of each bucket, not cumulative, with +Inf last
+        self.counts: dict[tuple[str, ...], list[int]] = {}
+        self.sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        counts = self.counts.get(label_values)
+        if counts is None:
+            counts = self.counts[label_values] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[label_values] = self.sums.get(label_values, 0) + value
+
+    def get_count(self, *label_values: str) -> int:
+        return sum(self.counts.get(label_values, ()))
+
+    def samples(self) -> Iterator[str]:
+        for label_values, counts in self.counts.items():
+            cumulative = 0
+            for bucket, count in zip((*self.buckets, math.inf), counts, strict=True):
+                cumulative += count
+                labels = self.label_string(label_values, f'le="{format_value(bucket)}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = self.label_string(label_values)
+            yield f'{self.name}_sum{labels} {format_value(self.sums[label_values])}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def register[M: Metric](self, metric: M) -> M:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return ''.join(metric.render() for metric in self.metrics)
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')